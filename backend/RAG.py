@@ -1,36 +1,38 @@
 from typing_extensions import Literal
 from pydantic import BaseModel, Field
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import HumanMessage
+from prompt_cache import system_message
+from langchain_core.runnables import RunnableConfig
 import os
 import uuid
-from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
-from langchain_anthropic import ChatAnthropic
-from langchain_deepseek import ChatDeepSeek
+import providers
 from langgraph.types import interrupt, Command
-from langgraph.func import entrypoint, task
-from langgraph.checkpoint.memory import MemorySaver
+from langgraph.func import entrypoint
+from checkpointers import get_checkpointer
 from parameter_recommendator import parameter_recommendation
-from online_search import online_search
+from online_search import online_search, normalize_query
 import json
 from datetime import datetime
 from result_logger import ResultLogger
+from tracing import traced_task, span, current_span
+from streaming import emit, stream_writer
+from tool_extrator import prefetch_tool_chunks, discard_tool_chunks
+from governor import invoke
+from hedging import hedged_invoke, hedge_model
+from model_tiers import model_for
+from singleflight import flights
+from metrics import serve_from_env
 
 ################################################################################################################################
-load_dotenv()
-openai_api_key = os.environ["OPENAI_API_KEY"]
+# the model used by every stage without a profile in model_tiers.json,
+# the OpenAI one of providers.py unless it is set, e.g. to a fake one in benchmark.py
+llm = None
 
-llm_openai = ChatOpenAI(
-        model="gpt-4o-2024-08-06",
-        temperature=0.7,
-        streaming=True
-    )
-
-llm_anthropic = ChatAnthropic(model="claude-3-7-sonnet-20250219",
-        temperature=0.3,)
+def get_llm(stage=None):
+    return model_for(stage) or llm or providers.get("openai")
 
-llm_deepseek = ChatDeepSeek(model="deepseek-chat",
-        temperature=1.0,)
+# the /metrics endpoint of the worker, when RAG_METRICS_PORT is set
+serve_from_env()
 
 ################################################################################################################################
 
@@ -46,11 +48,12 @@ class new_queries(BaseModel):
         None, description="The rewritten queries in a list"
     )
 
-@task
+@traced_task
 def rewrite_query(query: str) -> str:
-    new_q = llm.with_structured_output(new_queries).invoke(
+    model = get_llm("rewrite_query")
+    new_q = invoke(model.with_structured_output(new_queries),
         [
-            SystemMessage(content="""
+            system_message(model, """
             Please rewrite the query to be more specific and clear to improve retrieval effectiveness.
             If multiple parameters are requested in the original query, please split them into separate queries.
 
@@ -70,7 +73,8 @@ def rewrite_query(query: str) -> str:
                                   
             """),
             HumanMessage(content=query),
-        ]
+        ],
+        model,
     )
     return new_q.query
 ################################################################################################################################
@@ -89,27 +93,32 @@ class Route(BaseModel):
     )
 
 
-@task
+@traced_task
 def llm_call_router(query:str):
-    decision = llm.with_structured_output(Route).invoke(
-        [
-            SystemMessage(
-                content=f"Route the input to one of these types: {QUESTION_TYPES.__args__} based on the user's request."
-            ),
-            HumanMessage(content=query),
-        ]
-    )
+    def route(model):
+        return invoke(model.with_structured_output(Route),
+            [
+                system_message(
+                    model, f"Route the input to one of these types: {QUESTION_TYPES.__args__} based on the user's request."
+                ),
+                HumanMessage(content=query),
+            ],
+            model,
+        )
+    model = get_llm("llm_call_router")
+    decision = hedged_invoke("llm_call_router", route, model, hedge_model(model))
+    current_span().set(route=decision.step)
     return decision.step
                 
 # Create workflow
-@entrypoint(checkpointer=MemorySaver())
+@entrypoint(checkpointer=get_checkpointer())
 def router_workflow(query: str):
         
     next_step = llm_call_router(query).result()
     print(f"\n🎯 Router leads to: {next_step}\n")
     
     if next_step == "parameter_recommendation":
-        response = parameter_recommendation(llm,query).result()
+        response = parameter_recommendation(get_llm(),query).result()
         return response, True
 
     elif next_step == "document_extraction":
@@ -117,46 +126,83 @@ def router_workflow(query: str):
 
     elif next_step == "online_search":
         try:
-            return online_search(llm,query),True
+            return online_search(get_llm("online_search"),query),True
         except Exception as e:
             return "Error occurred in online search: " + str(e),False
 
     elif next_step == "unknown":
         return "Unknown question type: " + query
 ################################################################################################################################
-@entrypoint(checkpointer=MemorySaver())
-def RAG(query):
+def run_streaming(workflow, query, config):
+    """run a nested entrypoint once, forwarding its custom stream events to the running entrypoint"""
+    writer = stream_writer()
+    result = None
+    for mode, chunk in workflow.stream(query, config=config, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            writer(chunk)
+        else:
+            result = chunk
+    return result
+
+
+@entrypoint(checkpointer=get_checkpointer())
+def RAG(query, config: RunnableConfig):
     # initialize the result logger
-    logger = ResultLogger("rag_logs", llm_openai)
+    logger = ResultLogger("rag_logs", get_llm())
+    # the sub-queries run on the same thread as the RAG call
+    sub_config = {"configurable": {"thread_id": config["configurable"]["thread_id"]}}
 
     logger.add_result("Original Query", query)
-    # get the rewritten query list
-    queries = rewrite_query(query).result()
-    logger.add_result("Rewritten Queries", queries)  # record the rewritten queries
-    
-    # process each query
-    for each_query in queries:
-        try:
-            # execute the processing workflow
-            workflow_result, is_successful = router_workflow.invoke(each_query, config=config)
-            
-            # store the results
-            logger.add_result(each_query, {
-                "result": workflow_result,
-                "is_successful": is_successful
-            })
-            
-            if not is_successful:
-                print(f"\n⚠️ warning: unable to get a valid response for the query: {each_query}")
-                continue
-                
-        except Exception as e:
-            print(f"\n⚠️ warning: error occurred when processing the query: {each_query}: {str(e)}")
-            logger.add_result(each_query, {
-                "result": str(e),
-                "is_successful": False
-            })
-            continue
+
+    with span("rag", query=query) as root:
+        # get the rewritten query list
+        queries = rewrite_query(query).result()
+        logger.add_result("Rewritten Queries", queries)  # record the rewritten queries
+
+        # the tool retrieval only needs the query text, start it while the queries are routed
+        for each_query in queries:
+            prefetch_tool_chunks(each_query)
+
+        # process each query
+        for each_query in queries:
+            with span("sub_query", query=each_query) as sub_span:
+                emit("sub_query", query=each_query)
+                try:
+                    # execute the processing workflow, its streamed events are passed on to the caller;
+                    # the same sub-query in flight (or just answered) is not run twice
+                    (workflow_result, is_successful), shared = flights["sub_query"].do(
+                        normalize_query(each_query), run_streaming, router_workflow, each_query, sub_config)
+                    if shared:
+                        sub_span.set(coalesced=True)
+                        if hasattr(workflow_result, "model_dump"):
+                            emit("answer", query=each_query, answer=workflow_result.model_dump())
+
+                    # store the results
+                    logger.add_result(each_query, {
+                        "result": workflow_result,
+                        "is_successful": is_successful
+                    })
+                    sub_span.set(is_successful=is_successful)
+
+                    if not is_successful:
+                        print(f"\n⚠️ warning: unable to get a valid response for the query: {each_query}")
+                        continue
+
+                except Exception as e:
+                    print(f"\n⚠️ warning: error occurred when processing the query: {each_query}: {str(e)}")
+                    logger.add_result(each_query, {
+                        "result": str(e),
+                        "is_successful": False
+                    })
+                    sub_span.set(is_successful=False)
+                    continue
+
+                finally:
+                    # unused when the router took another path
+                    discard_tool_chunks(each_query)
+
+    # record the stage timings and token usage
+    logger.add_spans(root.to_dict())
 
     # save all results
     logger.save_results()
@@ -225,14 +271,16 @@ if __name__ == "__main__":
     config = {"configurable": {"thread_id": thread_id}}
     
     query = get_valid_query()
-    llm = llm_openai
-    
-    # get the complete results
-    results = RAG.invoke(query, config)
-    
-    # display the streaming output
-    for step in RAG.stream(query, config, stream_mode="updates"):
-        for _, event in step.items():
+
+    # a single run, the answer fields are printed as they are generated
+    for mode, event in RAG.stream(query, config, stream_mode=["custom", "updates"]):
+        if mode == "custom" and event["event"] == "sub_query":
+            print(f"\n📡 Streaming the answer to: {event['query']}")
+        elif mode == "custom" and event["event"] == "answer_delta":
+            print(event["delta"], end="", flush=True)
+        elif mode == "custom" and event["event"] == "answer":
+            print()
+        elif mode == "updates":
             print(event)
 
 
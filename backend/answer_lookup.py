@@ -0,0 +1,156 @@
+import os
+import re
+import json
+import threading
+import snapshot
+
+# the precomputed answers written by precompute.py
+ANSWER_LOOKUP_PATH = os.path.join("backend", "mappings", "answer_lookup.json")
+
+# the catalogued values, same as the ones listed in the prompts
+TOOL_GRADES = ["HM Carbide", "D10", "D20", "D60", "Cermet", "PKD/PCD"]
+OPERATIONS = ["turning", "milling", "drilling"]
+PARAMETERS = ["cutting speed", "feed rate", "cutting depth"]
+
+# the Answer fields, stored as a list in this order to keep the file compact
+ANSWER_FIELDS = ["questioned_parameter", "tool_range", "metal_range", "combined_range", "thoughts"]
+
+PARAMETER_ALIASES = {
+    "cutting speed": ["cutting speed", "cut speed", "speed", "vc", "v_c"],
+    "feed rate": ["feed rate", "feed", "fc", "f_c"],
+    "cutting depth": ["cutting depth", "cut depth", "depth of cut", "depth", "ap", "a_p"],
+}
+
+OPERATION_STEMS = {
+    "turning": ["turn", "lathe"],
+    "milling": ["mill"],
+    "drilling": ["drill"],
+}
+
+_lock = threading.Lock()
+_cache = {"path": None, "mtime": None, "answers": {}}
+
+
+def normalize(text) -> str:
+    """lower-case the text and collapse the whitespaces"""
+    return " ".join(str(text or "").lower().split())
+
+
+def canonical_tool(tool):
+    """map the extracted tool name (e.g. "D10 carbide tool") to a catalogued tool grade"""
+    tool_norm = normalize(tool)
+    for grade in TOOL_GRADES:
+        grade_norm = normalize(grade)
+        if tool_norm == grade_norm or re.search(rf"(?<![\w/]){re.escape(grade_norm)}(?![\w/])", tool_norm):
+            return grade
+    return None
+
+
+def canonical_operation(operation):
+    """map the extracted operation (e.g. "turn") to a catalogued operation"""
+    operation_norm = normalize(operation)
+    for name, stems in OPERATION_STEMS.items():
+        if any(operation_norm.startswith(stem) for stem in stems):
+            return name
+    return None
+
+
+def canonical_parameter(parameter):
+    """map the questioned parameter (e.g. "cut speed") to a catalogued parameter"""
+    parameter_norm = normalize(parameter)
+    # the longest aliases first, so that "cutting speed" is not taken as "speed"
+    aliases = sorted(
+        ((alias, name) for name, names in PARAMETER_ALIASES.items() for alias in names),
+        key=lambda item: -len(item[0]),
+    )
+    for alias, name in aliases:
+        if parameter_norm == alias:
+            return name
+    for alias, name in aliases:
+        if len(alias) > 3 and alias in parameter_norm:
+            return name
+    return None
+
+
+def single_parameter(parameters):
+    """
+    the catalogued parameter of the questioned parameters (e.g. "cut speed"), None unless they name
+    exactly one: "feed rate and cutting speed" must not be answered with the cutting speed cell
+    """
+    found = {canonical_parameter(part) for part in re.split(r",|;|/|\band\b", str(parameters or ""), flags=re.I)}
+    found.discard(None)
+    return found.pop() if len(found) == 1 else None
+
+
+def make_key(tool, metal, operation, parameter):
+    """
+    build the lookup key of a (tool, metal, operation, parameter) cell.
+    return None if any of the factors is not catalogued or more than one parameter is questioned.
+    """
+    tool = canonical_tool(tool)
+    operation = canonical_operation(operation)
+    parameter = single_parameter(parameter)
+    metal = normalize(metal)
+    if not (tool and operation and parameter and metal):
+        return None
+    return "|".join([normalize(tool), metal, operation, parameter])
+
+
+def answer_to_row(answer) -> list:
+    """convert an Answer (or its dict) to the compact row stored in the lookup file"""
+    data = answer.model_dump() if hasattr(answer, "model_dump") else dict(answer)
+    return [data.get(field) for field in ANSWER_FIELDS]
+
+
+def read_answer_lookup(path=ANSWER_LOOKUP_PATH) -> dict:
+    """parse the lookup file, {key: answer dict}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    fields = data.get("fields", ANSWER_FIELDS)
+    return {
+        key: dict(zip(fields, row))
+        for key, row in data.get("answers", {}).items()
+    }
+
+
+def load_answer_lookup(path=ANSWER_LOOKUP_PATH) -> dict:
+    """load the lookup file (or its fresh snapshot), it is only re-read when the file changed on disk"""
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    answers = snapshot.load("answer_lookup", path)
+    if answers is not None:
+        return answers
+
+    with _lock:
+        if _cache["path"] == path and _cache["mtime"] == mtime:
+            return _cache["answers"]
+        answers = read_answer_lookup(path)
+        _cache.update(path=path, mtime=mtime, answers=answers)
+        return answers
+
+
+def lookup_answer(tool, metal, operation, parameter, path=ANSWER_LOOKUP_PATH):
+    """return the precomputed answer as a dict, None if the cell is not precomputed"""
+    key = make_key(tool, metal, operation, parameter)
+    if key is None:
+        return None
+    return load_answer_lookup(path).get(key)
+
+
+def save_answer_lookup(rows: dict, path=ANSWER_LOOKUP_PATH):
+    """
+    write the lookup file atomically.
+    :param rows: {key: row} where row is built by answer_to_row()
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = {
+        "version": 1,
+        "fields": ANSWER_FIELDS,
+        "answers": dict(sorted(rows.items())),
+    }
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
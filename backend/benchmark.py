@@ -0,0 +1,311 @@
+"""
+Offline benchmark of the RAG pipeline.
+
+Replays a query set through the RAG entrypoint with the fake chat models,
+embeddings and search client of fakes.py, in a throw-away workspace with a
+small metal/tool corpus. Reports the throughput, the p50/p95/p99 latency of
+every stage (from the tracing.py spans) and the LLM calls per query.
+
+Usage (from the project root):
+    python backend/benchmark.py --queries "rag_logs/*.jsonl" --repeat 5 --concurrency 4
+    python backend/benchmark.py --llm-latency-ms 800 --llm-sigma 0.6 --output bench.json
+"""
+import os
+import sys
+import glob
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+from langchain_core.vectorstores import InMemoryVectorStore
+
+# the JSONL run logs of result_logger.py and the legacy one-JSON-per-run logs
+DEFAULT_QUERY_PATTERNS = [os.path.join("rag_logs", "*.jsonl"), os.path.join("rag_logs", "*.json")]
+DEFAULT_QUERIES = [
+    "I wanna turn 1.4125 with D10, cutting speed?",
+    "I wanna turn 1.4125 with D60, cut speed? cut depth?",
+    "What feed rate should I use for milling CCR-1150 with HM Carbide?",
+    "Cutting speed and feed rate for drilling 1.4598 with Cermet?",
+    "What is the melting point of titanium?",
+]
+
+FIXTURE_METALS = {
+    "CHRONIFER M-17C": {
+        "aliases": ["1.4125", "AISI 440C", "X105CrMo17", "SUS440C"],
+        "doc_path": os.path.join("backend", "markdowns", "Klein_Metals", "1.4125.md"),
+    },
+    "CCR-1150": {
+        "aliases": ["CCR1150", "CCR 1150"],
+        "doc_path": os.path.join("backend", "markdowns", "Klein_Metals", "CCR-1150.md"),
+    },
+    "AISI 316L DECOLLETAGE": {
+        "aliases": ["1.4598", "316L"],
+        "doc_path": os.path.join("backend", "markdowns", "Klein_Metals", "1.4598.md"),
+    },
+}
+
+FIXTURE_TABLES = [
+    {"table_id": 0, "summary": "Cutting speeds for steels.", "original_table": "<table><tr><td>D10</td><td>60-120</td></tr></table>"},
+]
+
+
+def fixture_tool_chunks():
+    """the chunks of the fake tool document"""
+    chunks = []
+    for tool in ["HM Carbide", "D10", "D20", "D60", "Cermet", "PKD/PCD"]:
+        for operation in ["turning", "milling", "drilling"]:
+            chunks.append(
+                f"{tool} grades for {operation}: recommended cutting speed, feed rate and cutting depth "
+                f"for steel, stainless steel and cast iron. " + "Application notes. " * 20
+            )
+    chunks.append("__TABLE0__:The table lists cutting speeds for D10 on steels.")
+    return chunks
+
+
+def create_workspace(root):
+    """write the metal mappings, metal documents and table mappings under root/backend"""
+    os.makedirs(os.path.join(root, "backend", "mappings"), exist_ok=True)
+    with open(os.path.join(root, "backend", "mappings", "metal_mappings.json"), "w", encoding="utf-8") as f:
+        json.dump(FIXTURE_METALS, f)
+    with open(os.path.join(root, "backend", "mappings", "table_mappings.json"), "w", encoding="utf-8") as f:
+        json.dump(FIXTURE_TABLES, f)
+    for name, info in FIXTURE_METALS.items():
+        path = os.path.join(root, info["doc_path"])
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"# {name}\n\nMachinability: fair. Cutting speed 20-30 m/min.\n" + "Composition and properties. " * 200)
+
+
+def load_queries(patterns):
+    """
+    read the queries ("Original Query") from the rag_logs/experiment JSON files and JSONL run logs, from .jsonl
+    query files ({"query": ...} lines) or .txt files (one query per line)
+    """
+    queries = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            if path.endswith(".json"):
+                with open(path, "r", encoding="utf-8") as f:
+                    query = json.load(f).get("Original Query")
+                if query:
+                    queries.append(query)
+            elif path.endswith(".jsonl"):
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        # a run log record {"run_id", "seq", "ts", "step", "data"} or a query line {"query": ...}
+                        query = record.get("data") if record.get("step") == "Original Query" else record.get("query")
+                        if query:
+                            queries.append(query)
+            else:
+                with open(path, "r", encoding="utf-8") as f:
+                    queries.extend(line.strip() for line in f if line.strip())
+    return queries
+
+
+def percentile(values, p):
+    """nearest-rank percentile"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+class SpanCollector:
+    """tracing exporter which keeps the finished root spans"""
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+def walk(span):
+    yield span
+    for child in span.children:
+        yield from walk(child)
+
+
+def install_fakes(args):
+    """replace every external backend with the fakes of fakes.py"""
+    import RAG
+    import providers
+    from online_search import search_layer
+    from fakes import FakeChatModel, FakeEmbeddings, FakeSearchClient, LatencyModel
+
+    llm_latency = LatencyModel(args.llm_latency_ms, kind=args.latency_kind, sigma=args.llm_sigma, seed=args.seed)
+    RAG.llm = FakeChatModel("fake-primary", llm_latency, accept_rate=args.accept_rate, seed=args.seed,
+                            error_rate=args.llm_error_rate)
+    providers.override("rater_fallback", FakeChatModel("fake-fallback", llm_latency, accept_rate=args.accept_rate,
+                                                       seed=args.seed, error_rate=args.llm_error_rate))
+    # the secondary model of the hedged requests, same latency distribution but independent draws
+    providers.override("hedge", FakeChatModel("fake-hedge", llm_latency, accept_rate=args.accept_rate,
+                                              seed=args.seed, error_rate=args.llm_error_rate))
+    if args.no_hedge:
+        os.environ["RAG_HEDGE"] = "0"
+    if args.no_coalesce:
+        os.environ["RAG_SINGLEFLIGHT"] = "0"
+
+    embeddings = FakeEmbeddings(latency=LatencyModel(args.embedding_latency_ms, kind="fixed"))
+    providers.override("embeddings", embeddings)
+
+    def vectorstore_factory(persist_directory, collection_name):
+        vectorstore = InMemoryVectorStore(embedding=embeddings)
+        vectorstore.add_documents([Document(page_content=chunk) for chunk in fixture_tool_chunks()])
+        return vectorstore
+    providers.override("vectorstore_factory", vectorstore_factory)
+
+    search_layer.set_client(FakeSearchClient(latency=LatencyModel(args.search_latency_ms, kind="fixed")))
+    return RAG
+
+
+def run_benchmark(args):
+    queries = load_queries(args.queries) or DEFAULT_QUERIES
+    queries = queries * args.repeat
+
+    workspace = tempfile.mkdtemp(prefix="rag-benchmark-")
+    create_workspace(workspace)
+    os.chdir(workspace)
+
+    import tracing
+    RAG = install_fakes(args)
+    collector = SpanCollector()
+    tracing.add_exporter(collector)
+
+    def run(query):
+        start = time.perf_counter()
+        RAG.RAG.invoke(query, {"configurable": {"thread_id": str(uuid.uuid4())}})
+        return (time.perf_counter() - start) * 1000
+
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output), ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(run, queries))
+    elapsed = time.perf_counter() - start
+
+    report = build_report(queries, latencies, elapsed, collector.spans, args)
+    from governor import governor
+    from hedging import hedge_stats
+    from singleflight import flight_stats
+    report["providers"] = governor.utilization()
+    report["hedging"] = hedge_stats()
+    report["coalescing"] = flight_stats()
+    return report
+
+
+def build_report(queries, latencies, elapsed, root_spans, args):
+    stages = {}
+    llm_calls = []
+    tokens = []
+    input_tokens = cache_read_tokens = 0
+    for root in root_spans:
+        spans = list(walk(root))
+        llm_calls.append(sum(span.llm_calls for span in spans))
+        tokens.append(sum(span.input_tokens + span.output_tokens for span in spans))
+        input_tokens += sum(span.input_tokens for span in spans)
+        cache_read_tokens += sum(span.cache_read_tokens for span in spans)
+        for span in spans:
+            # a discarded speculative retrieval may still run when its root span is exported
+            if span.wall_ms is None:
+                continue
+            stage = stages.setdefault(span.name, {"wall_ms": [], "wait_ms": [], "llm_calls": 0})
+            stage["wall_ms"].append(span.wall_ms)
+            stage["wait_ms"].append(span.wait_ms)
+            stage["llm_calls"] += span.llm_calls
+
+    return {
+        "queries": len(queries),
+        "concurrency": args.concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_qps": round(len(queries) / elapsed, 3) if elapsed else None,
+        "latency_ms": {f"p{p}": round(percentile(latencies, p), 3) for p in (50, 95, 99)},
+        "llm_calls_per_query": {
+            "mean": round(sum(llm_calls) / len(llm_calls), 3) if llm_calls else 0,
+            "max": max(llm_calls, default=0),
+        },
+        "tokens_per_query": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+        "cache_read_share": round(cache_read_tokens / input_tokens, 3) if input_tokens else 0,
+        "stages": {
+            name: {
+                "count": len(stage["wall_ms"]),
+                **{f"p{p}_ms": round(percentile(stage["wall_ms"], p), 3) for p in (50, 95, 99)},
+                "mean_wait_ms": round(sum(stage["wait_ms"]) / len(stage["wait_ms"]), 3),
+                "llm_calls": stage["llm_calls"],
+            }
+            for name, stage in sorted(stages.items())
+        },
+    }
+
+
+def print_report(report):
+    print(f"\n📊 {report['queries']} queries, concurrency {report['concurrency']}, "
+          f"{report['elapsed_s']} s, {report['throughput_qps']} queries/s")
+    print(f"   end-to-end latency: {report['latency_ms']}")
+    print(f"   LLM calls per query: {report['llm_calls_per_query']}, tokens per query: {report['tokens_per_query']}, "
+          f"prompt cache reads: {report['cache_read_share']:.1%} of the input tokens\n")
+    print(f"{'stage':<28}{'count':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'wait ms':>10}{'LLM':>7}")
+    for name, stage in report["stages"].items():
+        print(f"{name:<28}{stage['count']:>7}{stage['p50_ms']:>11.1f}{stage['p95_ms']:>11.1f}"
+              f"{stage['p99_ms']:>11.1f}{stage['mean_wait_ms']:>10.1f}{stage['llm_calls']:>7}")
+    if report.get("providers"):
+        print(f"\n{'provider':<14}{'calls':>7}{'limit':>8}{'req/min':>9}{'tok/min':>10}{'429':>6}{'retries':>9}{'wait ms':>10}")
+        for name, provider in report["providers"].items():
+            print(f"{name:<14}{provider['calls']:>7}{provider['concurrency_limit']:>8.1f}{provider['requests_per_min']:>9}"
+                  f"{provider['tokens_per_min']:>10}{provider['throttled']:>6}{provider['retries']:>9}{provider['wait_ms']:>10.1f}")
+    if report.get("hedging"):
+        print(f"\n{'hedged stage':<28}{'calls':>7}{'hedged':>8}{'rate':>7}{'2nd won':>9}{'failover':>10}{'delay ms':>10}")
+        for name, stage in report["hedging"].items():
+            print(f"{name:<28}{stage['calls']:>7}{stage['hedged']:>8}{stage['hedge_rate']:>7.1%}"
+                  f"{stage['secondary_wins']:>9}{stage['failovers']:>10}{stage['delay_ms']:>10.1f}")
+    if report.get("coalescing"):
+        print(f"\n{'coalesced level':<28}{'calls':>7}{'executed':>10}{'shared':>8}{'saved':>8}{'errors':>8}")
+        for name, level in report["coalescing"].items():
+            print(f"{name:<28}{level['calls']:>7}{level['executed']:>10}{level['shared']:>8}"
+                  f"{level['saved_rate']:>8.1%}{level['errors']:>8}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the RAG pipeline with fake backends.")
+    parser.add_argument("--queries", nargs="+", default=DEFAULT_QUERY_PATTERNS,
+                        help="glob patterns of .jsonl / .json run logs, .jsonl or .txt query files")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--llm-sigma", type=float, default=0.5)
+    parser.add_argument("--latency-kind", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--embedding-latency-ms", type=float, default=30)
+    parser.add_argument("--search-latency-ms", type=float, default=500)
+    parser.add_argument("--accept-rate", type=float, default=0.6)
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="share of fake LLM calls answered with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-hedge", action="store_true", help="no hedged requests (RAG_HEDGE=0)")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="run every repeated query in full (RAG_SINGLEFLIGHT=0)")
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own prints")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+    # resolve the paths before moving into the benchmark workspace
+    args.queries = [os.path.abspath(pattern) for pattern in args.queries]
+    output = os.path.abspath(args.output) if args.output else None
+
+    report = run_benchmark(args)
+    print_report(report)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"\n💾 Report saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
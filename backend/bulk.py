@@ -0,0 +1,693 @@
+"""
+Offline bulk recommendations for job lists exported from the CAM system.
+
+Reads a CSV or JSONL file of (tool, metal, operation, parameter) lines (any
+other column is copied to the output) and answers them like
+parameter_recommendation, but with the provider batch APIs instead of one
+synchronous call per stage:
+
+  1. local work up front: the metals are matched once per name, the lines
+     found in the precomputed answer lookup are answered from it, and the
+     tool chunks are retrieved once per (tool, operation, parameter) from the
+     catalog collections of the tool and operation (catalog.py); the rating
+     prompt ignores the metal, so the retrieval query leaves it out
+  2. batch "rating": every retrieved chunk is rated once
+  3. batch "rating_fallback": the chunks judged "not relevant" get the
+     second opinion of the fallback model, as in rater.rating
+  4. batch "answer": one recommendation per remaining line
+  5. the results are written at once to a CSV or JSONL file
+
+The stage models are the profiles of model_tiers.json ("rating", "answer"),
+DEFAULT_PROFILES otherwise. OpenAI and Anthropic requests go to their batch
+APIs; --local runs every batch with the fake models of fakes.py in a
+background thread and retrieves with the fake embeddings from in-memory
+stores of the benchmark.py tool chunks instead of the vector DBs, to test a
+run without provider calls.
+
+All state is kept in the work directory (backend/bulk_runs/<input name> by
+default): the prepared lines, the retrieved chunks, the submitted batch ids
+and the collected results. An interrupted run started again skips the local
+work, polls the batches it already submitted and only submits what is left.
+The local work is tied to the SHA-256 of the input file: a changed input is
+prepared again, or refused once batches of the old one were submitted.
+
+Usage (from the project root):
+    python backend/bulk.py jobs.csv
+    python backend/bulk.py jobs.jsonl --output results.jsonl --poll-interval 60
+    python backend/bulk.py jobs.csv --no-wait      # submit the next stage and exit, run again later
+    python backend/bulk.py jobs.csv --local        # the local batch stand-in and fake retrieval, no provider calls
+"""
+import os
+import io
+import csv
+import json
+import time
+import uuid
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from pydantic import BaseModel
+from dotenv import load_dotenv
+from langgraph.func import entrypoint
+from answer_lookup import ANSWER_FIELDS, lookup_answer
+from metal_extractor import fuzzy_match_metal
+from model_tiers import ModelProfile, profile_for
+from parameter_recommendator import ANSWER_PROMPT, Answer
+from prompt_cache import CACHE_CONTROL
+from rater import RATING_PROMPT, Feedback
+from reference_packer import pack_references
+from tool_extrator import retrieve_tool_chunks
+
+WORKDIR_ROOT = os.path.join("backend", "bulk_runs")
+INPUT_FIELDS = ["tool", "metal", "operation", "parameter"]
+OUTPUT_FIELDS = ["metal_match", "source", *ANSWER_FIELDS, "error"]
+SCHEMAS = {"Feedback": Feedback, "Answer": Answer}
+# the models of the interactive path (providers.py)
+DEFAULT_PROFILES = {
+    "rating": ModelProfile(provider="openai", model="gpt-4o-2024-08-06", temperature=0.7),
+    "rating_fallback": ModelProfile(provider="anthropic", model="claude-3-5-haiku-20241022"),
+    "answer": ModelProfile(provider="openai", model="gpt-4o-2024-08-06", temperature=0.7),
+}
+# requests per submitted batch, below the limits of both providers
+MAX_BATCH = 10000
+# encoded bytes per submitted batch, with a margin below the 200 MB batch file of OpenAI
+# and the 256 MB request of Anthropic (an answer request with its references is ~100 KB)
+OPENAI_MAX_BYTES = 190_000_000
+ANTHROPIC_MAX_BYTES = 240_000_000
+POLL_INTERVAL = 30.0
+
+
+class BatchRequest(BaseModel):
+    custom_id: str
+    profile: ModelProfile
+    system: str
+    # the part of the user message shared across requests (the metal document), sent first
+    cached: str = ""
+    user: str
+    schema_name: str
+
+    def user_text(self) -> str:
+        return f"{self.cached}\n\n{self.user}" if self.cached else self.user
+
+    def json_schema(self) -> dict:
+        return SCHEMAS[self.schema_name].model_json_schema()
+
+
+class BatchClient:
+    """
+    the batch API of a provider.
+    submit() returns the batch id, poll() "running" or "done", results() {custom_id: {"output": dict} or {"error": str}}
+    a submitted batch holds at most max_bytes of encoded requests (encoded_size()), None for no limit
+    """
+    max_bytes = None
+
+    def encoded_size(self, request: BatchRequest) -> int:
+        return len(request.model_dump_json().encode("utf-8"))
+
+    def submit(self, requests: list[BatchRequest]) -> str:
+        raise NotImplementedError
+
+    def poll(self, batch_id: str) -> str:
+        raise NotImplementedError
+
+    def results(self, batch_id: str) -> dict:
+        raise NotImplementedError
+
+
+class OpenAIBatchClient(BatchClient):
+    """the OpenAI Batch API on /v1/chat/completions, structured outputs with a JSON schema response format"""
+    ENDED = ("completed", "failed", "expired", "cancelled")
+    max_bytes = OPENAI_MAX_BYTES
+
+    def __init__(self):
+        from openai import OpenAI
+        self.client = OpenAI()
+
+    def line(self, request: BatchRequest) -> str:
+        return json.dumps({"custom_id": request.custom_id, "method": "POST", "url": "/v1/chat/completions",
+                           "body": self.body(request)}, ensure_ascii=False)
+
+    def encoded_size(self, request):
+        return len(self.line(request).encode("utf-8")) + 1
+
+    @staticmethod
+    def body(request: BatchRequest) -> dict:
+        profile = request.profile
+        body = {
+            "model": profile.model,
+            "messages": [
+                {"role": "system", "content": request.system},
+                {"role": "user", "content": request.user_text()},
+            ],
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": request.schema_name, "schema": request.json_schema()},
+            },
+        }
+        if profile.temperature is not None:
+            body["temperature"] = profile.temperature
+        if profile.max_tokens is not None:
+            body["max_tokens"] = profile.max_tokens
+        return body
+
+    def submit(self, requests):
+        lines = [self.line(request) for request in requests]
+        batch_file = self.client.files.create(file=("batch.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch")
+        batch = self.client.batches.create(input_file_id=batch_file.id, endpoint="/v1/chat/completions",
+                                           completion_window="24h")
+        return batch.id
+
+    def poll(self, batch_id):
+        return "done" if self.client.batches.retrieve(batch_id).status in self.ENDED else "running"
+
+    def results(self, batch_id):
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        # an expired or cancelled batch still has the output of its finished requests
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get("response") or {}
+                if record.get("error") or response.get("status_code") != 200:
+                    results[record["custom_id"]] = {"error": str(record.get("error") or response.get("body"))}
+                    continue
+                content = response["body"]["choices"][0]["message"]["content"]
+                try:
+                    results[record["custom_id"]] = {"output": json.loads(content)}
+                except (TypeError, json.JSONDecodeError):
+                    results[record["custom_id"]] = {"error": f"invalid JSON output: {str(content)[:200]}"}
+        if batch.status == "failed" and not results:
+            print(f"⚠️ warning: batch {batch_id} failed: {batch.errors}")
+        return results
+
+
+class AnthropicBatchClient(BatchClient):
+    """the Anthropic Message Batches API, structured outputs as a forced tool call"""
+    max_bytes = ANTHROPIC_MAX_BYTES
+
+    def __init__(self):
+        from anthropic import Anthropic
+        self.client = Anthropic()
+
+    def encoded_size(self, request):
+        # the entry of the requests list in the JSON body, with its separator
+        return len(json.dumps({"custom_id": request.custom_id, "params": self.params(request)},
+                              ensure_ascii=False).encode("utf-8")) + 2
+
+    @staticmethod
+    def params(request: BatchRequest) -> dict:
+        profile = request.profile
+        # the static prefix is a cache breakpoint, as in prompt_cache.py
+        content = [{"type": "text", "text": request.user}]
+        if request.cached:
+            content.insert(0, {"type": "text", "text": request.cached, "cache_control": CACHE_CONTROL})
+        params = {
+            "model": profile.model,
+            "max_tokens": profile.max_tokens or 1024,
+            "system": [{"type": "text", "text": request.system, "cache_control": CACHE_CONTROL}],
+            "messages": [{"role": "user", "content": content}],
+            "tools": [{"name": request.schema_name, "input_schema": request.json_schema()}],
+            "tool_choice": {"type": "tool", "name": request.schema_name},
+        }
+        if profile.temperature is not None:
+            params["temperature"] = profile.temperature
+        return params
+
+    def submit(self, requests):
+        batch = self.client.messages.batches.create(
+            requests=[{"custom_id": request.custom_id, "params": self.params(request)} for request in requests]
+        )
+        return batch.id
+
+    def poll(self, batch_id):
+        return "done" if self.client.messages.batches.retrieve(batch_id).processing_status == "ended" else "running"
+
+    def results(self, batch_id):
+        results = {}
+        for entry in self.client.messages.batches.results(batch_id):
+            if entry.result.type != "succeeded":
+                results[entry.custom_id] = {"error": entry.result.type}
+                continue
+            tool_use = next((block for block in entry.result.message.content if block.type == "tool_use"), None)
+            results[entry.custom_id] = {"output": tool_use.input} if tool_use else {"error": "no tool call in the output"}
+        return results
+
+
+class LocalBatchClient(BatchClient):
+    """
+    stand-in of a batch API: every batch is run in a background thread with a chat model (the fakes by default).
+    the batches are files in directory, a batch left unfinished by a restart is continued on the next poll().
+    """
+    def __init__(self, directory: str, model_factory=None, workers: int = 4):
+        self.directory = directory
+        self.model_factory = model_factory or self.fake_model
+        self.workers = workers
+        self._models = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def fake_model(profile: ModelProfile):
+        from fakes import FakeChatModel
+        return FakeChatModel(profile.model)
+
+    def _path(self, batch_id, kind):
+        return os.path.join(self.directory, f"{batch_id}.{kind}.jsonl")
+
+    def _model(self, profile: ModelProfile):
+        key = profile.model_dump_json()
+        with self._lock:
+            if key not in self._models:
+                self._models[key] = self.model_factory(profile)
+            return self._models[key]
+
+    def _answer(self, request: BatchRequest) -> dict:
+        from langchain_core.messages import HumanMessage, SystemMessage
+        from governor import invoke
+        model = self._model(request.profile)
+        result = invoke(model.with_structured_output(SCHEMAS[request.schema_name]),
+                        [SystemMessage(content=request.system), HumanMessage(content=request.user_text())],
+                        model)
+        return {"output": result.model_dump() if hasattr(result, "model_dump") else dict(result)}
+
+    def _run(self, batch_id):
+        requests = _read_jsonl(self._path(batch_id, "input"))
+        done = {record["custom_id"] for record in _read_jsonl(self._path(batch_id, "output"))}
+        pending = [BatchRequest.model_validate(request) for request in requests if request["custom_id"] not in done]
+        write_lock = threading.Lock()
+
+        def run(request):
+            try:
+                record = self._answer(request)
+            except Exception as e:
+                record = {"error": str(e)}
+            with write_lock, open(self._path(batch_id, "output"), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"custom_id": request.custom_id, **record}, ensure_ascii=False) + "\n")
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(run, pending))
+
+    def _start(self, batch_id):
+        thread = threading.Thread(target=self._run, args=(batch_id,), daemon=True)
+        self._threads[batch_id] = thread
+        thread.start()
+
+    def submit(self, requests):
+        batch_id = f"local-{uuid.uuid4().hex[:12]}"
+        with open(self._path(batch_id, "input"), "w", encoding="utf-8") as f:
+            for request in requests:
+                f.write(request.model_dump_json() + "\n")
+        self._start(batch_id)
+        return batch_id
+
+    def poll(self, batch_id):
+        total = len(_read_jsonl(self._path(batch_id, "input")))
+        if len({record["custom_id"] for record in _read_jsonl(self._path(batch_id, "output"))}) >= total:
+            return "done"
+        thread = self._threads.get(batch_id)
+        if thread is None or not thread.is_alive():
+            self._start(batch_id)
+        return "running"
+
+    def results(self, batch_id):
+        return {record.pop("custom_id"): record for record in _read_jsonl(self._path(batch_id, "output"))}
+
+
+def install_local_retrieval():
+    """--local: the fake embeddings and, per collection, an in-memory store of the benchmark.py tool chunks"""
+    import providers
+    from langchain_core.documents import Document
+    from langchain_core.vectorstores import InMemoryVectorStore
+    from benchmark import fixture_tool_chunks
+    from fakes import FakeEmbeddings
+
+    embeddings = FakeEmbeddings()
+    providers.override("embeddings", embeddings)
+
+    def vectorstore_factory(persist_directory, collection_name):
+        vectorstore = InMemoryVectorStore(embedding=embeddings)
+        vectorstore.add_documents([Document(page_content=chunk) for chunk in fixture_tool_chunks()])
+        return vectorstore
+    providers.override("vectorstore_factory", vectorstore_factory)
+
+
+def client_for(provider: str, local: Optional[LocalBatchClient] = None) -> BatchClient:
+    if local is not None:
+        return local
+    if provider == "openai":
+        return OpenAIBatchClient()
+    if provider == "anthropic":
+        return AnthropicBatchClient()
+    raise ValueError(f"{provider} has no batch API, give the stage an OpenAI or Anthropic profile in model_tiers.json")
+
+
+def stage_profile(stage: str) -> ModelProfile:
+    return (profile_for(stage) if stage != "rating_fallback" else None) or DEFAULT_PROFILES[stage]
+
+
+def _read_jsonl(path) -> list:
+    """the records of a JSONL file, the last line may be cut off by an interruption"""
+    records = []
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return records
+
+
+def _append_jsonl(path, records):
+    with open(path, "a", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def read_jobs(path) -> list[dict]:
+    """the lines of a CSV (with a header) or JSONL job file"""
+    if path.endswith(".jsonl"):
+        jobs = _read_jsonl(path)
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            jobs = list(csv.DictReader(f))
+    missing = [field for field in INPUT_FIELDS if jobs and field not in jobs[0]]
+    if missing:
+        raise ValueError(f"{path} misses the columns {missing}, expected {INPUT_FIELDS}")
+    return jobs
+
+
+def retrieval_query(tool, operation, parameter) -> str:
+    return f"What's the {parameter} for {operation} with {tool} tool?"
+
+
+def retrieval_key(query: str) -> str:
+    return hashlib.sha1(query.encode("utf-8")).hexdigest()[:16]
+
+
+@entrypoint()
+def match_metal(metal: str):
+    return fuzzy_match_metal(metal).result()
+
+
+def input_digest(input_path) -> str:
+    sha256 = hashlib.sha256()
+    with open(input_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def prepare(input_path, workdir, workers=8):
+    """
+    the local work of every line, done once per work directory and input file.
+    the prepared lines are only reused for the same input (SHA-256); a changed input is prepared again,
+    unless batches were already submitted for the old one: their answer-<line> ids would no longer match.
+    :return: (lines, chunks) where chunks is {retrieval key: {"query": ..., "chunks": [...]}}
+    """
+    lines_path = os.path.join(workdir, "lines.jsonl")
+    chunks_path = os.path.join(workdir, "chunks.json")
+    input_record_path = os.path.join(workdir, "input.json")
+    digest = input_digest(input_path)
+    prepared = None
+    if os.path.exists(input_record_path):
+        with open(input_record_path, "r", encoding="utf-8") as f:
+            prepared = json.load(f).get("sha256")
+    if prepared == digest and os.path.exists(lines_path) and os.path.exists(chunks_path):
+        with open(chunks_path, "r", encoding="utf-8") as f:
+            chunks = json.load(f)
+        lines = _read_jsonl(lines_path)
+        print(f"🔹 Reusing the {len(lines)} prepared lines of {workdir}")
+        return lines, chunks
+    if os.path.exists(os.path.join(workdir, "batches.jsonl")):
+        raise ValueError(f"{workdir} holds the batches of another input than {input_path}, "
+                         f"use another --workdir or delete it")
+
+    jobs = read_jobs(input_path)
+    metals = {}
+    for metal in {job["metal"] for job in jobs}:
+        main_name, doc_path, _ = match_metal.invoke(metal)
+        metals[metal] = (main_name, doc_path)
+
+    lines = []
+    queries = {}
+    for i, job in enumerate(jobs):
+        main_name, doc_path = metals[job["metal"]]
+        cached = lookup_answer(job["tool"], main_name, job["operation"], job["parameter"]) if main_name else None
+        line = {"line": i, "job": job, "main_name": main_name, "doc_path": doc_path, "cached": cached, "key": None}
+        if cached is None:
+            query = retrieval_query(job["tool"], job["operation"], job["parameter"])
+            line["key"] = retrieval_key(query)
+            queries[line["key"]] = (query, job["tool"], job["operation"])
+        lines.append(line)
+    print(f"🔹 {len(lines)} lines, {sum(line['cached'] is not None for line in lines)} answered from the lookup, "
+          f"{len(metals)} metals, {len(queries)} retrievals")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(lambda item: retrieve_tool_chunks(item[0], tool=item[1], operation=item[2]),
+                               queries.values())
+        chunks = {key: {"query": item[0], "chunks": result} for (key, item), result in zip(queries.items(), results)}
+
+    # chunks and lines first: the input record marks the local work as done
+    with open(chunks_path, "w", encoding="utf-8") as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    with open(lines_path + ".tmp", "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    os.replace(lines_path + ".tmp", lines_path)
+    with open(input_record_path, "w", encoding="utf-8") as f:
+        json.dump({"input": input_path, "sha256": digest}, f)
+    return lines, chunks
+
+
+def split_batches(requests: list, client: BatchClient, max_batch=MAX_BATCH) -> list:
+    """the requests in parts of at most max_batch requests and client.max_bytes encoded bytes"""
+    parts, part, size = [], [], 0
+    for request in requests:
+        request_size = client.encoded_size(request) if client.max_bytes else 0
+        if part and (len(part) >= max_batch or (client.max_bytes and size + request_size > client.max_bytes)):
+            parts.append(part)
+            part, size = [], 0
+        part.append(request)
+        size += request_size
+    if part:
+        parts.append(part)
+    return parts
+
+
+def run_stage(stage, requests, workdir, client_factory, max_batch=MAX_BATCH,
+              poll_interval=POLL_INTERVAL, wait=True, retry_failed=False):
+    """
+    submit the requests not answered yet, collect the batches of the stage.
+    :return: {custom_id: result}, None when wait is False and a batch is still running
+    """
+    results_path = os.path.join(workdir, f"{stage}.results.jsonl")
+    batches_path = os.path.join(workdir, "batches.jsonl")
+    results = {record.pop("custom_id"): record for record in _read_jsonl(results_path)}
+    if retry_failed:
+        results = {custom_id: result for custom_id, result in results.items() if "output" in result}
+
+    batches = {}
+    for record in _read_jsonl(batches_path):
+        if record["stage"] != stage:
+            continue
+        if record.get("collected"):
+            batches.pop(record["batch_id"], None)
+        else:
+            batches[record["batch_id"]] = record
+    submitted = {custom_id for batch in batches.values() for custom_id in batch["custom_ids"]}
+
+    pending = [request for request in requests if request.custom_id not in results and request.custom_id not in submitted]
+    by_provider = {}
+    for request in pending:
+        by_provider.setdefault(request.profile.provider, []).append(request)
+    for provider, group in by_provider.items():
+        for part in split_batches(group, client_factory(provider), max_batch):
+            batch_id = client_factory(provider).submit(part)
+            record = {"stage": stage, "provider": provider, "batch_id": batch_id,
+                      "custom_ids": [request.custom_id for request in part]}
+            _append_jsonl(batches_path, [record])
+            batches[batch_id] = record
+            print(f"📤 {stage}: submitted {len(part)} requests to {provider} as {batch_id}")
+
+    while batches:
+        for batch_id, record in list(batches.items()):
+            client = client_factory(record["provider"])
+            if client.poll(batch_id) != "done":
+                continue
+            collected = client.results(batch_id)
+            # the requests a batch did not process are failed, so --retry-failed submits them again
+            for custom_id in record["custom_ids"]:
+                collected.setdefault(custom_id, {"error": "not processed by the batch"})
+            _append_jsonl(results_path, [{"custom_id": custom_id, **result} for custom_id, result in collected.items()])
+            _append_jsonl(batches_path, [{"stage": stage, "batch_id": batch_id, "collected": True}])
+            results.update(collected)
+            del batches[batch_id]
+            print(f"📥 {stage}: collected {batch_id}, {sum('output' in result for result in collected.values())}"
+                  f"/{len(collected)} answered")
+        if batches:
+            if not wait:
+                print(f"⏳ {stage}: {len(batches)} batches still running, run the command again to continue")
+                return None
+            time.sleep(poll_interval)
+
+    failed = sum("error" in results.get(request.custom_id, {}) for request in requests)
+    if failed:
+        print(f"⚠️ warning: {failed} {stage} requests failed, --retry-failed submits them again")
+    return results
+
+
+def rating_requests(chunks, stage, only=None) -> list[BatchRequest]:
+    """one rating request per retrieved chunk, only the custom ids in only if given"""
+    profile = stage_profile(stage)
+    requests = []
+    for key, entry in chunks.items():
+        for i, reference in enumerate(entry["chunks"]):
+            custom_id = f"{key}-{i}"
+            if only is not None and custom_id not in only:
+                continue
+            requests.append(BatchRequest(custom_id=f"{stage}-{custom_id}", profile=profile, system=RATING_PROMPT,
+                                         user=f"Query: {entry['query']}\nReference: {reference}",
+                                         schema_name="Feedback"))
+    return requests
+
+
+def relevant(result) -> bool:
+    return bool(result) and (result.get("output") or {}).get("judge") == "relevant"
+
+
+def answer_requests(lines, chunks, accepted) -> list[BatchRequest]:
+    """one recommendation request per line which is not in the lookup, with the packed references"""
+    profile = stage_profile("answer")
+    documents = {}
+    requests = []
+    for line in lines:
+        if line["cached"] is not None:
+            continue
+        job = line["job"]
+        doc_path = line["doc_path"]
+        if doc_path and doc_path not in documents:
+            try:
+                with open(doc_path, "r", encoding="utf-8") as f:
+                    documents[doc_path] = f.read()
+            except FileNotFoundError:
+                documents[doc_path] = None
+        tool_refs = [reference for i, reference in enumerate(chunks[line["key"]]["chunks"])
+                     if f"{line['key']}-{i}" in accepted]
+        references = pack_references(documents.get(doc_path), tool_refs or None, profile.model,
+                                     metal_name=line["main_name"])
+        query = f"What's the {job['parameter']} for {job['operation']} {job['metal']} with {job['tool']} tool?"
+        cached = f"References:\n{references.metal}" if references.metal else ""
+        user = f"{references.tools}\n\nQuery: {query}" if cached else f"References:\n{references.tools}\n\nQuery: {query}"
+        requests.append(BatchRequest(custom_id=f"answer-{line['line']}", profile=profile, system=ANSWER_PROMPT,
+                                     cached=cached, user=user, schema_name="Answer"))
+    return requests
+
+
+def write_results(lines, answers, output_path):
+    """the input columns and the answer of every line, in the input order"""
+    rows = []
+    for line in lines:
+        row = dict(line["job"])
+        row["metal_match"] = line["main_name"]
+        result = answers.get(f"answer-{line['line']}") or {}
+        if line["cached"] is not None:
+            row.update(source="lookup", **line["cached"])
+        elif "output" in result:
+            row.update(source="batch", **{field: result["output"].get(field) for field in ANSWER_FIELDS})
+        else:
+            row.update(source="error", error=result.get("error", "no answer"))
+        rows.append(row)
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    if output_path.endswith(".jsonl"):
+        content = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    else:
+        fields = list(dict.fromkeys([*lines[0]["job"], *OUTPUT_FIELDS])) if lines else OUTPUT_FIELDS
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+        content = buffer.getvalue()
+    with open(output_path + ".tmp", "w", encoding="utf-8", newline="") as f:
+        f.write(content)
+    os.replace(output_path + ".tmp", output_path)
+    return rows
+
+
+def run_bulk(input_path, workdir=None, output_path=None, local=False, workers=8, max_batch=MAX_BATCH,
+             poll_interval=POLL_INTERVAL, wait=True, retry_failed=False):
+    """
+    answer the job file through the batch APIs, resumable from workdir.
+    :return: the output rows, None when wait is False and the run is not finished
+    """
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    workdir = workdir or os.path.join(WORKDIR_ROOT, name)
+    output_path = output_path or os.path.join(workdir, "results.csv")
+    os.makedirs(workdir, exist_ok=True)
+
+    local_client = LocalBatchClient(os.path.join(workdir, "local_batches")) if local else None
+    clients = {}
+
+    def client_factory(provider):
+        if provider not in clients:
+            clients[provider] = client_for(provider, local_client)
+        return clients[provider]
+
+    options = {"max_batch": max_batch, "poll_interval": poll_interval, "wait": wait, "retry_failed": retry_failed}
+    lines, chunks = prepare(input_path, workdir, workers)
+
+    ratings = run_stage("rating", rating_requests(chunks, "rating"), workdir, client_factory, **options)
+    if ratings is None:
+        return None
+    rejected = {custom_id[len("rating-"):] for custom_id, result in ratings.items() if not relevant(result)}
+    fallbacks = run_stage("rating_fallback", rating_requests(chunks, "rating_fallback", only=rejected),
+                          workdir, client_factory, **options)
+    if fallbacks is None:
+        return None
+    accepted = {custom_id[len("rating-"):] for custom_id, result in ratings.items() if relevant(result)}
+    accepted |= {custom_id[len("rating_fallback-"):] for custom_id, result in fallbacks.items() if relevant(result)}
+
+    answers = run_stage("answer", answer_requests(lines, chunks, accepted), workdir, client_factory, **options)
+    if answers is None:
+        return None
+    rows = write_results(lines, answers, output_path)
+    counts = {}
+    for row in rows:
+        counts[row["source"]] = counts.get(row["source"], 0) + 1
+    print(f"\n💾 {len(rows)} results saved to: {output_path} {counts}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Answer a job list of recommendations with the provider batch APIs.")
+    parser.add_argument("input", help="CSV or JSONL file with the columns tool, metal, operation, parameter")
+    parser.add_argument("--output", default=None, help="CSV or JSONL file, default: <workdir>/results.csv")
+    parser.add_argument("--workdir", default=None, help=f"the resume state, default: {WORKDIR_ROOT}/<input name>")
+    parser.add_argument("--local", action="store_true",
+                        help="run the batches locally with the fake models, retrieve with the fake embeddings")
+    parser.add_argument("--workers", type=int, default=8, help="parallel retrievals of the local work")
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH)
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="seconds between the batch polls")
+    parser.add_argument("--no-wait", action="store_true", help="exit after submitting instead of waiting for the batches")
+    parser.add_argument("--retry-failed", action="store_true", help="submit the failed requests again")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.local:
+        install_local_retrieval()
+    run_bulk(args.input, workdir=args.workdir, output_path=args.output, local=args.local, workers=args.workers,
+             max_batch=args.max_batch, poll_interval=args.poll_interval, wait=not args.no_wait,
+             retry_failed=args.retry_failed)
+
+
+if __name__ == "__main__":
+    main()
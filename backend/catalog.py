@@ -0,0 +1,168 @@
+"""
+Catalog of the tool document collections.
+
+Every washed tool document is embedded into its own Chroma collection
+(markdown2embedding.py). The catalog records per collection the vendor, the
+operations and the tool grades the document covers, and is updated at
+ingestion time:
+
+    {
+        "version": 1,
+        "collections": [
+            {"source": "backend/washed_documents/Summurized_Diametal_Turning.md",
+             "collection": "rag-Summurized_Diametal_Turning",
+             "persist_directory": "backend/VectorDBs/Summurized_Diametal_Turning",
+             "vendor": "Diametal", "operations": ["turning"], "tool_grades": ["D10", "D20"], "chunks": 120}
+        ]
+    }
+
+select() picks the collections of a query (tool grade, operation, vendor);
+an empty list in an entry means "not known" and matches anything. Without
+a catalog file the single DEFAULT_DOCUMENT collection is used, as before.
+"""
+import os
+import re
+import json
+import threading
+from typing import Optional
+from pydantic import BaseModel
+import snapshot
+from answer_lookup import TOOL_GRADES, OPERATION_STEMS, canonical_tool, normalize
+
+CATALOG_PATH = os.path.join("backend", "mappings", "collection_catalog.json")
+# the only collection before the catalog existed
+DEFAULT_DOCUMENT = os.path.join("backend", "washed_documents", "Summurized_Diametal_Turning.md")
+# file name parts which are not the vendor
+NAME_STOPWORDS = {"summurized", "summarized", "washed", "datasheet", "catalog", "catalogue", "tools", "tool", "md"}
+
+
+class CollectionEntry(BaseModel):
+    source: str
+    collection: str
+    persist_directory: str
+    vendor: Optional[str] = None
+    operations: list[str] = []
+    tool_grades: list[str] = []
+    chunks: Optional[int] = None
+
+    def matches(self, tool_grade=None, operation=None, vendor=None) -> bool:
+        return (
+            (not tool_grade or not self.tool_grades or tool_grade in self.tool_grades)
+            and (not operation or not self.operations or operation in self.operations)
+            and (not vendor or not self.vendor or normalize(vendor) == normalize(self.vendor))
+        )
+
+
+_lock = threading.Lock()
+_cache = {"path": None, "mtime": None, "entries": []}
+
+
+def collection_for(file_path: str):
+    """(persist directory, collection name) of a document, shared by the ingestion and the retrieval"""
+    filename = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join("backend", "VectorDBs", filename), f"rag-{filename}"
+
+
+def operations_in(text: str) -> list[str]:
+    """the catalogued operations whose stem starts a word of text"""
+    words = re.findall(r"[a-z]+", normalize(text))
+    return [name for name, stems in OPERATION_STEMS.items()
+            if any(word.startswith(stem) for word in words for stem in stems)]
+
+
+def tool_grades_in(text: str) -> list[str]:
+    text_norm = normalize(text)
+    return [grade for grade in TOOL_GRADES
+            if re.search(rf"(?<![\w/]){re.escape(normalize(grade))}(?![\w/])", text_norm)]
+
+
+def describe_document(file_path: str, text: str, vendor=None, operations=None, chunks=None) -> CollectionEntry:
+    """
+    the catalog entry of a tool document.
+    the vendor and the operations are taken from the file name unless given (the text of a
+    turning datasheet also mentions milling), the tool grades from the text.
+    """
+    persist_directory, collection = collection_for(file_path)
+    name = os.path.splitext(os.path.basename(file_path))[0]
+    if vendor is None:
+        parts = [part for part in re.split(r"[_\-\s.]+", name)
+                 if part and part.lower() not in NAME_STOPWORDS and not operations_in(part)]
+        vendor = parts[0] if parts else None
+    return CollectionEntry(
+        source=file_path,
+        collection=collection,
+        persist_directory=persist_directory,
+        vendor=vendor,
+        operations=operations if operations is not None else operations_in(name),
+        tool_grades=tool_grades_in(text),
+        chunks=chunks,
+    )
+
+
+def default_entries() -> list[CollectionEntry]:
+    persist_directory, collection = collection_for(DEFAULT_DOCUMENT)
+    return [CollectionEntry(source=DEFAULT_DOCUMENT, collection=collection, persist_directory=persist_directory)]
+
+
+def read_catalog(path=CATALOG_PATH) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("collections", [])
+
+
+def to_entries(collections: list[dict]) -> list[CollectionEntry]:
+    return [CollectionEntry.model_validate(entry) for entry in collections]
+
+
+def load_catalog(path=CATALOG_PATH) -> list[CollectionEntry]:
+    """
+    the catalog entries (or their fresh snapshot), only re-read when the file changed on disk;
+    the default collection without file
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return default_entries()
+    entries = snapshot.load("catalog", path, convert=to_entries)
+    if entries is not None:
+        return entries
+
+    with _lock:
+        if _cache["path"] == path and _cache["mtime"] == mtime:
+            return _cache["entries"]
+        entries = to_entries(read_catalog(path))
+        _cache.update(path=path, mtime=mtime, entries=entries)
+        return entries
+
+
+def register(entry: CollectionEntry, path=CATALOG_PATH):
+    """add or replace (same collection) the entry and write the catalog atomically"""
+    with _lock:
+        entries = []
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                entries = json.load(f).get("collections", [])
+        entries = [item for item in entries if item["collection"] != entry.collection] + [entry.model_dump()]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "collections": sorted(entries, key=lambda item: item["collection"])},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def select(query: str, tool=None, operation=None, path=CATALOG_PATH) -> list[CollectionEntry]:
+    """
+    the collections to search for a query, the tool grade and the operation are read from
+    the query unless given. a vendor named in the query restricts the search to its documents.
+    every collection is searched when none matches.
+    """
+    entries = load_catalog(path)
+    tool_grade = canonical_tool(tool) if tool else canonical_tool(query)
+    operations = operations_in(operation or query)
+    vendors = {normalize(entry.vendor) for entry in entries if entry.vendor}
+    vendor = next((name for name in vendors if re.search(rf"\b{re.escape(name)}\b", normalize(query))), None)
+    selected = [
+        entry for entry in entries
+        if entry.matches(tool_grade, operations[0] if len(operations) == 1 else None, vendor)
+    ]
+    return selected or entries
@@ -0,0 +1,240 @@
+"""
+Bounded checkpointers for the langgraph entrypoints.
+
+The default MemorySaver keeps every thread's checkpoints for the lifetime of
+the process. The savers here evict whole threads instead:
+
+  - LRUMemorySaver: in memory, evicts the least recently used threads once the
+    serialized checkpoints exceed max_bytes (and, optionally, idle threads after ttl)
+  - EvictingSqliteSaver: persisted in a SQLite file, so threads survive restarts,
+    evicts the threads idle for longer than ttl and the oldest ones above max_bytes
+
+Both expose stats() with the retained threads and bytes.
+
+get_checkpointer() returns the process-wide saver selected with the environment:
+    RAG_CHECKPOINTER=lru|sqlite|memory   (default lru)
+    RAG_CHECKPOINT_MAX_MB=256
+    RAG_CHECKPOINT_TTL_S=86400           (0 disables the TTL)
+    RAG_CHECKPOINT_PATH=checkpoints.sqlite
+"""
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+
+class LRUMemorySaver(MemorySaver):
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024, ttl: float = None, **kwargs):
+        super().__init__(**kwargs)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        # thread_id -> last use, the least recently used first
+        self._last_used = OrderedDict()
+        self._thread_bytes = {}
+        self._total_bytes = 0
+        self.evicted_threads = 0
+
+    def _touch(self, thread_id, added_bytes: int = 0):
+        self._last_used[thread_id] = time.monotonic()
+        self._last_used.move_to_end(thread_id)
+        self._thread_bytes[thread_id] = self._thread_bytes.get(thread_id, 0) + added_bytes
+        self._total_bytes += added_bytes
+
+    def _evict(self, keep):
+        # the head is the least recently used (and so the longest idle) thread:
+        # pop it while it expired or the budget is exceeded, keep was just touched
+        now = time.monotonic()
+        while self._last_used:
+            thread_id, last_used = next(iter(self._last_used.items()))
+            expired = self.ttl and now - last_used > self.ttl
+            if thread_id == keep or not (expired or self._total_bytes > self.max_bytes):
+                break
+            self.delete_thread(thread_id)
+            self.evicted_threads += 1
+
+    def get_tuple(self, config):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            if thread_id in self._last_used:
+                self._touch(thread_id)
+            return super().get_tuple(config)
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        with self._lock:
+            result = super().put(config, checkpoint, metadata, new_versions)
+            thread_id = config["configurable"]["thread_id"]
+            checkpoint_ns = config["configurable"]["checkpoint_ns"]
+            saved, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            added = len(saved[1]) + len(saved_metadata[1])
+            for channel, version in new_versions.items():
+                added += len(self.blobs[(thread_id, checkpoint_ns, channel, version)][1])
+            self._touch(thread_id, added)
+            self._evict(keep=thread_id)
+            return result
+
+    def put_writes(self, config, writes, task_id, task_path=""):
+        with self._lock:
+            thread_id = config["configurable"]["thread_id"]
+            outer_key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+            stored = self.writes.get(outer_key, {})
+            before = {key: value[2] for key, value in stored.items() if key[0] == task_id}
+            super().put_writes(config, writes, task_id, task_path)
+            # size the values the parent just serialized, minus the ones they replaced
+            added = 0
+            for key, value in self.writes.get(outer_key, {}).items():
+                if key[0] == task_id and before.get(key) is not value[2]:
+                    added += len(value[2][1]) - (len(before[key][1]) if key in before else 0)
+            self._touch(thread_id, added)
+            self._evict(keep=thread_id)
+
+    def delete_thread(self, thread_id):
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._last_used.pop(thread_id, None)
+            self._total_bytes -= self._thread_bytes.pop(thread_id, 0)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "kind": "lru",
+                "threads": len(self._last_used),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "evicted_threads": self.evicted_threads,
+            }
+
+
+class EvictingSqliteSaver(SqliteSaver):
+    """
+    :param evict_every: the eviction query runs once every evict_every checkpoints
+    """
+    def __init__(self, path: str = "checkpoints.sqlite", max_bytes: int = 1024 * 1024 * 1024,
+                 ttl: float = None, evict_every: int = 50, **kwargs):
+        super().__init__(sqlite3.connect(path, check_same_thread=False), **kwargs)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.evict_every = evict_every
+        self.evicted_threads = 0
+        self._puts = 0
+
+    def setup(self):
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS thread_access (
+                thread_id TEXT PRIMARY KEY,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS thread_access_last_used ON thread_access (last_used);
+            """
+        )
+
+    def _touch(self, thread_id):
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT INTO thread_access (thread_id, last_used) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET last_used = excluded.last_used",
+                (str(thread_id), time.time()),
+            )
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config["configurable"]["thread_id"])
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            self.evict(keep=config["configurable"]["thread_id"])
+        return result
+
+    def _thread_sizes(self, cur):
+        """(thread_id, bytes) of every thread, the least recently used first"""
+        cur.execute(
+            """
+            SELECT a.thread_id,
+                   COALESCE((SELECT SUM(LENGTH(checkpoint) + LENGTH(metadata)) FROM checkpoints c WHERE c.thread_id = a.thread_id), 0)
+                 + COALESCE((SELECT SUM(LENGTH(value)) FROM writes w WHERE w.thread_id = a.thread_id), 0)
+            FROM thread_access a
+            ORDER BY a.last_used
+            """
+        )
+        return cur.fetchall()
+
+    def evict(self, keep=None):
+        """delete the threads idle for longer than ttl, then the oldest threads while above max_bytes"""
+        with self.cursor() as cur:
+            if self.ttl:
+                cur.execute("SELECT thread_id FROM thread_access WHERE last_used < ?", (time.time() - self.ttl,))
+                expired = {row[0] for row in cur.fetchall()} - {str(keep)}
+            else:
+                expired = set()
+            sizes = self._thread_sizes(cur)
+
+        total = sum(size for _, size in sizes)
+        victims = []
+        for thread_id, size in sizes:
+            if thread_id in expired or (total > self.max_bytes and thread_id != str(keep)):
+                victims.append(thread_id)
+                total -= size
+
+        for thread_id in victims:
+            self.delete_thread(thread_id)
+        self.evicted_threads += len(victims)
+        return len(victims)
+
+    def delete_thread(self, thread_id):
+        super().delete_thread(thread_id)
+        with self.cursor() as cur:
+            cur.execute("DELETE FROM thread_access WHERE thread_id = ?", (str(thread_id),))
+
+    def stats(self) -> dict:
+        with self.cursor(transaction=False) as cur:
+            sizes = self._thread_sizes(cur)
+        return {
+            "kind": "sqlite",
+            "path": self.path,
+            "threads": len(sizes),
+            "bytes": sum(size for _, size in sizes),
+            "max_bytes": self.max_bytes,
+            "evicted_threads": self.evicted_threads,
+        }
+
+
+_checkpointer = None
+_checkpointer_lock = threading.Lock()
+
+
+def make_checkpointer(kind: str = None):
+    """build the checkpointer selected by kind or RAG_CHECKPOINTER"""
+    kind = kind or os.getenv("RAG_CHECKPOINTER", "lru")
+    max_bytes = int(float(os.getenv("RAG_CHECKPOINT_MAX_MB", "256")) * 1024 * 1024)
+    ttl = float(os.getenv("RAG_CHECKPOINT_TTL_S", "86400")) or None
+
+    if kind == "lru":
+        return LRUMemorySaver(max_bytes=max_bytes, ttl=ttl)
+    if kind == "sqlite":
+        return EvictingSqliteSaver(os.getenv("RAG_CHECKPOINT_PATH", "checkpoints.sqlite"), max_bytes=max_bytes, ttl=ttl)
+    if kind == "memory":
+        return MemorySaver()
+    raise ValueError(f"Unknown checkpointer: {kind}")
+
+
+def get_checkpointer():
+    """the checkpointer shared by the entrypoints of the process"""
+    global _checkpointer
+    with _checkpointer_lock:
+        if _checkpointer is None:
+            _checkpointer = make_checkpointer()
+        return _checkpointer
+
+
+def checkpointer_stats() -> dict:
+    checkpointer = get_checkpointer()
+    if hasattr(checkpointer, "stats"):
+        return checkpointer.stats()
+    return {"kind": "memory", "threads": len(checkpointer.storage)}
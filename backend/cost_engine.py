@@ -0,0 +1,413 @@
+"""
+Numeric optimizer of the battlefield cost model.
+
+The cost functions of battlefield.py accept NumPy arrays here, so thousands of
+(v_c, f_c, a) points are evaluated in one call. optimize() samples the
+recommended ranges densely (Latin hypercube or grid), refines the best points
+with a vectorized pattern search and returns the optimum with its cost
+breakdown. The LLM is only asked to explain the result (explain_optimum).
+
+pareto_front() returns the trade-off between the three unweighted cost terms
+instead of one weighted optimum: the non-dominated points of a large candidate
+set, cached per (ranges, cost model constants) so moving a slider back is free.
+
+Usage (from the project root):
+    python backend/cost_engine.py --v-c 20-120 --f-c 0.01-0.12 --a 0.5-2.0
+    python backend/cost_engine.py --v-c 60-120 --metal-v-c 20-30 --merge conservative --explain
+    python backend/cost_engine.py --v-c 20-120 --f-c 0.01-0.12 --a 0.5-2.0 --pareto --output front.csv
+"""
+import re
+import time
+import bisect
+import argparse
+import threading
+from collections import OrderedDict
+import numpy as np
+from pydantic import BaseModel, ConfigDict, Field
+
+PARAMETERS = ("v_c", "f_c", "a")
+# neighbours of the pattern search: every combination of -1/0/+1 steps per parameter
+_OFFSETS = np.array(np.meshgrid(*[[-1.0, 0.0, 1.0]] * len(PARAMETERS), indexing="ij")).reshape(len(PARAMETERS), -1).T
+
+
+class CostModel(BaseModel):
+    """constants and weights of the cost terms"""
+    C_T: float = Field(default=1.8e6, description="Taylor tool life at v_c = 1 m/min (min)")
+    k_T: float = Field(default=-2.0, description="Taylor exponent, negative")
+    C_I: float = Field(default=20.0, description="cost of a cutting edge")
+    roughness_k: float = Field(default=10.0, description="feed/speed factor of the roughness cost")
+    tool_weight: float = 1.0
+    time_weight: float = 1.0
+    roughness_weight: float = 1.0
+
+
+OBJECTIVES = ("tool", "time", "roughness")
+
+
+class ParetoFront(BaseModel):
+    """the non-dominated points, read-only arrays sorted by tool cost"""
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    points: np.ndarray       # (n, 3) v_c, f_c, a
+    objectives: np.ndarray   # (n, 3) tool, time, roughness
+    bounds: dict
+    candidates: int
+    elapsed_ms: float
+    cached: bool = False
+
+
+class OptimizationResult(BaseModel):
+    v_c: float
+    f_c: float
+    a: float
+    cost: float
+    breakdown: dict
+    bounds: dict
+    evaluations: int
+    elapsed_ms: float
+
+
+################################################################################################################################
+# cost functions, every argument may be a float or an array
+
+def production_time_cost(v_c, f_c):
+    """the production time is inversely proportional to the cutting speed and the feed rate"""
+    return 1.0 / (np.asarray(v_c) * np.asarray(f_c))
+
+
+def tool_life(v_c, C_T, k_T):
+    """Taylor formula T_c = C_T * v_c^k_T"""
+    return C_T * np.power(np.asarray(v_c, dtype=float), k_T)
+
+
+def tool_cost(v_c, C_T, k_T, C_I):
+    """tool cost per part C_I / T_c"""
+    return C_I / tool_life(v_c, C_T, k_T)
+
+
+def roughness_cost(v_c, f_c, a, k: float = 10.0):
+    """roughness grows with the feed rate and the cutting depth and falls with the cutting speed"""
+    return k * (np.asarray(f_c) / np.asarray(v_c)) + np.asarray(a)
+
+
+def cost_breakdown(v_c, f_c, a, model: CostModel = CostModel()) -> dict:
+    """{"tool", "time", "roughness", "total"} of every point, weighted"""
+    tool = model.tool_weight * tool_cost(v_c, model.C_T, model.k_T, model.C_I)
+    production = model.time_weight * production_time_cost(v_c, f_c)
+    roughness = model.roughness_weight * roughness_cost(v_c, f_c, a, model.roughness_k)
+    return {"tool": tool, "time": production, "roughness": roughness, "total": tool + production + roughness}
+
+
+def total_cost(points, model: CostModel = CostModel()):
+    """total cost of an (..., 3) array of (v_c, f_c, a) points"""
+    return cost_breakdown(points[..., 0], points[..., 1], points[..., 2], model)["total"]
+
+
+################################################################################################################################
+# ranges
+
+def parse_range(text):
+    """(low, high) of a range like "60-120 m/min", "0.05 – 0.25", "20 to 30" or a single value; None if no number"""
+    if text is None:
+        return None
+    if isinstance(text, (tuple, list)):
+        return float(min(text)), float(max(text))
+    numbers = [float(n.replace(",", ".")) for n in re.findall(r"\d+(?:[.,]\d+)?", str(text))]
+    if not numbers:
+        return None
+    return min(numbers[:2]), max(numbers[:2])
+
+
+def merge_ranges(tool_range, metal_range, mode: str = "intersect"):
+    """
+    combine the tool and metal ranges of a parameter.
+    intersect: the overlap, the conservative (metal) range when they do not overlap
+    conservative: the range with the lower upper bound
+    union: from the lowest to the highest bound
+    """
+    tool, metal = parse_range(tool_range), parse_range(metal_range)
+    if tool is None or metal is None:
+        return tool or metal
+    if mode == "union":
+        return min(tool[0], metal[0]), max(tool[1], metal[1])
+    conservative = min(tool, metal, key=lambda r: r[1])
+    if mode == "conservative":
+        return conservative
+    low, high = max(tool[0], metal[0]), min(tool[1], metal[1])
+    return (low, high) if low <= high else conservative
+
+
+################################################################################################################################
+# optimizer
+
+def latin_hypercube(n: int, dims: int, rng) -> np.ndarray:
+    """n points in [0, 1)^dims, one per row and column stratum"""
+    strata = np.stack([rng.permutation(n) for _ in range(dims)], axis=1)
+    return (strata + rng.random((n, dims))) / n
+
+
+def sample_points(bounds, samples: int, method: str = "lhs", seed: int = 0) -> np.ndarray:
+    low = np.array([bounds[p][0] for p in PARAMETERS], dtype=float)
+    high = np.array([bounds[p][1] for p in PARAMETERS], dtype=float)
+    if method == "grid":
+        per_axis = max(2, int(round(samples ** (1 / len(PARAMETERS)))))
+        axes = [np.linspace(0.0, 1.0, per_axis)] * len(PARAMETERS)
+        unit = np.array(np.meshgrid(*axes, indexing="ij")).reshape(len(PARAMETERS), -1).T
+    elif method == "lhs":
+        unit = latin_hypercube(samples, len(PARAMETERS), np.random.default_rng(seed))
+    else:
+        raise ValueError(f"Unknown sampling method: {method}")
+    return low + unit * (high - low)
+
+
+def refine(points, bounds, model: CostModel, step: float = 0.05, tolerance: float = 1e-4, max_iterations: int = 200):
+    """
+    pattern search from every start point at once: move to the best of the 27 neighbours,
+    halve the step (relative to the range) of the starts which did not improve.
+    :return: (points, costs, evaluations)
+    """
+    low = np.array([bounds[p][0] for p in PARAMETERS], dtype=float)
+    high = np.array([bounds[p][1] for p in PARAMETERS], dtype=float)
+    span = np.where(high > low, high - low, 0.0)
+    points = np.array(points, dtype=float)
+    costs = total_cost(points, model)
+    steps = np.full(len(points), step)
+    evaluations = 0
+    for _ in range(max_iterations):
+        active = steps > tolerance
+        if not active.any():
+            break
+        # (starts, 27, 3) candidates within the bounds
+        candidates = points[active, None, :] + steps[active, None, None] * _OFFSETS[None] * span
+        candidates = np.clip(candidates, low, high)
+        candidate_costs = total_cost(candidates, model)
+        evaluations += candidate_costs.size
+        best = candidate_costs.argmin(axis=1)
+        best_costs = candidate_costs[np.arange(len(best)), best]
+        improved = best_costs < costs[active] - 1e-12
+        index = np.flatnonzero(active)
+        points[index[improved]] = candidates[improved, best[improved]]
+        costs[index[improved]] = best_costs[improved]
+        steps[index[~improved]] /= 2
+    return points, costs, evaluations
+
+
+def parse_bounds(bounds: dict) -> dict:
+    """{parameter: (low, high)} of the bounds, a ValueError naming the parameter without a positive range"""
+    parsed = {}
+    for name in PARAMETERS:
+        value = parse_range(bounds.get(name))
+        if value is None:
+            raise ValueError(f"No range for {name}: {bounds.get(name)!r}")
+        if value[0] <= 0:
+            raise ValueError(f"The range of {name} must be positive, got {value}")
+        parsed[name] = value
+    return parsed
+
+
+def optimize(bounds: dict, model: CostModel = CostModel(), samples: int = 4096, method: str = "lhs",
+             starts: int = 8, seed: int = 0) -> OptimizationResult:
+    """
+    minimize the total cost over the bounds {"v_c": (low, high), "f_c": ..., "a": ...}.
+    a parameter with low == high is fixed.
+    """
+    start = time.perf_counter()
+    bounds = parse_bounds(bounds)
+
+    points = sample_points(bounds, samples, method, seed)
+    costs = total_cost(points, model)
+    best = np.argsort(costs)[:starts]
+    refined, refined_costs, evaluations = refine(points[best], bounds, model)
+    winner = refined[refined_costs.argmin()]
+
+    breakdown = cost_breakdown(*winner, model)
+    return OptimizationResult(
+        **{p: float(v) for p, v in zip(PARAMETERS, winner)},
+        cost=float(breakdown["total"]),
+        breakdown={k: float(v) for k, v in breakdown.items() if k != "total"},
+        bounds=bounds,
+        evaluations=len(points) + evaluations,
+        elapsed_ms=round((time.perf_counter() - start) * 1000, 3),
+    )
+
+
+################################################################################################################################
+# Pareto front
+
+def objective_matrix(points, model: CostModel = CostModel()) -> np.ndarray:
+    """(n, 3) unweighted tool, time and roughness costs of (n, 3) points"""
+    v_c, f_c, a = points[:, 0], points[:, 1], points[:, 2]
+    return np.column_stack([
+        tool_cost(v_c, model.C_T, model.k_T, model.C_I),
+        production_time_cost(v_c, f_c),
+        roughness_cost(v_c, f_c, a, model.roughness_k),
+    ])
+
+
+def pareto_mask(objectives: np.ndarray) -> np.ndarray:
+    """boolean mask of the non-dominated rows (all objectives minimized)"""
+    if objectives.shape[1] == 3:
+        return _pareto_mask_3d(objectives)
+    return _pareto_mask_cull(objectives)
+
+
+def _pareto_mask_3d(objectives):
+    """
+    sweep in lexicographic order: a row can only be dominated by earlier rows, i.e. by the
+    2D staircase (objective 2 ascending, objective 3 descending) of the non-dominated rows
+    seen so far; one bisect per row, O(n log n)
+    """
+    order = np.lexsort(objectives.T[::-1])
+    first, second, third = (objectives[order, k].tolist() for k in range(3))
+    xs, ys, zs = [], [], []
+    mask = np.zeros(len(order), dtype=bool)
+    for i, (z, x, y) in enumerate(zip(first, second, third)):
+        j = bisect.bisect_right(xs, x) - 1
+        # the staircase row with the largest objective 2 <= x has the lowest objective 3 of them
+        if j >= 0 and (ys[j] < y or (ys[j] == y and (xs[j] < x or zs[j] < z))):
+            continue
+        mask[order[i]] = True
+        k = bisect.bisect_left(xs, x)
+        end = k
+        while end < len(xs) and ys[end] >= y:
+            end += 1
+        xs[k:end], ys[k:end], zs[k:end] = [x], [y], [z]
+    return mask
+
+
+def _pareto_mask_cull(objectives):
+    """any number of objectives: every kept row removes the rows it dominates, O(n * front size)"""
+    order = np.lexsort(objectives.T[::-1])
+    remaining = objectives[order]
+    index = np.arange(len(order))
+    i = 0
+    while i < len(remaining):
+        dominated = np.all(remaining >= remaining[i], axis=1) & np.any(remaining > remaining[i], axis=1)
+        kept_before = np.count_nonzero(~dominated[:i])
+        remaining, index = remaining[~dominated], index[~dominated]
+        i = kept_before + 1
+    mask = np.zeros(len(order), dtype=bool)
+    mask[order[index]] = True
+    return mask
+
+
+def non_dominated_ranks(objectives: np.ndarray, max_rank: int = None) -> np.ndarray:
+    """front number of every row (0 = Pareto front) by peeling the fronts, -1 beyond max_rank"""
+    ranks = np.full(len(objectives), -1)
+    remaining = np.arange(len(objectives))
+    rank = 0
+    while len(remaining) and (max_rank is None or rank <= max_rank):
+        mask = pareto_mask(objectives[remaining])
+        ranks[remaining[mask]] = rank
+        remaining = remaining[~mask]
+        rank += 1
+    return ranks
+
+
+_front_cache = OrderedDict()
+_front_cache_lock = threading.Lock()
+FRONT_CACHE_SIZE = 128
+
+
+def _front_key(bounds, model: CostModel, samples, method, seed):
+    # rounded so that slider positions which only differ by float noise share an entry
+    ranges = tuple(tuple(round(x, 9) for x in bounds[p]) for p in PARAMETERS)
+    constants = (model.C_T, model.k_T, model.C_I, model.roughness_k)
+    return ranges, constants, samples, method, seed
+
+
+def pareto_front(bounds: dict, model: CostModel = CostModel(), samples: int = 20000,
+                 method: str = "lhs", seed: int = 0) -> ParetoFront:
+    """the Pareto front of the tool, time and roughness costs over the bounds, cached"""
+    start = time.perf_counter()
+    bounds = parse_bounds(bounds)
+    key = _front_key(bounds, model, samples, method, seed)
+    with _front_cache_lock:
+        front = _front_cache.get(key)
+        if front is not None:
+            _front_cache.move_to_end(key)
+            return front.model_copy(update={"cached": True, "elapsed_ms": round((time.perf_counter() - start) * 1000, 3)})
+
+    points = sample_points(bounds, samples, method, seed)
+    objectives = objective_matrix(points, model)
+    mask = pareto_mask(objectives)
+    order = np.argsort(objectives[mask][:, 0], kind="stable")
+    front_points, front_objectives = points[mask][order], objectives[mask][order]
+    front_points.flags.writeable = False
+    front_objectives.flags.writeable = False
+    front = ParetoFront(
+        points=front_points,
+        objectives=front_objectives,
+        bounds=bounds,
+        candidates=len(points),
+        elapsed_ms=round((time.perf_counter() - start) * 1000, 3),
+    )
+    with _front_cache_lock:
+        _front_cache[key] = front
+        while len(_front_cache) > FRONT_CACHE_SIZE:
+            _front_cache.popitem(last=False)
+    return front
+
+
+def explain_optimum(llm, result: OptimizationResult, requirement: str = "") -> str:
+    """let the LLM explain the optimum, it does not search for it"""
+    from langchain_core.messages import HumanMessage, SystemMessage
+    from governor import invoke
+    response = invoke(llm, [
+        SystemMessage(content="""
+        You are a machining process expert. A numeric optimizer minimized the total cost
+        (tool wear + production time + surface roughness) of the cutting parameters within the recommended ranges.
+        Explain the optimum in 3-4 sentences: which cost term drives each parameter, which bounds are active,
+        and whether the result respects the user's requirement. Do not propose other numbers.
+        """),
+        HumanMessage(content=f"Requirement: {requirement or 'none'}\nResult: {result.model_dump_json()}"),
+    ])
+    return response.content
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize (v_c, f_c, a) of the battlefield cost model.")
+    parser.add_argument("--v-c", required=True, help="cutting speed range (tool), e.g. 60-120")
+    parser.add_argument("--f-c", required=True, help="feed rate range, e.g. 0.01-0.12")
+    parser.add_argument("--a", required=True, help="cutting depth range, e.g. 0.5-2.0")
+    parser.add_argument("--metal-v-c", default=None, help="cutting speed range of the metal source")
+    parser.add_argument("--merge", choices=["intersect", "conservative", "union"], default="intersect")
+    parser.add_argument("--samples", type=int, default=4096)
+    parser.add_argument("--method", choices=["lhs", "grid"], default="lhs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--explain", action="store_true", help="ask the LLM to explain the optimum")
+    parser.add_argument("--pareto", action="store_true", help="compute the Pareto front instead of the weighted optimum")
+    parser.add_argument("--output", default=None, help="write the Pareto front as CSV")
+    args = parser.parse_args()
+
+    try:
+        bounds = parse_bounds({
+            "v_c": merge_ranges(args.v_c, args.metal_v_c, args.merge) if args.metal_v_c else args.v_c,
+            "f_c": args.f_c,
+            "a": args.a,
+        })
+    except ValueError as e:
+        parser.error(str(e))
+    if args.pareto:
+        front = pareto_front(bounds, samples=args.samples, method=args.method, seed=args.seed)
+        print(f"🎯 {len(front.points)} non-dominated points of {front.candidates} candidates in {front.elapsed_ms} ms")
+        for i in np.linspace(0, len(front.points) - 1, min(5, len(front.points))).astype(int):
+            print(f"   v_c={front.points[i, 0]:.2f} f_c={front.points[i, 1]:.4f} a={front.points[i, 2]:.3f}  "
+                  + ", ".join(f"{name}={value:.5f}" for name, value in zip(OBJECTIVES, front.objectives[i])))
+        if args.output:
+            np.savetxt(args.output, np.hstack([front.points, front.objectives]), delimiter=",",
+                       header=",".join(PARAMETERS + OBJECTIVES), comments="")
+            print(f"\n💾 Pareto front saved to: {args.output}")
+        return
+
+    result = optimize(bounds, samples=args.samples, method=args.method, seed=args.seed)
+    print(f"🎯 v_c={result.v_c:.2f} m/min, f_c={result.f_c:.4f} mm/rev, a={result.a:.3f} mm, cost={result.cost:.5f}")
+    print(f"   breakdown: {result.breakdown}")
+    print(f"   {result.evaluations} evaluations in {result.elapsed_ms} ms")
+    if args.explain:
+        import providers
+        print(f"\n💭 {explain_optimum(providers.get('openai'), result)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-from langchain_openai import ChatOpenAI
 from langchain_core.messages import HumanMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 from langgraph.checkpoint.memory import MemorySaver
@@ -10,11 +9,13 @@ from langchain_core.prompts import ChatPromptTemplate
 from langgraph.func import entrypoint, task
 from langchain_core.tools import tool
 from pydantic import BaseModel, Field
-from langchain_anthropic import ChatAnthropic
 from pydantic import BaseModel, Field
 from datetime import datetime
 import json
 from result_logger import ResultLogger
+from metal_index import best_reference
+from governor import invoke
+import providers
 
 class MetalAnalysis(BaseModel):
     Carbon_analysis: str = Field(
@@ -50,14 +51,30 @@ def read_file(file_path: str):
     with open(file_path, 'r', encoding='utf-8') as file:
         return file.read()
 
-model = ChatAnthropic(model="claude-3-7-sonnet-20250219",temperature=0)
-model1 = ChatOpenAI(model="gpt-4.5-preview-2025-02-27", temperature=0) #o3-mini-2025-01-31
-model2 = ChatOpenAI(model="gpt-4o-2024-08-06", temperature=0) #o3-mini-2025-01-31
-model0 = ChatOpenAI(model="o3-mini-2025-01-31") #temperature not supported
+def get_model():
+    """the model of the experiment, built on first use and shared (providers.py)"""
+    return providers.get("experiment")
+
+DEFAULT_REFERENCE_PATH = r"backend/markdowns/Klein_Metals/1.4125.md"
+
+def choose_reference(new_metal_path: str) -> str:
+    """the document of the most similar metal with known parameters, from the numeric metal index"""
+    try:
+        match = best_reference(new_metal_path)
+    except FileNotFoundError:
+        print("⚠️ warning: no metal index, run `python backend/metal_index.py build`; using the default reference")
+        return DEFAULT_REFERENCE_PATH
+    if match is None:
+        return DEFAULT_REFERENCE_PATH
+    name, doc_path, distance = match
+    print(f"🔹 Reference metal: {name} (distance {distance:.3f})")
+    return doc_path
 
 @task
-def metal_analysis(reference_path=r"backend/markdowns/Klein_Metals/1.4125.md", new_metal_path=r"backend/markdowns/Klein_Metals/1.4598.md"):
-    """Analyze metal materials."""
+def metal_analysis(reference_path=None, new_metal_path=r"backend/markdowns/Klein_Metals/1.4598.md"):
+    """Analyze metal materials, against the most similar known metal unless reference_path is given."""
+    if reference_path is None:
+        reference_path = choose_reference(new_metal_path)
     reference = read_file(reference_path)
     new_metal = read_file(new_metal_path)
     messages = [
@@ -86,7 +103,7 @@ def metal_analysis(reference_path=r"backend/markdowns/Klein_Metals/1.4125.md", n
             """
         )
     ]
-    result = model.with_structured_output(MetalAnalysis).invoke(messages)
+    result = invoke(get_model().with_structured_output(MetalAnalysis), messages, get_model())
     return result
 
 class Answer(BaseModel):
@@ -112,7 +129,7 @@ class Answer(BaseModel):
 @task
 def estimate_cutting_parameters(compare_result):
     """Estimate cutting parameters based on comparison results."""
-    result = model.with_structured_output(Answer).invoke(
+    result = invoke(get_model().with_structured_output(Answer),
         [
             SystemMessage(content="You are a professional metal materials engineer. Please analyze the comparison results of two metal materials and answer the user's question."),
             HumanMessage(content=f"""
@@ -128,13 +145,15 @@ def estimate_cutting_parameters(compare_result):
 
             Provide your recommendations for target metal's all three parameters with explanations.
             """)
-        ])
+        ],
+        get_model(),
+    )
     return result
 
 @entrypoint(checkpointer=MemorySaver())
 def main(Q):
     # initialize the result logger
-    logger = ResultLogger("experiment_results", model)
+    logger = ResultLogger("experiment_results", get_model())
     
     # get the comparison result
     compare_result = metal_analysis().result()
@@ -149,10 +168,11 @@ def main(Q):
 
     return
 
-config = {
-    "configurable": {
-        "thread_id": 1
+if __name__ == "__main__":
+    config = {
+        "configurable": {
+            "thread_id": 1
+        }
     }
-}
-for each in main.stream("hah", config):
-    print(each)
\ No newline at end of file
+    for each in main.stream("hah", config):
+        print(each)
@@ -0,0 +1,324 @@
+"""
+Deterministic stand-ins of the chat models, embeddings and search client.
+
+They answer every structured-output schema of the pipeline (new_queries,
+Route, Check, Feedback, Answer, ...) from the text of the query itself, and
+sleep for a latency drawn from a configurable distribution. The same prompt
+always gets the same answer and the same latency, so benchmark runs are
+reproducible without any network access.
+"""
+import re
+import json
+import time
+import zlib
+import random
+import typing
+import threading
+from langchain_core.messages import AIMessage
+from langchain_core.embeddings import Embeddings, DeterministicFakeEmbedding
+from answer_lookup import TOOL_GRADES, PARAMETER_ALIASES, OPERATION_STEMS, canonical_tool
+from online_search import LocalSearchClient
+import tracing
+import governor
+
+METAL_PATTERN = re.compile(r"\b(\d\.\d{4}|[A-Z]{2,}-?\d+[A-Z]?)\b")
+
+FAKE_RANGES = {
+    "cutting speed": ("60-120 m/min", "20-30 m/min"),
+    "feed rate": ("0.05-0.25 mm/rev", "0.1-0.2 mm/rev"),
+    "cutting depth": ("0.5-2.0 mm", "0.15-0.25 mm"),
+}
+
+
+def stable_hash(*parts) -> int:
+    return zlib.crc32("\x1f".join(str(part) for part in parts).encode("utf-8"))
+
+
+class LatencyModel:
+    """
+    latency distribution of a fake backend.
+    :param kind: "fixed", "uniform" (median_ms +- spread_ms) or "lognormal" (median_ms, sigma)
+    """
+    def __init__(self, median_ms: float = 0.0, kind: str = "lognormal", sigma: float = 0.5,
+                 spread_ms: float = 0.0, seed: int = 0):
+        self.median_ms = median_ms
+        self.kind = kind
+        self.sigma = sigma
+        self.spread_ms = spread_ms
+        self.seed = seed
+
+    def sample_ms(self, *key) -> float:
+        if self.median_ms <= 0:
+            return 0.0
+        rng = random.Random(stable_hash(self.seed, *key))
+        if self.kind == "fixed":
+            return self.median_ms
+        if self.kind == "uniform":
+            return max(0.0, rng.uniform(self.median_ms - self.spread_ms, self.median_ms + self.spread_ms))
+        return rng.lognormvariate(0.0, self.sigma) * self.median_ms
+
+    def sleep(self, *key):
+        delay = self.sample_ms(*key)
+        if delay:
+            time.sleep(delay / 1000)
+
+
+def message_text(message) -> str:
+    """the text of a message, also when the content is a list of blocks"""
+    content = getattr(message, "content", message)
+    if isinstance(content, list):
+        return "".join(block.get("text", "") if isinstance(block, dict) else str(block) for block in content)
+    return str(content)
+
+
+def cached_prefix(messages) -> str:
+    """the prefix a provider would cache: up to the last cache_control block, otherwise the system prompt"""
+    parts, prefix = [], ""
+    for message in messages:
+        content = getattr(message, "content", message)
+        for block in content if isinstance(content, list) else [str(content)]:
+            parts.append(block.get("text", "") if isinstance(block, dict) else str(block))
+            if isinstance(block, dict) and block.get("cache_control"):
+                prefix = "\n".join(parts)
+    if not prefix and messages and getattr(messages[0], "type", None) == "system":
+        prefix = message_text(messages[0])
+    return prefix
+
+
+def extract_facts(text: str) -> dict:
+    """find the tool, metal, operation and parameters mentioned in a query"""
+    lower = text.lower()
+    operation = next(
+        (name for name, stems in OPERATION_STEMS.items() if any(stem in lower for stem in stems)),
+        None,
+    )
+    parameters = [
+        name for name, aliases in PARAMETER_ALIASES.items()
+        if any(len(alias) > 3 and alias in lower for alias in aliases)
+    ]
+    tool = canonical_tool(text)
+    metals = [m for m in METAL_PATTERN.findall(text) if m not in TOOL_GRADES]
+    return {
+        "tool": tool,
+        "metal": metals[0] if metals else None,
+        "operation": operation,
+        "parameters": parameters,
+    }
+
+
+class JsonSchema:
+    """a JSON schema (with_structured_output(dict)) in the place of a pydantic class, it builds plain dicts"""
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.__name__ = schema.get("title", "Output")
+
+    def __call__(self, **values):
+        return dict(values)
+
+
+def fill_schema(schema):
+    """a valid instance of any pydantic schema, used for the schemas without a dedicated answer"""
+    if isinstance(schema, JsonSchema):
+        return {name: f"fake {name}" for name in schema.schema.get("properties", {})}
+    values = {}
+    for name, field in schema.model_fields.items():
+        values[name] = _fake_value(field.annotation, name)
+    return schema(**values)
+
+
+def _fake_value(annotation, name):
+    origin = typing.get_origin(annotation)
+    args = typing.get_args(annotation)
+    if origin is typing.Literal:
+        return args[0]
+    if origin in (list, typing.List):
+        return [_fake_value(args[0] if args else str, name)]
+    if origin is typing.Union:
+        return _fake_value(next(arg for arg in args if arg is not type(None)), name)
+    if annotation in (int,):
+        return 1
+    if annotation in (float,):
+        return 1.0
+    if annotation in (bool,):
+        return True
+    return f"fake {name}"
+
+
+class FakeRateLimitError(Exception):
+    """the 429 of a fake provider"""
+    status_code = 429
+
+
+class FakeChatModel:
+    """
+    stand-in of a LangChain chat model, supports invoke(), bind_tools() and with_structured_output().
+    :param latency: a LatencyModel, or {schema name: LatencyModel} with an optional "default" entry
+    :param accept_rate: the share of references judged "relevant" by the rating stage
+    :param error_rate: the share of calls rejected with a FakeRateLimitError (429)
+    """
+    def __init__(self, model_name: str = "fake-chat", latency=None, accept_rate: float = 0.6, seed: int = 0,
+                 error_rate: float = 0.0):
+        self.model_name = model_name
+        self.temperature = 0.0
+        self.latency = latency or LatencyModel()
+        self.accept_rate = accept_rate
+        self.seed = seed
+        self.error_rate = error_rate
+        self._errors = random.Random(seed)
+        self.calls = {}
+        # the prompt prefixes seen so far, a repeated prefix is reported as cache-read tokens
+        self._prefixes = set()
+        self._lock = threading.Lock()
+
+    def _latency_for(self, stage):
+        if isinstance(self.latency, dict):
+            return self.latency.get(stage) or self.latency.get("default") or LatencyModel()
+        return self.latency
+
+    def _check_rate_limit(self):
+        if self.error_rate:
+            with self._lock:
+                rejected = self._errors.random() < self.error_rate
+            if rejected:
+                raise FakeRateLimitError(f"{self.model_name}: rate limit exceeded")
+
+    def _record(self, stage, prompt, output, prefix=""):
+        governor.report_usage((len(prompt) + len(output)) // 4)
+        with self._lock:
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+            cached = prefix in self._prefixes
+            self._prefixes.add(prefix)
+        span = tracing.current_span()
+        if span is not None:
+            prefix_tokens = len(prefix) // 4
+            span.add_usage(len(prompt) // 4, len(output) // 4,
+                           cache_read_tokens=prefix_tokens if cached else 0,
+                           cache_write_tokens=0 if cached else prefix_tokens)
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def with_structured_output(self, schema, **kwargs):
+        return _FakeStructuredModel(self, JsonSchema(schema) if isinstance(schema, dict) else schema)
+
+    def invoke(self, messages, config=None, **kwargs):
+        self._check_rate_limit()
+        prompt = "\n".join(message_text(m) for m in messages)
+        self._latency_for("text").sleep(self.model_name, "text", prompt)
+        content = f"Fake answer to: {message_text(messages[-1])[:200]}"
+        self._record("text", prompt, content, cached_prefix(messages))
+        return AIMessage(content=content)
+
+    def answer(self, schema, messages):
+        """the deterministic structured answer to the messages"""
+        query = message_text(messages[-1])
+        name = schema.__name__
+        facts = extract_facts(query)
+
+        if name == "new_queries":
+            if not facts["parameters"]:
+                return schema(query=[query])
+            return schema(query=[
+                f"What's the {parameter} for {facts['operation'] or 'turning'} {facts['metal'] or 'steel'} "
+                f"with {facts['tool'] or 'D10'} tool?"
+                for parameter in facts["parameters"]
+            ])
+        if name == "Route":
+            return schema(step="parameter_recommendation" if facts["parameters"] else "online_search")
+        if name == "Check":
+            complete = all([facts["tool"], facts["metal"], facts["operation"], facts["parameters"]])
+            return schema(
+                judge="yes" if complete else "no",
+                tool=facts["tool"] or "None",
+                metal=facts["metal"] or "UNKNOWN",
+                operation=facts["operation"] or "None",
+                questioned_parameters=", ".join(facts["parameters"]) or "None",
+            )
+        if name == "Feedback":
+            relevant = stable_hash(self.seed, self.model_name, query) % 1000 < self.accept_rate * 1000
+            return schema(thought="Fake relevance judgement.", judge="relevant" if relevant else "not relevant")
+        if name == "Answer":
+            parameter = facts["parameters"][0] if facts["parameters"] else "cutting speed"
+            tool_range, metal_range = FAKE_RANGES[parameter]
+            return schema(
+                questioned_parameter=parameter,
+                tool_range=tool_range,
+                metal_range=metal_range,
+                combined_range="conflicted",
+                thoughts="Fake recommendation, the metal source is the more conservative one.",
+            )
+        return fill_schema(schema)
+
+
+class _FakeStructuredModel:
+    # share of the latency before the first streamed chunk, and the characters per chunk
+    FIRST_CHUNK_SHARE = 0.3
+    CHUNK_CHARS = 12
+
+    def __init__(self, model: FakeChatModel, schema):
+        self.model = model
+        self.schema = schema
+
+    def _answer(self, messages):
+        result = self.model.answer(self.schema, messages)
+        output = json.dumps(result) if isinstance(result, dict) else result.model_dump_json()
+        return result, output
+
+    def invoke(self, messages, config=None, **kwargs):
+        self.model._check_rate_limit()
+        stage = self.schema.__name__
+        prompt = "\n".join(message_text(m) for m in messages)
+        self.model._latency_for(stage).sleep(self.model.model_name, stage, prompt)
+        result, output = self._answer(messages)
+        self.model._record(stage, prompt, output, cached_prefix(messages))
+        return result
+
+    def stream(self, messages, config=None, **kwargs):
+        """yield growing partial dicts like the JSON output parsers, the latency spread over the chunks"""
+        self.model._check_rate_limit()
+        stage = self.schema.__name__
+        prompt = "\n".join(message_text(m) for m in messages)
+        result, output = self._answer(messages)
+        values = result if isinstance(result, dict) else result.model_dump()
+        chunks = [
+            (name, str(value)[:end])
+            for name, value in values.items()
+            for end in range(self.CHUNK_CHARS, len(str(value)) + self.CHUNK_CHARS, self.CHUNK_CHARS)
+        ]
+        delay_ms = self.model._latency_for(stage).sample_ms(self.model.model_name, stage, prompt)
+        time.sleep(delay_ms * self.FIRST_CHUNK_SHARE / 1000)
+        partial = {}
+        for name, text in chunks:
+            time.sleep(delay_ms * (1 - self.FIRST_CHUNK_SHARE) / len(chunks) / 1000)
+            partial = {**partial, name: text}
+            yield partial
+        self.model._record(stage, prompt, output, cached_prefix(messages))
+
+
+class FakeEmbeddings(Embeddings):
+    """deterministic embeddings (same text, same vector) with an optional latency per call"""
+    def __init__(self, size: int = 256, latency: LatencyModel = None):
+        self._embedding = DeterministicFakeEmbedding(size=size)
+        self.latency = latency or LatencyModel()
+        self.calls = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        self.latency.sleep("embed_documents", len(texts))
+        return self._embedding.embed_documents(texts)
+
+    def embed_query(self, text):
+        self.calls += 1
+        self.latency.sleep("embed_query", text)
+        return self._embedding.embed_query(text)
+
+
+class FakeSearchClient(LocalSearchClient):
+    """LocalSearchClient with a latency drawn from a LatencyModel"""
+    def __init__(self, latency: LatencyModel = None, **kwargs):
+        super().__init__(**kwargs)
+        self.latency_model = latency or LatencyModel()
+
+    def search(self, query: str, **kwargs):
+        self.latency_model.sleep("search", query)
+        return super().search(query, **kwargs)
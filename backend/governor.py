@@ -0,0 +1,421 @@
+"""
+Process-wide rate limiting and retries of the provider calls.
+
+Every call to an LLM, embedding or search provider goes through
+governor.call(provider, func, ...) (governor.stream() for streamed output,
+invoke() for a LangChain runnable):
+
+  - token buckets per provider for the requests and the tokens per minute;
+    the tokens are estimated from the prompt and corrected with the usage the
+    provider reports once the call is done
+  - an AIMD concurrency limit per provider: +1/limit after every call which
+    succeeded in the usual time of its stage, halved on a 429 and cut by a
+    fifth when a call takes LATENCY_FACTOR times the usual time; only calls
+    started after the last decrease can decrease it again
+  - retries of 429s, timeouts, connection errors and 5xx with full-jitter
+    exponential backoff, at least the Retry-After of the provider
+
+The provider SDKs are built with max_retries=0 (providers.py), the retries
+happen here where they are counted against the limits.
+
+governor.utilization() returns the state per provider: the calls in flight
+against the concurrency limit, the requests and tokens of the last minute
+against their limits, throttles, retries, errors and the time spent waiting.
+
+The limits are LIMITS below, RAG_LIMITS overrides them per provider, e.g.
+    RAG_LIMITS='{"openai": {"rpm": 500, "tpm": 30000}, "tavily": {"max_concurrency": 2}}'
+"""
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Optional
+from pydantic import BaseModel
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.rate_limiters import BaseRateLimiter
+from langchain_core.tracers.context import register_configure_hook
+from providers import model_name_of
+from tracing import current_span, usage_of
+from metrics import LLM_CALLS, LLM_TOKENS
+
+
+class ProviderLimits(BaseModel):
+    # requests and tokens per minute, None for no limit
+    rpm: Optional[float] = None
+    tpm: Optional[float] = None
+    max_concurrency: int = 16
+    min_concurrency: int = 1
+
+
+LIMITS = {
+    "openai": ProviderLimits(rpm=5000, tpm=800000, max_concurrency=32),
+    "anthropic": ProviderLimits(rpm=1000, tpm=160000, max_concurrency=16),
+    "deepseek": ProviderLimits(rpm=600, max_concurrency=16),
+    "embeddings": ProviderLimits(rpm=3000, tpm=1000000, max_concurrency=16),
+    "tavily": ProviderLimits(rpm=100, max_concurrency=4),
+    "default": ProviderLimits(max_concurrency=64),
+}
+
+# tokens reserved for the output of a call, on top of the estimated prompt
+OUTPUT_TOKENS = 400
+MAX_RETRIES = 4
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 20.0
+THROTTLE_FACTOR = 0.5
+SLOW_FACTOR = 0.8
+LATENCY_FACTOR = 3.0
+LATENCY_ALPHA = 0.1
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+RETRYABLE_ERRORS = ("RateLimit", "Timeout", "Connection", "Overloaded", "InternalServer", "ServiceUnavailable")
+
+# the tokens reported by the provider for the call in progress
+_reported_tokens = ContextVar("governor_reported_tokens", default=None)
+
+
+def load_limits() -> dict:
+    limits = dict(LIMITS)
+    overrides = os.getenv("RAG_LIMITS")
+    if overrides:
+        for provider, values in json.loads(overrides).items():
+            limits[provider] = limits.get(provider, LIMITS["default"]).model_copy(update=values)
+    return limits
+
+
+def status_of(error) -> Optional[int]:
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def is_rate_limited(error) -> bool:
+    return status_of(error) == 429 or "RateLimit" in type(error).__name__
+
+
+def is_retryable(error) -> bool:
+    return status_of(error) in RETRYABLE_STATUS or any(name in type(error).__name__ for name in RETRYABLE_ERRORS)
+
+
+def retry_after(error) -> float:
+    """the Retry-After of the provider response in seconds, 0 if there is none"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def report_usage(tokens: int):
+    """count the tokens the provider reported for the governed call in progress"""
+    reported = _reported_tokens.get()
+    if reported is not None:
+        reported.append(tokens)
+
+
+class GovernorUsageHandler(BaseCallbackHandler):
+    """LangChain callback which reports the token usage of every LLM call to the governed call around it"""
+
+    def on_llm_end(self, response, **kwargs):
+        input_tokens, output_tokens, _, _ = usage_of(response)
+        if input_tokens or output_tokens:
+            report_usage(input_tokens + output_tokens)
+
+
+_usage_handler_var = ContextVar("governor_usage_handler", default=GovernorUsageHandler())
+register_configure_hook(_usage_handler_var, inheritable=True)
+
+
+class TokenBucket:
+    """per_minute units refilled continuously; a reservation may overdraw it and waits until it is covered"""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """take amount out of the bucket, return the seconds to wait before using it"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def adjust(self, amount: float):
+        """give back (positive) or take (negative) units after the fact"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level + amount)
+
+
+class ProviderState:
+    def __init__(self, name: str, limits: ProviderLimits):
+        self.name = name
+        self.limits = limits
+        self.requests = TokenBucket(limits.rpm) if limits.rpm else None
+        self.tokens = TokenBucket(limits.tpm) if limits.tpm else None
+        self.limit = float(limits.max_concurrency)
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self.decreased_at = 0.0
+        # EWMA of the call latency by stage (span name)
+        self.latency_ms = {}
+        # (time, tokens) of the calls of the last minute
+        self.window = deque()
+        self.calls = 0
+        self.throttled = 0
+        self.slow = 0
+        self.retries = 0
+        self.errors = 0
+        self.wait_ms = 0.0
+
+    def _trim_window(self, now):
+        while self.window and self.window[0][0] < now - 60:
+            self.window.popleft()
+
+    def _decrease(self, factor, started):
+        # one decrease per round of calls: those started before the last one saw the old limit
+        if started > self.decreased_at:
+            self.limit = max(float(self.limits.min_concurrency), self.limit * factor)
+            self.decreased_at = time.monotonic()
+
+
+class Governor:
+    def __init__(self, limits: dict = None):
+        self.limits = limits if limits is not None else load_limits()
+        self._providers = {}
+        self._lock = threading.Lock()
+
+    def configure(self, provider: str, **limits):
+        """change the limits of a provider, e.g. governor.configure("openai", rpm=500, tpm=30000)"""
+        with self._lock:
+            self.limits[provider] = self.limits.get(provider, self.limits["default"]).model_copy(update=limits)
+            self._providers.pop(provider, None)
+
+    def state(self, provider: str) -> ProviderState:
+        state = self._providers.get(provider)
+        if state is None:
+            with self._lock:
+                state = self._providers.get(provider)
+                if state is None:
+                    state = ProviderState(provider, self.limits.get(provider) or self.limits["default"])
+                    self._providers[provider] = state
+        return state
+
+    def _acquire(self, state: ProviderState, tokens: int) -> float:
+        """wait for the buckets and a concurrency slot, return the waited ms"""
+        start = time.perf_counter()
+        delay = state.requests.reserve(1) if state.requests else 0.0
+        if state.tokens:
+            delay = max(delay, state.tokens.reserve(tokens))
+        if delay:
+            time.sleep(delay)
+        with state.condition:
+            while state.in_flight >= max(state.limits.min_concurrency, int(state.limit)):
+                state.condition.wait()
+            state.in_flight += 1
+            waited = (time.perf_counter() - start) * 1000
+            state.wait_ms += waited
+        return waited
+
+    def _release(self, state: ProviderState):
+        with state.condition:
+            state.in_flight -= 1
+            state.condition.notify_all()
+
+    def _succeeded(self, state: ProviderState, stage: str, started: float, estimate: int, reported: list):
+        now = time.monotonic()
+        latency_ms = (now - started) * 1000
+        tokens = sum(reported) if reported else estimate
+        if reported and state.tokens:
+            state.tokens.adjust(estimate - tokens)
+        LLM_CALLS.inc(state.name, "ok")
+        LLM_TOKENS.inc(state.name, n=tokens)
+        with state.condition:
+            state.calls += 1
+            state.window.append((now, tokens))
+            state._trim_window(now)
+            usual = state.latency_ms.get(stage)
+            if usual is not None and latency_ms > LATENCY_FACTOR * usual:
+                state.slow += 1
+                state._decrease(SLOW_FACTOR, started)
+            else:
+                state.limit = min(float(state.limits.max_concurrency), state.limit + 1 / state.limit)
+            state.latency_ms[stage] = latency_ms if usual is None else usual + LATENCY_ALPHA * (latency_ms - usual)
+            state.condition.notify_all()
+
+    def _failed(self, state: ProviderState, error, attempt: int, started: float) -> Optional[float]:
+        """the backoff before the next attempt, None if the error is final"""
+        with state.condition:
+            if is_rate_limited(error):
+                state.throttled += 1
+                state._decrease(THROTTLE_FACTOR, started)
+            if not is_retryable(error) or attempt >= MAX_RETRIES:
+                state.errors += 1
+                LLM_CALLS.inc(state.name, "error")
+                return None
+            state.retries += 1
+        backoff = random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+        return max(backoff, retry_after(error))
+
+    def _annotate(self, waited_ms: float, attempts: int):
+        sp = current_span()
+        if sp is not None:
+            sp.set(governor_wait_ms=round(sp.attributes.get("governor_wait_ms", 0) + waited_ms, 3),
+                   governor_retries=sp.attributes.get("governor_retries", 0) + attempts)
+
+    def call(self, provider: str, func, *args, tokens: int = OUTPUT_TOKENS, **kwargs):
+        """func(*args, **kwargs) within the limits of provider, retried on throttling and transient errors"""
+        state = self.state(provider)
+        stage = current_span().name if current_span() is not None else ""
+        waited = 0.0
+        for attempt in range(MAX_RETRIES + 1):
+            waited += self._acquire(state, tokens)
+            started = time.monotonic()
+            reported = []
+            token = _reported_tokens.set(reported)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                backoff = self._failed(state, e, attempt, started)
+                if backoff is None:
+                    self._annotate(waited, attempt)
+                    raise
+                time.sleep(backoff)
+                continue
+            finally:
+                _reported_tokens.reset(token)
+                self._release(state)
+            self._succeeded(state, stage, started, tokens, reported)
+            self._annotate(waited, attempt)
+            return result
+
+    def stream(self, provider: str, func, *args, tokens: int = OUTPUT_TOKENS, **kwargs):
+        """like call() for a function returning an iterator, a call is only retried before its first item"""
+        state = self.state(provider)
+        stage = current_span().name if current_span() is not None else ""
+        waited = 0.0
+        for attempt in range(MAX_RETRIES + 1):
+            waited += self._acquire(state, tokens)
+            started = time.monotonic()
+            reported = []
+            token = _reported_tokens.set(reported)
+            yielded = False
+            try:
+                for item in func(*args, **kwargs):
+                    yielded = True
+                    yield item
+            except Exception as e:
+                backoff = None if yielded else self._failed(state, e, attempt, started)
+                if backoff is None:
+                    self._annotate(waited, attempt)
+                    raise
+                time.sleep(backoff)
+                continue
+            finally:
+                _reported_tokens.reset(token)
+                self._release(state)
+            self._succeeded(state, stage, started, tokens, reported)
+            self._annotate(waited, attempt)
+            return
+
+    def utilization(self) -> dict:
+        """the current state of every provider called so far"""
+        now = time.monotonic()
+        output = {}
+        for name, state in list(self._providers.items()):
+            with state.condition:
+                state._trim_window(now)
+                requests = len(state.window)
+                tokens = sum(count for _, count in state.window)
+                output[name] = {
+                    "in_flight": state.in_flight,
+                    "concurrency_limit": round(state.limit, 2),
+                    "max_concurrency": state.limits.max_concurrency,
+                    "requests_per_min": requests,
+                    "rpm_limit": state.limits.rpm,
+                    "rpm_utilization": round(requests / state.limits.rpm, 3) if state.limits.rpm else None,
+                    "tokens_per_min": tokens,
+                    "tpm_limit": state.limits.tpm,
+                    "tpm_utilization": round(tokens / state.limits.tpm, 3) if state.limits.tpm else None,
+                    "calls": state.calls,
+                    "throttled": state.throttled,
+                    "slow": state.slow,
+                    "retries": state.retries,
+                    "errors": state.errors,
+                    "wait_ms": round(state.wait_ms, 3),
+                }
+        return output
+
+    def reset(self):
+        """forget the state of every provider, e.g. between benchmark runs"""
+        with self._lock:
+            self._providers.clear()
+
+
+class GovernedRateLimiter(BaseRateLimiter):
+    """
+    the request bucket of a provider as LangChain rate_limiter, for models invoked
+    by code we do not call ourselves (the react agents of battlefield.py)
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+
+    def acquire(self, *, blocking: bool = True) -> bool:
+        state = governor.state(self.provider)
+        delay = state.requests.reserve(1) if state.requests else 0.0
+        if delay and not blocking:
+            state.requests.adjust(1)
+            return False
+        if delay:
+            time.sleep(delay)
+        return True
+
+    async def aacquire(self, *, blocking: bool = True) -> bool:
+        import asyncio
+        return await asyncio.to_thread(self.acquire, blocking=blocking)
+
+
+governor = Governor()
+
+
+def provider_of(model) -> str:
+    """the provider whose limits apply to a chat model, from its class or model name"""
+    model = getattr(model, "bound", model)
+    module = type(model).__module__
+    for provider in ("anthropic", "deepseek", "openai"):
+        if provider in module:
+            return provider
+    name = model_name_of(model).lower()
+    if name.startswith("claude"):
+        return "anthropic"
+    if name.startswith("deepseek"):
+        return "deepseek"
+    if name.startswith(("gpt", "o1", "o3", "o4")):
+        return "openai"
+    return "default"
+
+
+def estimate_tokens(messages, output_tokens: int = OUTPUT_TOKENS) -> int:
+    """prompt tokens estimated at 4 characters a token, plus the output reserve"""
+    if isinstance(messages, str):
+        chars = len(messages)
+    else:
+        chars = sum(len(str(getattr(message, "content", message))) for message in messages)
+    return chars // 4 + output_tokens
+
+
+def invoke(runnable, messages, model=None, **kwargs):
+    """runnable.invoke(messages) within the limits of the provider of model (by default the runnable itself)"""
+    return governor.call(provider_of(model if model is not None else runnable), runnable.invoke, messages,
+                         tokens=estimate_tokens(messages), **kwargs)
+
@@ -0,0 +1,283 @@
+"""
+Hedged requests for the structured-output stages (router, factors_check,
+rating, answer).
+
+hedged_invoke(stage, call, primary, secondary) runs call(primary); when it has
+not answered within the hedge delay of the stage, call(secondary) is sent as
+well and the first answer wins. A primary which fails before that is failed
+over to the secondary at once. The delay is the RAG_HEDGE_PERCENTILE (95 by
+default) of the recent latencies of the primary in the stage, HEDGE_DELAY_MS
+until MIN_SAMPLES of them are known.
+
+hedged_stream() does the same on the time to the first streamed chunk, the
+losing stream is closed at its next chunk. A losing invoke can not be
+interrupted in its thread, its answer is dropped.
+
+RAG_HEDGE=0 disables hedging. The secondary model is providers.get("hedge"),
+RAG_HEDGE_MODEL picks it (the Anthropic model by default); rating hedges with
+its own fallback model. hedge_stats() returns the hedge rate per stage.
+"""
+import os
+import time
+import queue
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from providers import model_name_of
+from tracing import current_span
+
+HEDGE_DELAY_MS = 2000.0
+MIN_SAMPLES = 20
+MAX_SAMPLES = 500
+
+
+def enabled() -> bool:
+    return os.getenv("RAG_HEDGE", "1") != "0"
+
+
+class StageStats:
+    def __init__(self, percentile: float):
+        self.percentile = percentile
+        self.latencies = deque(maxlen=MAX_SAMPLES)
+        self.calls = 0
+        self.hedged = 0
+        self.secondary_wins = 0
+        self.failovers = 0
+        self._lock = threading.Lock()
+
+    def observe(self, latency_ms: float):
+        with self._lock:
+            self.latencies.append(latency_ms)
+
+    def delay_ms(self) -> float:
+        with self._lock:
+            if len(self.latencies) < MIN_SAMPLES:
+                return HEDGE_DELAY_MS
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))]
+
+    def count(self, hedged: bool, secondary_won: bool, failover: bool = False):
+        with self._lock:
+            self.calls += 1
+            self.hedged += hedged
+            self.secondary_wins += secondary_won
+            self.failovers += failover
+
+    def to_dict(self) -> dict:
+        delay_ms = self.delay_ms()
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / self.calls, 3) if self.calls else 0.0,
+                "secondary_wins": self.secondary_wins,
+                "failovers": self.failovers,
+                "delay_ms": round(delay_ms, 3),
+            }
+
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+def stage_stats(stage: str) -> StageStats:
+    with _stats_lock:
+        if stage not in _stats:
+            _stats[stage] = StageStats(float(os.getenv("RAG_HEDGE_PERCENTILE", "95")))
+        return _stats[stage]
+
+
+def hedge_stats() -> dict:
+    with _stats_lock:
+        stages = dict(_stats)
+    return {stage: stats.to_dict() for stage, stats in sorted(stages.items())}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def hedge_model(primary):
+    """the secondary model of primary, None if hedging is off or it is the same model"""
+    if not enabled():
+        return None
+    import providers
+    secondary = providers.get("hedge")
+    if secondary is primary or model_name_of(secondary) == model_name_of(primary):
+        return None
+    return secondary
+
+
+def _submit(func, *args) -> Future:
+    """
+    run func in a thread of its own, with a copy of the caller's context (span, governor call).
+    not a bounded pool: a stream holds its thread until it ends, a pool would cap the concurrent
+    LLM calls in front of the governor and its queue time would count against the hedge delay
+    """
+    future = Future()
+    context = contextvars.copy_context()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(func, *args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True, name="hedge").start()
+    return future
+
+
+def _start_clock() -> dict:
+    """the start of the primary, set by clock["on_start"]() in its thread"""
+    clock = {"event": threading.Event(), "at": None}
+
+    def on_start():
+        clock["at"] = time.perf_counter()
+        clock["event"].set()
+    clock["on_start"] = on_start
+    return clock
+
+
+def _remaining(clock: dict, delay_ms: float) -> float:
+    """seconds left of the hedge delay, counted from the moment the primary started running"""
+    clock["event"].wait()
+    return max(0.0, delay_ms / 1000 - (time.perf_counter() - clock["at"]))
+
+
+def _annotate(stage, hedged, secondary_won, failover=False):
+    stage_stats(stage).count(hedged, secondary_won, failover)
+    sp = current_span()
+    if sp is not None and hedged:
+        sp.set(hedged=True, hedge_winner="secondary" if secondary_won else "primary", failover=failover)
+
+
+def hedged_invoke(stage: str, call, primary, secondary=None, with_model: bool = False):
+    """
+    call(primary), hedged with call(secondary) after the delay of the stage.
+    :param with_model: return (answer, the model which gave it)
+    """
+    answered = lambda result, model: (result, model) if with_model else result
+    if secondary is None or not enabled():
+        return answered(call(primary), primary)
+    stats = stage_stats(stage)
+    clock = _start_clock()
+
+    def run_primary():
+        clock["on_start"]()
+        return call(primary)
+
+    def observe(future):
+        if not future.cancelled() and future.exception() is None:
+            stats.observe((time.perf_counter() - clock["at"]) * 1000)
+
+    first = _submit(run_primary)
+    first.add_done_callback(observe)
+    wait([first], timeout=_remaining(clock, stats.delay_ms()))
+    if first.done() and first.exception() is None:
+        _annotate(stage, False, False)
+        return answered(first.result(), primary)
+
+    failover = first.done()
+    second = _submit(call, secondary)
+    pending = {second} if failover else {first, second}
+    error = first.exception() if failover else None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                for other in pending:
+                    other.cancel()
+                _annotate(stage, True, future is second, failover)
+                return answered(future.result(), secondary if future is second else primary)
+            error = future.exception()
+    _annotate(stage, True, False, failover)
+    raise error
+
+
+def _pump(stream, model, events: queue.Queue, stop: threading.Event, tag: str, on_first=None, on_start=None):
+    """
+    put the chunks of stream(model) on events until stop is set, on_start() is called before the stream is
+    opened, on_first() at its first chunk
+    """
+    if on_start is not None:
+        on_start()
+    iterator = None
+    first = True
+    try:
+        # opening the stream can fail too (e.g. building the messages), that is an error event as well
+        iterator = iter(stream(model))
+        for item in iterator:
+            if first and on_first is not None:
+                on_first()
+            first = False
+            events.put((tag, "item", item))
+            if stop.is_set():
+                break
+        else:
+            events.put((tag, "done", None))
+    except Exception as e:
+        events.put((tag, "error", e))
+    finally:
+        close = getattr(iterator, "close", None) if iterator is not None else None
+        if close is not None:
+            close()
+
+
+def hedged_stream(stage: str, stream, primary, secondary=None):
+    """iterate stream(primary), hedged with stream(secondary) when the first chunk is later than the delay of the stage"""
+    if secondary is None or not enabled():
+        yield from stream(primary)
+        return
+    stats = stage_stats(stage)
+    events = queue.Queue()
+    stops = {"primary": threading.Event(), "secondary": threading.Event()}
+    clock = _start_clock()
+    # the time to the first chunk of the primary is observed also when it loses
+    on_first = lambda: stats.observe((time.perf_counter() - clock["at"]) * 1000)
+    _submit(_pump, stream, primary, events, stops["primary"], "primary", on_first, clock["on_start"])
+    started = {"primary"}
+    failed = set()
+    failover = False
+
+    def start_secondary():
+        _submit(_pump, stream, secondary, events, stops["secondary"], "secondary")
+        started.add("secondary")
+
+    winner = None
+    try:
+        try:
+            event = events.get(timeout=_remaining(clock, stats.delay_ms()))
+        except queue.Empty:
+            start_secondary()
+            event = events.get()
+        while True:
+            tag, kind, value = event
+            if winner is None:
+                if kind == "error":
+                    failed.add(tag)
+                    if "secondary" not in started:
+                        failover = True
+                        start_secondary()
+                    elif failed == started:
+                        _annotate(stage, True, False, failover)
+                        raise value
+                else:
+                    winner = tag
+                    stops["secondary" if tag == "primary" else "primary"].set()
+                    _annotate(stage, "secondary" in started, tag == "secondary", failover)
+                    if kind == "done":
+                        return
+                    yield value
+            elif tag == winner:
+                if kind == "error":
+                    raise value
+                if kind == "done":
+                    return
+                yield value
+            event = events.get()
+    finally:
+        for stop in stops.values():
+            stop.set()
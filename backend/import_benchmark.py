@@ -0,0 +1,144 @@
+"""
+Import-time benchmark of the backend modules.
+
+Every module is imported in a fresh interpreter with `python -X importtime`,
+the cumulative import time (median of --runs) and the heaviest imported
+packages are reported, and the result is appended to a JSONL history so the
+numbers can be tracked over time. With --max-regression the command fails
+when a module got slower than the previous record by more than that share.
+
+Usage (from the project root):
+    python backend/import_benchmark.py
+    python backend/import_benchmark.py --runs 5 --max-regression 0.2
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+HISTORY_PATH = os.path.join(BACKEND_DIR, "benchmarks", "import_times.jsonl")
+
+MODULES = [
+    "RAG",
+    "parameter_recommendator",
+    "online_search",
+    "retriever",
+    "rater",
+    "metal_extractor",
+    "tool_extrator",
+    "result_logger",
+    "markdown2embedding",
+    "preprocessing",
+    "experiment",
+    "battlefield",
+]
+
+
+def parse_importtime(stderr: str) -> dict:
+    """{package: cumulative ms} from the `-X importtime` output"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        try:
+            times[parts[2].strip()] = int(parts[1]) / 1000
+        except ValueError:
+            continue
+    return times
+
+
+def measure(module: str, runs: int = 3, top: int = 10) -> dict:
+    totals = []
+    packages = {}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=BACKEND_DIR, capture_output=True, text=True,
+        )
+        if result.returncode != 0:
+            return {"error": result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"}
+        times = parse_importtime(result.stderr)
+        totals.append(times.get(module, 0.0))
+        packages = times
+    heaviest = sorted(
+        ((package, ms) for package, ms in packages.items() if package != module and "." not in package),
+        key=lambda item: -item[1],
+    )[:top]
+    return {
+        "cumulative_ms": round(statistics.median(totals), 1),
+        "top": [[package, round(ms, 1)] for package, ms in heaviest],
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_last_record(history_path):
+    if not os.path.exists(history_path):
+        return None
+    last = None
+    with open(history_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                last = json.loads(line)
+    return last
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-time benchmark of the backend modules.")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--max-regression", type=float, default=None,
+                        help="fail if a module is slower than the previous record by more than this share, e.g. 0.2")
+    args = parser.parse_args()
+
+    previous = load_last_record(args.history)
+    previous_modules = previous["modules"] if previous else {}
+    record = {
+        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "modules": {},
+    }
+
+    regressions = []
+    print(f"{'module':<26}{'import ms':>11}{'previous':>11}  heaviest imports")
+    for module in args.modules:
+        result = measure(module, args.runs)
+        record["modules"][module] = result
+        if "error" in result:
+            print(f"{module:<26}{'failed':>11}{'':>11}  {result['error']}")
+            continue
+        before = previous_modules.get(module, {}).get("cumulative_ms")
+        heaviest = ", ".join(f"{package} {ms:.0f}" for package, ms in result["top"][:4])
+        print(f"{module:<26}{result['cumulative_ms']:>11.1f}{before if before is not None else '-':>11}  {heaviest}")
+        if args.max_regression is not None and before and result["cumulative_ms"] > before * (1 + args.max_regression):
+            regressions.append(module)
+
+    if not args.no_save:
+        os.makedirs(os.path.dirname(args.history), exist_ok=True)
+        with open(args.history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+        print(f"\n💾 Import times appended to: {args.history}")
+
+    if regressions:
+        print(f"\n⚠️ import time regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
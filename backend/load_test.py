@@ -0,0 +1,215 @@
+"""
+End-to-end load test of the RAG entrypoint over HTTP.
+
+Starts the mock server of mock_server.py in the process (or uses the one at
+--url), points the real provider clients at it and drives RAG with N
+concurrent users in a closed loop: every user sends its next query as soon
+as the previous one is answered, for --duration seconds. Every --users level
+is run in turn and reported with its throughput, error count, latency
+percentiles and latency histogram, the requests and injected faults seen by
+the server and the governor utilization per provider.
+
+The workspace is the one of benchmark.py (metal documents, table mappings),
+the tool chunks go into an in-memory vector store embedded by the mock
+embeddings endpoint. The embeddings client sends strings instead of token
+arrays (no tiktoken download needed).
+
+Usage (from the project root):
+    python backend/load_test.py --users 1 8 32 --duration 30
+    python backend/load_test.py --users 16 --llm-latency-ms 900 --rate-limit-rate 0.05 --output load.json
+    python backend/load_test.py --url http://127.0.0.1:8765 --users 4    # an already running mock_server.py
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+import contextlib
+import benchmark
+from mock_server import MockServer, add_backend_arguments, build_backend, client_env
+
+# upper bounds of the latency histogram buckets in ms, the last bucket is open
+HISTOGRAM_BUCKETS_MS = [250, 500, 1000, 2000, 4000, 8000, 16000, 32000]
+HISTOGRAM_WIDTH = 40
+
+
+def histogram(latencies, buckets=HISTOGRAM_BUCKETS_MS) -> list:
+    """[(label, count)] of the latencies per bucket"""
+    counts = [0] * (len(buckets) + 1)
+    for latency in latencies:
+        counts[next((i for i, bound in enumerate(buckets) if latency <= bound), len(buckets))] += 1
+    labels = [f"<= {bound} ms" for bound in buckets] + [f"> {buckets[-1]} ms"]
+    return list(zip(labels, counts))
+
+
+def install_http_backends():
+    """the real clients against the mock server, the tool chunks in an in-memory store"""
+    import RAG
+    import providers
+    from langchain_core.documents import Document
+    from langchain_core.vectorstores import InMemoryVectorStore
+    from langchain_openai import OpenAIEmbeddings
+
+    providers.override("embeddings", OpenAIEmbeddings(check_embedding_ctx_length=False, max_retries=0))
+    vectorstores = {}
+    lock = threading.Lock()
+
+    def vectorstore_factory(persist_directory, collection_name):
+        with lock:
+            if collection_name not in vectorstores:
+                vectorstore = InMemoryVectorStore(embedding=providers.get("embeddings"))
+                vectorstore.add_documents([Document(page_content=chunk) for chunk in benchmark.fixture_tool_chunks()])
+                vectorstores[collection_name] = vectorstore
+            return vectorstores[collection_name]
+    providers.override("vectorstore_factory", vectorstore_factory)
+    return RAG
+
+
+def run_users(RAG, users: int, duration: float, queries: list) -> dict:
+    """closed loop of users for duration seconds, the latency and outcome of every query"""
+    results = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user(index):
+        i = index
+        while time.perf_counter() < deadline:
+            query = queries[i % len(queries)]
+            i += users
+            start = time.perf_counter()
+            try:
+                RAG.RAG.invoke(query, {"configurable": {"thread_id": str(uuid.uuid4())}})
+                error = None
+            except Exception as e:
+                error = f"{type(e).__name__}: {str(e)[:200]}"
+            with lock:
+                results.append({"latency_ms": (time.perf_counter() - start) * 1000, "error": error})
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=user, args=(index,), daemon=True) for index in range(users)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"elapsed_s": time.perf_counter() - start, "results": results}
+
+
+def summarize(users, run, server_stats, providers, coalescing) -> dict:
+    latencies = [result["latency_ms"] for result in run["results"] if result["error"] is None]
+    errors = [result["error"] for result in run["results"] if result["error"] is not None]
+    elapsed = run["elapsed_s"]
+    return {
+        "users": users,
+        "elapsed_s": round(elapsed, 3),
+        "completed": len(latencies),
+        "errors": len(errors),
+        "error_samples": sorted(set(errors))[:5],
+        "throughput_qps": round(len(latencies) / elapsed, 3) if elapsed else None,
+        "latency_ms": {f"p{p}": round(benchmark.percentile(latencies, p), 3) if latencies else None
+                       for p in (50, 95, 99)},
+        "histogram": histogram(latencies),
+        "server": server_stats,
+        "providers": providers,
+        "coalescing": coalescing,
+    }
+
+
+def run_load_test(args):
+    server = None
+    url = args.url
+    if url is None:
+        server = MockServer(build_backend(args)).start()
+        url = server.url
+    os.environ.update(client_env(url))
+
+    queries = benchmark.load_queries(args.queries) or benchmark.DEFAULT_QUERIES
+    workspace = tempfile.mkdtemp(prefix="rag-load-")
+    benchmark.create_workspace(workspace)
+    os.chdir(workspace)
+    RAG = install_http_backends()
+    metrics_server = None
+    if args.metrics_port is not None:
+        from metrics import MetricsServer
+        metrics_server = MetricsServer(port=args.metrics_port).start()
+        print(f"📊 Metrics at: {metrics_server.url}", file=sys.stderr)
+    from governor import governor
+    from hedging import reset_stats
+    from singleflight import reset_flights, flight_stats
+
+    summaries = []
+    with contextlib.nullcontext(sys.stdout) if args.verbose else open(os.devnull, "w") as output:
+        for users in args.users:
+            governor.reset()
+            reset_stats()
+            reset_flights()
+            if server is not None:
+                server.backend.reset_stats()
+            print(f"🔹 {users} users for {args.duration} s ...", file=sys.stderr)
+            with contextlib.redirect_stdout(output):
+                run = run_users(RAG, users, args.duration, queries)
+            server_stats = server.backend.stats if server is not None else None
+            summaries.append(summarize(users, run, server_stats, governor.utilization(), flight_stats()))
+    if server is not None:
+        server.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    return summaries
+
+
+def print_report(summaries):
+    print(f"\n{'users':>6}{'queries':>9}{'errors':>8}{'queries/s':>11}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for summary in summaries:
+        latency = {name: value if value is not None else float("nan") for name, value in summary["latency_ms"].items()}
+        print(f"{summary['users']:>6}{summary['completed']:>9}{summary['errors']:>8}{summary['throughput_qps']:>11.2f}"
+              f"{latency['p50']:>10.1f}{latency['p95']:>10.1f}{latency['p99']:>10.1f}")
+    for summary in summaries:
+        print(f"\n📊 {summary['users']} users, latency histogram:")
+        top = max((count for _, count in summary["histogram"]), default=0) or 1
+        for label, count in summary["histogram"]:
+            print(f"   {label:>12} {'█' * round(count / top * HISTOGRAM_WIDTH):<{HISTOGRAM_WIDTH}} {count}")
+        for error in summary["error_samples"]:
+            print(f"   ⚠️ {error}")
+        if summary["server"]:
+            print(f"   server: " + ", ".join(
+                f"{endpoint} {counts['requests']} ok / {counts['rate_limited']} 429 / {counts['errors']} 500"
+                for endpoint, counts in sorted(summary["server"].items())))
+        print(f"   governor: " + ", ".join(
+            f"{name} {provider['calls']} calls, {provider['retries']} retries, limit {provider['concurrency_limit']:.0f}"
+            for name, provider in summary["providers"].items()))
+        print(f"   coalesced: " + ", ".join(
+            f"{name} {level['shared']}/{level['calls']} shared" for name, level in summary["coalescing"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the RAG pipeline against the mock provider APIs.")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 4, 16], help="concurrent users, one run per value")
+    parser.add_argument("--duration", type=float, default=20, help="seconds per run")
+    parser.add_argument("--url", default=None, help="an already running mock_server.py, default: start one")
+    parser.add_argument("--queries", nargs="+", default=benchmark.DEFAULT_QUERY_PATTERNS,
+                        help="glob patterns of .jsonl / .json run logs, .jsonl or .txt query files")
+    parser.add_argument("--no-coalesce", action="store_true",
+                        help="run every repeated query in full (RAG_SINGLEFLIGHT=0)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="serve the pipeline metrics at http://127.0.0.1:PORT/metrics during the runs")
+    parser.add_argument("--output", default=None, help="write the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the pipeline's own prints")
+    args = add_backend_arguments(parser).parse_args()
+    if args.no_coalesce:
+        os.environ["RAG_SINGLEFLIGHT"] = "0"
+    # resolve the paths before moving into the workspace
+    args.queries = [os.path.abspath(pattern) for pattern in args.queries]
+    output = os.path.abspath(args.output) if args.output else None
+
+    summaries = run_load_test(args)
+    print_report(summaries)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=4)
+        print(f"\n💾 Report saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
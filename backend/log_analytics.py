@@ -0,0 +1,423 @@
+"""
+Columnar export and aggregate reports of the accumulated run logs.
+
+`compact` converts the rag_logs / experiment_results logs (the legacy one-JSON-
+per-run files and the JSONL logs of result_logger.py) into a Parquet dataset
+with one row per sub-query and typed Answer fields. It is incremental: the
+files (and, for JSONL logs, the runs) already exported are recorded in a
+manifest, and every call only writes a new part file with the new rows.
+
+`report` runs aggregate queries over the dataset with pyarrow.
+
+Usage (from the project root):
+    python backend/log_analytics.py compact rag_logs experiment_results
+    python backend/log_analytics.py report summary
+    python backend/log_analytics.py report conflicts --by tool
+    python backend/log_analytics.py report metal-misses --limit 20
+"""
+import os
+import re
+import ast
+import json
+import glob
+import time
+import uuid
+import argparse
+from datetime import datetime
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+DATASET_DIR = "log_dataset"
+MAX_PARTS = 64
+
+RAG_SCHEMA = pa.schema([
+    ("run_id", pa.string()),
+    ("source_file", pa.string()),
+    ("run_ts", pa.timestamp("s")),
+    ("model_name", pa.string()),
+    ("model_id", pa.string()),
+    ("temperature", pa.float64()),
+    ("original_query", pa.string()),
+    ("sub_query", pa.string()),
+    ("is_successful", pa.bool_()),
+    ("error", pa.string()),
+    ("route", pa.string()),
+    ("tool", pa.string()),
+    ("metal", pa.string()),
+    ("operation", pa.string()),
+    ("questioned_parameters", pa.string()),
+    ("metal_matched", pa.string()),
+    ("metal_score", pa.float64()),
+    ("answered", pa.bool_()),
+    ("questioned_parameter", pa.string()),
+    ("tool_range", pa.string()),
+    ("metal_range", pa.string()),
+    ("combined_range", pa.string()),
+    ("conflicted", pa.bool_()),
+    ("thoughts", pa.string()),
+    ("wall_ms", pa.float64()),
+    ("llm_calls", pa.int32()),
+    ("input_tokens", pa.int64()),
+    ("output_tokens", pa.int64()),
+    ("cache_read_tokens", pa.int64()),
+    ("cache_write_tokens", pa.int64()),
+    ("cache_hits", pa.int32()),
+])
+
+EXPERIMENT_SCHEMA = pa.schema([
+    ("run_id", pa.string()),
+    ("source_file", pa.string()),
+    ("run_ts", pa.timestamp("s")),
+    ("model_name", pa.string()),
+    ("model_id", pa.string()),
+    ("temperature", pa.float64()),
+    ("cutting_speed", pa.float64()),
+    ("cutting_depth", pa.float64()),
+    ("feed_rate", pa.float64()),
+    ("thoughts", pa.string()),
+])
+
+SCHEMAS = {"rag": RAG_SCHEMA, "experiments": EXPERIMENT_SCHEMA}
+
+# the keys of a run which are not sub-queries
+RUN_KEYS = {"run_id", "timestamp", "model_info", "Original Query", "Rewritten Queries", "spans", "run_start", "run_end"}
+
+ANSWER_FIELDS = ["questioned_parameter", "tool_range", "metal_range", "combined_range", "thoughts"]
+REPR_FIELD_PATTERN = re.compile(r"(\w+)=('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|None)")
+REPR_SUCCESS_PATTERN = re.compile(r"'is_successful': (True|False)")
+REPR_RESULT_PATTERN = re.compile(r"^\{'result': ('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")")
+
+
+################################################################################################################################
+# parsing
+
+def parse_timestamp(text):
+    try:
+        return datetime.strptime(str(text)[:15], "%Y%m%d_%H%M%S")
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_step_result(value):
+    """
+    parse a sub-query entry of a run log, either a dict (JSONL logs) or the repr string of the legacy logs.
+    :return: (answer dict or None, is_successful, error message or None)
+    """
+    if isinstance(value, dict):
+        result = value.get("result")
+        is_successful = value.get("is_successful")
+        if isinstance(result, dict) and "questioned_parameter" in result:
+            return result, is_successful, None
+        return None, is_successful, None if result is None else str(result)
+
+    text = str(value)
+    success = REPR_SUCCESS_PATTERN.search(text)
+    is_successful = success.group(1) == "True" if success else None
+    start = text.find("Answer(")
+    if start >= 0:
+        answer = {}
+        for name, literal in REPR_FIELD_PATTERN.findall(text[start:]):
+            if name in ANSWER_FIELDS and name not in answer:
+                answer[name] = ast.literal_eval(literal)
+        return answer, is_successful, None
+    result = REPR_RESULT_PATTERN.search(text)
+    return None, is_successful, ast.literal_eval(result.group(1)) if result else text
+
+
+def walk_spans(span):
+    yield span
+    for child in span.get("children", []):
+        yield from walk_spans(child)
+
+
+def sub_query_spans(spans):
+    """{sub-query text: sub_query span} of a span tree"""
+    if not spans:
+        return {}
+    return {
+        span["attributes"].get("query"): span
+        for span in walk_spans(spans)
+        if span.get("name") == "sub_query"
+    }
+
+
+def span_fields(span):
+    """the stage attributes and the totals of a sub_query span"""
+    if span is None:
+        return {}
+    counters = ("llm_calls", "input_tokens", "output_tokens", "cache_read_tokens", "cache_write_tokens", "cache_hits")
+    fields = {"wall_ms": span.get("wall_ms"), **{key: 0 for key in counters}}
+    for child in walk_spans(span):
+        for key in counters:
+            fields[key] += child.get(key, 0)
+        attributes = child.get("attributes", {})
+        if child["name"] == "llm_call_router":
+            fields["route"] = attributes.get("route")
+        elif child["name"] == "factors_check":
+            for key in ("tool", "metal", "operation", "questioned_parameters"):
+                fields[key] = attributes.get(key)
+        elif child["name"] == "fuzzy_match_metal":
+            fields["metal_matched"] = attributes.get("matched")
+            fields["metal_score"] = attributes.get("score")
+    return fields
+
+
+def rows_from_run(run, source_file):
+    """
+    convert a run (the legacy JSON layout: {"timestamp", "model_info", "Original Query", <sub-query>: result, ...})
+    into (rag rows, experiment rows)
+    """
+    model_info = run.get("model_info") or {}
+    base = {
+        "run_id": run.get("run_id") or run.get("timestamp"),
+        "source_file": source_file,
+        "run_ts": parse_timestamp(run.get("timestamp")),
+        "model_name": model_info.get("name"),
+        "model_id": model_info.get("model_id"),
+        "temperature": model_info.get("temperature") if isinstance(model_info.get("temperature"), (int, float)) else None,
+    }
+
+    if "Metal_analysis" in run or "Answer" in run:
+        answer = run.get("Answer") or {}
+        if not isinstance(answer, dict):
+            answer = {}
+        return [], [{
+            **base,
+            "cutting_speed": answer.get("Cutting_speed"),
+            "cutting_depth": answer.get("Cutting_depth"),
+            "feed_rate": answer.get("Feed_rate"),
+            "thoughts": answer.get("Thoughts"),
+        }]
+
+    spans = sub_query_spans(run.get("spans"))
+    rows = []
+    for key, value in run.items():
+        if key in RUN_KEYS:
+            continue
+        answer, is_successful, error = parse_step_result(value)
+        answer = answer or {}
+        row = {
+            **base,
+            "original_query": run.get("Original Query"),
+            "sub_query": key,
+            "is_successful": is_successful,
+            "error": error,
+            "answered": bool(answer),
+            **{field: answer.get(field) for field in ANSWER_FIELDS},
+            "conflicted": (str(answer.get("combined_range", "")).strip().lower() == "conflicted") if answer else None,
+            **span_fields(spans.get(key)),
+        }
+        rows.append(row)
+    return rows, []
+
+
+def read_jsonl_runs(path):
+    """group the records of a JSONL log by run id, in the legacy run layout"""
+    runs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            run = runs.setdefault(record["run_id"], {"run_id": record["run_id"], "timestamp": record["run_id"]})
+            if record["step"] == "run_start":
+                run["model_info"] = record["data"]
+            else:
+                run[record["step"]] = record["data"]
+    return runs
+
+
+################################################################################################################################
+# compaction
+
+def load_manifest(dataset_dir):
+    path = os.path.join(dataset_dir, "_manifest.json")
+    if not os.path.exists(path):
+        return {"files": {}}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(dataset_dir, manifest):
+    path = os.path.join(dataset_dir, "_manifest.json")
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def iter_log_files(sources):
+    for source in sources:
+        if os.path.isdir(source):
+            yield from sorted(glob.glob(os.path.join(source, "*.json")) + glob.glob(os.path.join(source, "*.jsonl")))
+        elif os.path.exists(source):
+            yield source
+
+
+def write_part(dataset_dir, kind, rows, schema):
+    if not rows:
+        return None
+    directory = os.path.join(dataset_dir, kind)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"part-{datetime.now().strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}.parquet")
+    pq.write_table(pa.Table.from_pylist(rows, schema=schema), path, compression="zstd")
+    return path
+
+
+def merge_parts(dataset_dir, kind, max_parts=MAX_PARTS):
+    """rewrite the part files of a table into one file once there are more than max_parts"""
+    directory = os.path.join(dataset_dir, kind)
+    parts = sorted(glob.glob(os.path.join(directory, "part-*.parquet")))
+    if len(parts) <= max_parts:
+        return
+    table = ds.dataset(parts, format="parquet", schema=SCHEMAS[kind]).to_table()
+    path = os.path.join(directory, f"part-{datetime.now().strftime('%Y%m%d_%H%M%S')}-{uuid.uuid4().hex[:8]}-merged.parquet")
+    pq.write_table(table, path, compression="zstd")
+    for part in parts:
+        os.remove(part)
+
+
+def compact(sources, dataset_dir=DATASET_DIR, stale_after: float = 3600):
+    """
+    export the new runs of the log files to the dataset.
+    :param stale_after: runs of a JSONL file without a run_end record are only exported
+                        when the file has not changed for stale_after seconds (crashed runs)
+    :return: (number of rag rows, number of experiment rows) written
+    """
+    os.makedirs(dataset_dir, exist_ok=True)
+    manifest = load_manifest(dataset_dir)
+    rag_rows, experiment_rows = [], []
+
+    for path in iter_log_files(sources):
+        stat = os.stat(path)
+        entry = manifest["files"].get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            continue
+
+        if path.endswith(".json"):
+            # the legacy files are written once per run
+            if entry:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                runs = [json.load(f)]
+            exported = []
+        else:
+            exported = entry["runs"] if entry else []
+            is_stale = time.time() - stat.st_mtime > stale_after
+            runs = [
+                run for run_id, run in read_jsonl_runs(path).items()
+                if run_id not in exported and ("run_end" in run or is_stale)
+            ]
+
+        for run in runs:
+            rows, experiments = rows_from_run(run, path)
+            rag_rows.extend(rows)
+            experiment_rows.extend(experiments)
+        manifest["files"][path] = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "runs": exported + [run["run_id"] for run in runs if "run_id" in run],
+        }
+
+    # the manifest is only saved once the rows are on disk
+    write_part(dataset_dir, "rag", rag_rows, RAG_SCHEMA)
+    write_part(dataset_dir, "experiments", experiment_rows, EXPERIMENT_SCHEMA)
+    save_manifest(dataset_dir, manifest)
+    merge_parts(dataset_dir, "rag")
+    merge_parts(dataset_dir, "experiments")
+    return len(rag_rows), len(experiment_rows)
+
+
+################################################################################################################################
+# reports
+
+def load_table(dataset_dir, columns, kind="rag"):
+    directory = os.path.join(dataset_dir, kind)
+    if not glob.glob(os.path.join(directory, "*.parquet")):
+        raise FileNotFoundError(f"No {kind} data in {dataset_dir}, run the compact command first")
+    # the schema fills the columns added since older parts were written with nulls
+    return ds.dataset(directory, format="parquet", schema=SCHEMAS[kind]).to_table(columns=columns)
+
+
+def report_summary(dataset_dir):
+    table = load_table(dataset_dir, ["run_id", "is_successful", "answered", "conflicted", "route", "wall_ms", "llm_calls",
+                                     "input_tokens", "cache_read_tokens"])
+    wall_ms = pc.drop_null(table["wall_ms"])
+    routes = table.group_by("route").aggregate([([], "count_all")]).sort_by([("count_all", "descending")])
+    return {
+        "sub_queries": table.num_rows,
+        "runs": pc.count_distinct(table["run_id"]).as_py(),
+        "success_rate": pc.mean(pc.cast(table["is_successful"], pa.float64())).as_py(),
+        "answered_rate": pc.mean(pc.cast(table["answered"], pa.float64())).as_py(),
+        "conflict_rate": pc.mean(pc.cast(table["conflicted"], pa.float64())).as_py(),
+        "wall_ms_p50_p95_p99": pc.tdigest(wall_ms, q=[0.5, 0.95, 0.99]).to_pylist() if len(wall_ms) else None,
+        "llm_calls_mean": pc.mean(table["llm_calls"]).as_py(),
+        # the share of the input tokens served from the providers' prompt caches
+        "cache_read_share": (pc.sum(table["cache_read_tokens"]).as_py() or 0) / (pc.sum(table["input_tokens"]).as_py() or 1),
+        "routes": dict(zip(routes["route"].to_pylist(), routes["count_all"].to_pylist())),
+    }
+
+
+def report_conflicts(dataset_dir, by="tool", limit=20):
+    """how often the tool and metal ranges are "conflicted", grouped by a column"""
+    table = load_table(dataset_dir, [by, "conflicted"])
+    table = table.filter(pc.is_valid(table["conflicted"]))
+    table = table.append_column("conflicted_n", pc.cast(table["conflicted"], pa.int64()))
+    grouped = table.group_by(by).aggregate([("conflicted_n", "sum"), ("conflicted_n", "count")])
+    rate = pc.divide(pc.cast(grouped["conflicted_n_sum"], pa.float64()), grouped["conflicted_n_count"])
+    grouped = grouped.append_column("conflict_rate", rate).sort_by([("conflicted_n_count", "descending")])
+    return [
+        {by: row[by], "answers": row["conflicted_n_count"], "conflicted": row["conflicted_n_sum"], "conflict_rate": row["conflict_rate"]}
+        for row in grouped.slice(0, limit).to_pylist()
+    ]
+
+
+def report_metal_misses(dataset_dir, limit=20):
+    """the extracted metal names which fuzzy_match_metal could not match"""
+    table = load_table(dataset_dir, ["metal", "metal_matched"])
+    misses = table.filter(pc.and_(pc.is_valid(table["metal"]), pc.is_null(table["metal_matched"])))
+    grouped = misses.group_by("metal").aggregate([([], "count_all")]).sort_by([("count_all", "descending")])
+    return [{"metal": row["metal"], "misses": row["count_all"]} for row in grouped.slice(0, limit).to_pylist()]
+
+
+def print_rows(rows):
+    if not rows:
+        print("No rows.")
+        return
+    columns = list(rows[0].keys())
+    widths = [max(len(str(column)), *(len(f"{row[column]}") for row in rows)) for column in columns]
+    print("  ".join(f"{column:<{width}}" for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(f"{str(row[column]):<{width}}" for column, width in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Columnar export and reports of the run logs.")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    compact_parser = subparsers.add_parser("compact", help="export the new runs to the Parquet dataset")
+    compact_parser.add_argument("sources", nargs="*", default=["rag_logs", "experiment_results"])
+    compact_parser.add_argument("--stale-after", type=float, default=3600)
+
+    report_parser = subparsers.add_parser("report", help="aggregate reports over the dataset")
+    report_parser.add_argument("name", choices=["summary", "conflicts", "metal-misses"])
+    report_parser.add_argument("--by", default="tool", help="group column of the conflicts report")
+    report_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "compact":
+        rag_rows, experiment_rows = compact(args.sources, args.dataset, args.stale_after)
+        print(f"💾 {rag_rows} sub-query rows and {experiment_rows} experiment rows added to {args.dataset}")
+    elif args.name == "summary":
+        print(json.dumps(report_summary(args.dataset), indent=4))
+    elif args.name == "conflicts":
+        print_rows(report_conflicts(args.dataset, args.by, args.limit))
+    else:
+        print_rows(report_metal_misses(args.dataset, args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,107 @@
+"""
+Chunking and embedding of the washed documents into the Chroma vector DBs.
+
+The text is encoded once; the character offset of every token is kept, so a
+chunk is a slice [start, end) of the source text instead of decoded tokens.
+Chunk ends are snapped back to the last paragraph break, sentence end, line
+break or space within max_tokens, consecutive chunks overlap by about
+--overlap tokens, and a __TABLEn__ marker with its description stays one chunk
+(when the text up to the next marker is longer, the marker starts its first chunk).
+The offsets (and the table id) are stored in the chunk metadata.
+
+Every document gets its own collection, registered in the collection catalog
+(catalog.py) with its vendor, operations and tool grades so that retrieval
+only searches the collections matching a query.
+
+Several documents are chunked in a process pool before they are embedded.
+The chunks are embedded in batches of --embed-batch through the governor, each
+chunk under a deterministic id, so a retried batch overwrites what it already
+wrote instead of adding duplicates.
+
+Usage (from the project root):
+    python backend/markdown2embedding.py
+    python backend/markdown2embedding.py backend/washed_documents/Summurized_Diametal_Turning.md --max-tokens 800 --overlap 80
+    python backend/markdown2embedding.py --dry-run    # chunk statistics only, no embeddings
+    python backend/markdown2embedding.py backend/washed_documents/Vendor_X_Tools.md --vendor "Vendor X" --operations milling drilling
+"""
 import os
 import re
-import tiktoken
+import argparse
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional
+from pydantic import BaseModel
 from dotenv import load_dotenv
-from langchain.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
-from langchain.docstore.document import Document
+import catalog
+import snapshot
 
 load_dotenv()
-openai_api_key = os.getenv("OPENAI_API_KEY")
 
-# multi-language suported by text-embedding-ada-002 
-tokenizer = tiktoken.encoding_for_model("text-embedding-ada-002")
+TABLE_PATTERN = re.compile(r"__TABLE(\d+)__[:\s]*")
+# break candidates from the best to the worst, a break is the position after the match
+BREAK_PATTERNS = [
+    re.compile(r"\n[ \t]*\n\s*"),
+    re.compile(r"[.!?。！？][\"')\]]*\s+"),
+    re.compile(r"\n\s*"),
+    re.compile(r"\s+"),
+]
+# a break is only taken if the chunk keeps at least this share of max_tokens
+MIN_FILL = 0.5
+DEFAULT_MAX_TOKENS = 1000
+DEFAULT_OVERLAP = 100
+DEFAULT_EMBED_BATCH = 256
+
+
+class Chunk(BaseModel):
+    text: str
+    start: int
+    end: int
+    tokens: int
+    table: Optional[int] = None
+
+    def metadata(self, source: str) -> dict:
+        metadata = {"source": source, "start": self.start, "end": self.end, "tokens": self.tokens}
+        if self.table is not None:
+            metadata["table"] = self.table
+        return metadata
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    """the tokenizer of text-embedding-ada-002 (multi-language suported), loaded on first use; None if unavailable"""
+    try:
+        import tiktoken
+        encoding_name = tiktoken.encoding_name_for_model("text-embedding-ada-002")
+        return snapshot.get_encoding(encoding_name) or tiktoken.get_encoding(encoding_name)
+    except (ImportError, OSError, ValueError) as e:
+        # no tiktoken, no network for the download (requests errors are OSErrors) or a download failing its hash check
+        print(f"⚠️ warning: no tokenizer ({type(e).__name__}), chunks are sized at 4 characters per token")
+        return None
+
+def token_offsets(text: str) -> list[int]:
+    """the character offset where each token of text starts, from a single encode"""
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        # offline estimate: a token every 4 characters
+        return list(range(0, len(text), 4))
+    tokens = tokenizer.encode(text, disallowed_special=())
+    offsets = []
+    position = 0
+    pending = b""
+    # the byte length of every token, a character starts where its first byte is
+    for token_bytes in tokenizer.decode_tokens_bytes(tokens):
+        offsets.append(position)
+        pending += token_bytes
+        decoded = pending.decode("utf-8", errors="ignore")
+        if decoded.encode("utf-8") == pending:
+            position += len(decoded)
+            pending = b""
+    return offsets
+
+def break_positions(text: str) -> list[list[int]]:
+    """the sorted break positions of every break level, computed once per document"""
+    return [[m.end() for m in pattern.finditer(text)] for pattern in BREAK_PATTERNS]
 
 def split_by_tables_combined(text):
     """
@@ -20,82 +111,166 @@ def split_by_tables_combined(text):
     return:
       ["Some text...", "__TABLE9__:The table presents cutting speeds...", " More text..."]
     """
-    pattern = r"(__TABLE\d+__[:\s]*)"
-    parts = re.split(pattern, text)
+    return [text[start:end] for start, end, _ in table_segments(text)]
+
+def table_segments(text):
+    """(start, end, table id or None) of the text parts, a table part runs from its marker to the next one"""
+    markers = list(TABLE_PATTERN.finditer(text))
+    if not markers:
+        return [(0, len(text), None)]
+    segments = []
+    if markers[0].start() > 0:
+        segments.append((0, markers[0].start(), None))
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        segments.append((marker.start(), end, int(marker.group(1))))
+    return segments
+
+def snap_end(start: int, limit: int, breaks: list[list[int]], min_end: int) -> int:
+    """the best break in (min_end, limit], limit itself if there is none"""
+    for positions in breaks:
+        i = bisect_right(positions, limit) - 1
+        if i >= 0 and positions[i] > min_end:
+            return positions[i]
+    return limit
+
+def chunk_text(text: str, max_tokens: int = DEFAULT_MAX_TOKENS, overlap: int = 0) -> list[Chunk]:
+    """chunks of text with their source offsets, tables kept whole"""
+    offsets = token_offsets(text)
+    breaks = break_positions(text)
+    overlap = max(0, min(overlap, max_tokens // 2))
+
+    def token_at(position):
+        return bisect_left(offsets, position)
+
+    def offset_of(token):
+        return offsets[token] if token < len(offsets) else len(text)
+
     chunks = []
-    i = 0
-    if parts and not re.match(pattern, parts[0]):
-        chunks.append(parts[0])
-        i = 1
-    while i < len(parts):
-        if i + 1 < len(parts):
-            combined = parts[i] + parts[i+1]
-            chunks.append(combined)
-            i += 2
-        else:
-            chunks.append(parts[i])
-            i += 1
+    for segment_start, segment_end, table in table_segments(text):
+        if not text[segment_start:segment_end].strip():
+            continue
+        tokens = token_at(segment_end) - token_at(segment_start)
+        if table is not None and tokens <= max_tokens:
+            chunks.append(Chunk(text=text[segment_start:segment_end], start=segment_start, end=segment_end,
+                                tokens=tokens, table=table))
+            continue
+        # text, or a table description running into more text than fits: the marker stays in the first chunk
+        start = segment_start
+        while start < segment_end:
+            first = token_at(start)
+            limit = min(offset_of(first + max_tokens), segment_end)
+            end = limit
+            if limit < segment_end:
+                min_end = offset_of(first + int(max_tokens * MIN_FILL))
+                end = snap_end(start, limit, breaks, min_end)
+            if text[start:end].strip():
+                chunks.append(Chunk(text=text[start:end], start=start, end=end,
+                                    tokens=token_at(end) - first,
+                                    table=table if start == segment_start else None))
+            if end >= segment_end:
+                break
+            # the next chunk starts overlap tokens earlier, at a word start, but always moves forward
+            next_start = end
+            if overlap:
+                back = offset_of(max(token_at(end) - overlap, first + 1))
+                words = breaks[-1]
+                i = bisect_left(words, back)
+                if i < len(words) and words[i] < end:
+                    next_start = words[i]
+            start = max(next_start, start + 1)
     return chunks
 
-def smart_chunking(text, max_tokens=1000):
+def smart_chunking(text, max_tokens=DEFAULT_MAX_TOKENS, overlap=0):
     """
     smart Chunking:
-      - first use split_by_tables_combined() to ensure the table blocks are complete;
-      - for non-table parts, if the token number exceeds max_tokens, further split into multiple sub-blocks.
+      - the table blocks (__TABLEn__ marker and its description) stay complete;
+      - the other parts are split at paragraph / sentence breaks into chunks of at most max_tokens.
     """
-    initial_chunks = split_by_tables_combined(text)
-    final_chunks = []
-    for chunk in initial_chunks:
-        # if the chunk starts with __TABLE\d+__, keep it
-        if re.match(r"^__TABLE\d+__", chunk):
-            final_chunks.append(chunk)
-        else:
-            tokens = tokenizer.encode(chunk)
-            if len(tokens) <= max_tokens:
-                final_chunks.append(chunk)
-            else:
-                # split into multiple sub-blocks by max_tokens
-                for i in range(0, len(tokens), max_tokens):
-                    sub_tokens = tokens[i:i+max_tokens]
-                    sub_chunk = tokenizer.decode(sub_tokens)
-                    final_chunks.append(sub_chunk)
-    return final_chunks
-
-def create_vector_DB(file_path):
-    # extract the filename from the file path
-    filename = os.path.splitext(os.path.basename(file_path))[0]
-    
-    # build the persistent directory and collection name
-    persist_directory = os.path.join("backend\\VectorDBs", filename)
-    collection_name = f"rag-{filename}"
+    return [chunk.text for chunk in chunk_text(text, max_tokens, overlap)]
+
+def chunk_file(file_path, max_tokens=DEFAULT_MAX_TOKENS, overlap=DEFAULT_OVERLAP) -> list[Chunk]:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return chunk_text(f.read(), max_tokens, overlap)
+
+def chunk_files(file_paths, max_tokens=DEFAULT_MAX_TOKENS, overlap=DEFAULT_OVERLAP, workers=None) -> dict:
+    """{file_path: chunks} of the documents, chunked in a process pool when there are several"""
+    if len(file_paths) <= 1 or workers == 1:
+        return {path: chunk_file(path, max_tokens, overlap) for path in file_paths}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(chunk_file, file_paths, [max_tokens] * len(file_paths), [overlap] * len(file_paths))
+        return dict(zip(file_paths, results))
+
+def register_document(file_path, chunks, vendor=None, operations=None):
+    """add the collection of the document to the catalog"""
+    with open(file_path, "r", encoding="utf-8") as f:
+        entry = catalog.describe_document(file_path, f.read(), vendor=vendor, operations=operations,
+                                          chunks=len(chunks) if chunks is not None else None)
+    catalog.register(entry)
+    print(f"🔹 Catalog: {entry.collection} (vendor {entry.vendor}, operations {entry.operations or 'any'}, "
+          f"tool grades {entry.tool_grades or 'any'})")
+
+def chunk_id(collection_name, chunk) -> str:
+    """the id of a chunk in its collection, the same on every run"""
+    return f"{collection_name}:{chunk.start}-{chunk.end}"
+
+def create_vector_DB(file_path, chunks=None, vendor=None, operations=None, embed_batch=DEFAULT_EMBED_BATCH):
+    import providers
+    from governor import governor
+
+    # build the persistent directory and collection name (same as the retrieval)
+    persist_directory, collection_name = catalog.collection_for(file_path)
 
     # check if the vector database already exists
     if os.path.exists(persist_directory):
         print(f"🔹 Vector database already exists at {persist_directory}, skipping creation.")
+        # an existing collection is still catalogued
+        register_document(file_path, chunks, vendor, operations)
         return
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        text_content = f.read()
-        
-    chunks = smart_chunking(text_content)
+    if chunks is None:
+        chunks = chunk_file(file_path)
     print(f"🔹 Got {len(chunks)} chunks without breaking a table.")
 
-    # convert the string chunks into Document objects
-    docs = [Document(page_content=chunk) for chunk in chunks]
-
-    # create the vector database, automatically calculate embeddings and persist to the specified directory
-    vectorstore = Chroma.from_documents(
-        documents=docs,
-        embedding=OpenAIEmbeddings(openai_api_key=openai_api_key),
-        persist_directory=persist_directory,
-        collection_name=collection_name,
-    )
+    # the embeddings client does not retry itself (providers.py), the governor retries one batch at a time;
+    # add_texts upserts, so a batch retried after a partial write leaves no duplicates
+    vectorstore = providers.get_vectorstore(persist_directory, collection_name)
+    for begin in range(0, len(chunks), embed_batch):
+        batch = chunks[begin:begin + embed_batch]
+        governor.call(
+            "embeddings", vectorstore.add_texts,
+            tokens=sum(chunk.tokens for chunk in batch),
+            texts=[chunk.text for chunk in batch],
+            # the metadata keeps the source offsets
+            metadatas=[chunk.metadata(file_path) for chunk in batch],
+            ids=[chunk_id(collection_name, chunk) for chunk in batch],
+        )
     vectorstore.persist()
     print(f"🔹 Vector database has been successfully persisted, saved to {persist_directory}.")
+    register_document(file_path, chunks, vendor, operations)
 
-washed_doc_path = ["backend\\washed_documents\\Summurized_Diametal_Turning.md",]
+washed_doc_path = [os.path.join("backend", "washed_documents", "Summurized_Diametal_Turning.md"),]
 
-for file_path in washed_doc_path:
-    create_vector_DB(file_path)
+def main():
+    parser = argparse.ArgumentParser(description="Chunk the washed documents and embed them into the vector DBs.")
+    parser.add_argument("paths", nargs="*", default=washed_doc_path)
+    parser.add_argument("--max-tokens", type=int, default=DEFAULT_MAX_TOKENS)
+    parser.add_argument("--overlap", type=int, default=DEFAULT_OVERLAP)
+    parser.add_argument("--workers", type=int, default=None, help="chunking processes, default: one per CPU")
+    parser.add_argument("--embed-batch", type=int, default=DEFAULT_EMBED_BATCH, help="chunks per embedding request")
+    parser.add_argument("--dry-run", action="store_true", help="only print the chunk statistics")
+    parser.add_argument("--vendor", default=None, help="default: taken from the file name")
+    parser.add_argument("--operations", nargs="+", default=None, help="default: taken from the file name")
+    args = parser.parse_args()
 
+    chunked = chunk_files(args.paths, args.max_tokens, args.overlap, args.workers)
+    for file_path, chunks in chunked.items():
+        tokens = [chunk.tokens for chunk in chunks]
+        tables = sum(chunk.table is not None for chunk in chunks)
+        print(f"🔹 {file_path}: {len(chunks)} chunks ({tables} tables), "
+              f"max {max(tokens, default=0)} / mean {sum(tokens) / max(len(tokens), 1):.0f} tokens")
+        if not args.dry_run:
+            create_vector_DB(file_path, chunks, args.vendor, args.operations, args.embed_batch)
 
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,15 @@
-from langgraph.func import task
+from tracing import traced_task, current_span
 
+import os
 import json
+import threading
 from rapidfuzz import fuzz
+import snapshot
+
+METAL_MAPPING_PATH = os.path.join("backend", "mappings", "metal_mappings.json")
+
+_lock = threading.Lock()
+_cache = {"path": None, "mtime": None, "metals": []}
 
 # class MetalName(BaseModel):
 #     metal_name: str = Field(
@@ -47,8 +55,61 @@ from rapidfuzz import fuzz
 
 #     return result.metal_name
 
-@task
-def fuzzy_match_metal(query: str, metal_mapping_path=r"backend\mappings\metal_mappings.json", threshold: int = 80):
+def read_metal_aliases(metal_mapping_path=METAL_MAPPING_PATH) -> list:
+    """[[main name, normalized main name, [normalized aliases], doc_path]] in the order of the mapping file"""
+    with open(metal_mapping_path, "r", encoding="utf-8") as f:
+        metal_data = json.load(f)
+    return [
+        [main_name, main_name.strip().lower(), [alias.strip().lower() for alias in info.get("aliases", [])],
+         info.get("doc_path")]
+        for main_name, info in metal_data.items()
+    ]
+
+
+def load_metal_aliases(metal_mapping_path=METAL_MAPPING_PATH) -> list:
+    """the metal aliases (or their fresh snapshot), only re-read when the mapping file changed on disk"""
+    metals = snapshot.load("metal_aliases", metal_mapping_path)
+    if metals is not None:
+        return metals
+    mtime = os.path.getmtime(metal_mapping_path)
+    with _lock:
+        if _cache["path"] != metal_mapping_path or _cache["mtime"] != mtime:
+            _cache.update(path=metal_mapping_path, mtime=mtime, metals=read_metal_aliases(metal_mapping_path))
+        return _cache["metals"]
+
+
+def best_metal_match(query: str, metal_mapping_path=METAL_MAPPING_PATH):
+    """the (main name, doc_path, score) of the best scoring name or alias, whatever the score"""
+    best_score = 0
+    best_main_name = None
+    best_doc_path = None
+
+    # the names and aliases are normalized once per mapping file
+    metals = load_metal_aliases(metal_mapping_path)
+
+    query_norm = query.strip().lower()
+
+    for main_name, main_name_norm, alias_norms, doc_path in metals:
+        # 1. fuzzy match with the main name
+        score = fuzz.ratio(query_norm, main_name_norm)
+        if score > best_score:
+            best_score = score
+            best_main_name = main_name
+            best_doc_path = doc_path
+
+        # 2. fuzzy match with each alias
+        for alias_norm in alias_norms:
+            score = fuzz.ratio(query_norm, alias_norm)
+            if score > best_score:
+                best_score = score
+                best_main_name = main_name
+                best_doc_path = doc_path
+
+    return best_main_name, best_doc_path, best_score
+
+
+@traced_task
+def fuzzy_match_metal(query: str, metal_mapping_path=METAL_MAPPING_PATH, threshold: int = 80):
     """
     fuzzy search for the metal name and its aliases in metal_data.
     
@@ -67,36 +128,11 @@ def fuzzy_match_metal(query: str, metal_mapping_path=r"backend\mappings\metal_ma
     :param threshold: the threshold of fuzzy matching score, default is 80.
     :return: if the match is successful, return (main name, doc_path, score); otherwise return (None, None, 0).
     """
-    best_score = 0
-    best_main_name = None
-    best_doc_path = None
-    matched_key = None
-
-    with open(metal_mapping_path, "r", encoding="utf-8") as f:
-        metal_data = json.load(f)
-
-    query_norm = query.strip().lower()
+    best_main_name, best_doc_path, best_score = best_metal_match(query, metal_mapping_path)
 
-    for main_name, info in metal_data.items():
-        # 1. fuzzy match with the main name
-        main_name_norm = main_name.strip().lower()
-        score = fuzz.ratio(query_norm, main_name_norm)
-        if score > best_score:
-            best_score = score
-            best_main_name = main_name
-            matched_key = main_name
-
-        # 2. fuzzy match with each alias
-        for alias in info.get("aliases", []):
-            alias_norm = alias.strip().lower()
-            score = fuzz.ratio(query_norm, alias_norm)
-            if score > best_score:
-                best_score = score
-                best_main_name = main_name
-                matched_key = main_name
+    current_span().set(metal=query, matched=best_main_name if best_score >= threshold else None, score=best_score)
 
-    if best_score >= threshold and matched_key:
-        best_doc_path = metal_data[matched_key].get("doc_path")
+    if best_score >= threshold and best_main_name:
         return best_main_name, best_doc_path, best_score
     else:
         return None, None, 0
@@ -0,0 +1,354 @@
+"""
+Numeric similarity index of the metal datasheets.
+
+build_index() reads every metal markdown of metal_mappings.json and extracts
+a feature vector: the composition in % (C, Si, Mn, Cr, Ni, Mo, ...), the
+hardness (HB, HRC), the tensile strength and the thermal properties. The
+vectors are standardized and saved as one .npz file. nearest() then returns
+the most similar metals in microseconds (a brute-force weighted distance over
+a few hundred rows), optionally only those with known parameters, so the LLM
+comparison of experiment.metal_analysis only runs against the best reference.
+
+Metals with known parameters are the metals of the precomputed answer lookup
+and of reference_metals.json ({"metal name": {"cutting speed": "97 m/min", ...}}),
+whose names may be aliases and are resolved to the main names of metal_mappings.json.
+
+Usage (from the project root):
+    python backend/metal_index.py build
+    python backend/metal_index.py query 1.4598 -k 5 --known
+"""
+import os
+import re
+import json
+import time
+import argparse
+import threading
+import warnings
+import numpy as np
+import snapshot
+from answer_lookup import load_answer_lookup, normalize
+
+METAL_MAPPING_PATH = os.path.join("backend", "mappings", "metal_mappings.json")
+METAL_INDEX_PATH = os.path.join("backend", "mappings", "metal_index.npz")
+REFERENCE_METALS_PATH = os.path.join("backend", "mappings", "reference_metals.json")
+
+ELEMENTS = ["C", "Si", "Mn", "P", "S", "Cr", "Ni", "Mo", "V", "W", "Co", "Cu", "Ti", "Al", "Nb", "N"]
+PROPERTIES = ["hardness_hb", "hardness_hrc", "tensile_strength_mpa", "thermal_conductivity",
+              "specific_heat", "thermal_expansion", "density"]
+FEATURES = ELEMENTS + PROPERTIES
+# the composition and the properties weigh the same in total
+WEIGHTS = np.array([1.0 / len(ELEMENTS)] * len(ELEMENTS) + [1.0 / len(PROPERTIES)] * len(PROPERTIES))
+
+NUMBER = r"(\d+(?:[.,]\d+)?)"
+RANGE = NUMBER + r"(?:\s*(?:-|–|to|bis|…|\.\.\.)\s*" + NUMBER + r")?"
+PROPERTY_PATTERNS = {
+    "tensile_strength_mpa": r"(?:tensile strength|zugfestigkeit|\bR\s?m\b)",
+    "thermal_conductivity": r"(?:thermal conductivity|wärmeleitfähigkeit|waermeleitfaehigkeit)",
+    "specific_heat": r"(?:specific heat|spezifische wärme|spez\. wärme)",
+    "thermal_expansion": r"(?:thermal expansion|wärmeausdehnung|ausdehnungskoeffizient)",
+    "density": r"(?:density|dichte)",
+}
+
+
+################################################################################################################################
+# extraction
+
+def to_float(text) -> float:
+    return float(str(text).replace(",", "."))
+
+
+def range_value(low, high=None) -> float:
+    """the middle of a range"""
+    return (to_float(low) + to_float(high)) / 2 if high else to_float(low)
+
+
+def cell_value(cell: str):
+    """the representative % of a composition cell: the middle of a range, half of a maximum, None if no number"""
+    cell = cell.strip()
+    if not cell or re.search(r"rest|bal", cell, re.IGNORECASE):
+        return None
+    match = re.search(RANGE, cell)
+    if not match:
+        return None
+    if match.group(2):
+        return range_value(match.group(1), match.group(2))
+    value = to_float(match.group(1))
+    if re.search(r"≤|<|max", cell, re.IGNORECASE):
+        return value / 2
+    return value
+
+
+def table_rows(text: str):
+    """the tables of a document as lists of rows of cells, markdown and HTML tables"""
+    tables = []
+    for html_table in re.findall(r"<table.*?</table>", text, re.IGNORECASE | re.DOTALL):
+        rows = []
+        for row in re.findall(r"<tr.*?</tr>", html_table, re.IGNORECASE | re.DOTALL):
+            cells = re.findall(r"<t[hd][^>]*>(.*?)</t[hd]>", row, re.IGNORECASE | re.DOTALL)
+            rows.append([re.sub(r"<[^>]+>", " ", cell).strip() for cell in cells])
+        tables.append(rows)
+
+    rows = []
+    for line in text.splitlines() + [""]:
+        line = line.strip()
+        if line.startswith("|"):
+            cells = [cell.strip() for cell in line.strip("|").split("|")]
+            if not all(re.fullmatch(r":?-+:?", cell) for cell in cells if cell):
+                rows.append(cells)
+        elif rows:
+            tables.append(rows)
+            rows = []
+    return tables
+
+
+def flatten_tables(text: str) -> str:
+    """the text with every HTML table row on one line, so a label and its value are on the same line"""
+    def row_line(match):
+        cells = re.findall(r"<t[hd][^>]*>(.*?)</t[hd]>", match.group(0), re.IGNORECASE | re.DOTALL)
+        return "\n" + " | ".join(re.sub(r"<[^>]+>", " ", cell).strip() for cell in cells) + "\n"
+    return re.sub(r"<tr.*?</tr>", row_line, text, flags=re.IGNORECASE | re.DOTALL)
+
+
+def extract_composition(text: str) -> dict:
+    """{element: %} from the composition tables (element symbols as header) or inline "Cr 16.0-18.0 %" """
+    values = {}
+    for rows in table_rows(text):
+        for i, header in enumerate(rows):
+            columns = {j: cell.strip(" %*") for j, cell in enumerate(header) if cell.strip(" %*") in ELEMENTS}
+            if len(columns) < 2:
+                continue
+            for row in rows[i + 1:]:
+                for j, element in columns.items():
+                    if j < len(row) and element not in values:
+                        value = cell_value(row[j])
+                        if value is not None:
+                            values[element] = value
+            break
+
+    inline = r"\b(" + "|".join(ELEMENTS) + r")\b\s*[:=]?\s*(≤|<|max\.?)?\s*" + RANGE + r"\s*%"
+    for element, limit, low, high in re.findall(inline, text):
+        if element not in values:
+            value = range_value(low, high or None)
+            values[element] = value / 2 if limit and not high else value
+    return values
+
+
+def extract_properties(text: str) -> dict:
+    """hardness, tensile strength and thermal properties, the first value found of each"""
+    flat = flatten_tables(text)
+    values = {}
+
+    hb = re.search(RANGE + r"\s*HB\b|\bHB\s*" + RANGE, flat)
+    if hb:
+        groups = [g for g in hb.groups() if g]
+        values["hardness_hb"] = range_value(*groups[:2])
+    hrc = re.findall(RANGE + r"\s*HRC\b|\bHRC\s*" + RANGE, flat)
+    if hrc:
+        # the hardened state, the highest value of the datasheet
+        values["hardness_hrc"] = max(range_value(*[g for g in groups if g][:2]) for groups in hrc)
+
+    for name, label in PROPERTY_PATTERNS.items():
+        match = re.search(label + r"[^\n\d]{0,80}?" + RANGE, flat, re.IGNORECASE)
+        if match:
+            values[name] = range_value(match.group(1), match.group(2))
+    return values
+
+
+def extract_features(text: str) -> np.ndarray:
+    """the feature vector of a datasheet, NaN where a value is missing"""
+    values = {**extract_composition(text), **extract_properties(text)}
+    return np.array([values.get(feature, np.nan) for feature in FEATURES], dtype=float)
+
+
+################################################################################################################################
+# index
+
+def build_index(mapping_path=METAL_MAPPING_PATH, index_path=METAL_INDEX_PATH) -> dict:
+    """extract the features of every metal document and save the standardized index"""
+    with open(mapping_path, "r", encoding="utf-8") as f:
+        metals = json.load(f)
+
+    names, doc_paths, aliases, rows = [], [], [], []
+    for name, info in metals.items():
+        doc_path = info.get("doc_path")
+        try:
+            with open(doc_path, "r", encoding="utf-8") as f:
+                rows.append(extract_features(f.read()))
+        except (OSError, TypeError):
+            print(f"⚠️ warning: no document for {name}: {doc_path}")
+            continue
+        names.append(name)
+        doc_paths.append(doc_path)
+        aliases.append(json.dumps(info.get("aliases", [])))
+
+    raw = np.vstack(rows) if rows else np.empty((0, len(FEATURES)))
+    with warnings.catch_warnings():
+        # the features found in no document
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nan_to_num(np.nanmean(raw, axis=0)) if len(raw) else np.zeros(len(FEATURES))
+        std = np.nanstd(raw, axis=0) if len(raw) else np.ones(len(FEATURES))
+    std = np.where(np.isfinite(std) & (std > 0), std, 1.0)
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    np.savez(index_path, names=np.array(names), doc_paths=np.array(doc_paths), aliases=np.array(aliases),
+             raw=raw, mean=mean, std=std, features=np.array(FEATURES))
+    coverage = {feature: int(np.isfinite(raw[:, i]).sum()) for i, feature in enumerate(FEATURES)}
+    return {"metals": len(names), "coverage": coverage}
+
+
+class MetalIndex:
+    def __init__(self, names, doc_paths, raw, mean, std, aliases=None):
+        self.names = [str(name) for name in names]
+        self.doc_paths = [str(path) for path in doc_paths]
+        self.raw = raw
+        self.mean = mean
+        self.std = std
+        # a missing value counts as the mean of the feature
+        self.vectors = np.nan_to_num((raw - mean) / std) * np.sqrt(WEIGHTS)
+        # the metals are found by their name or any alias of metal_mappings.json
+        self._positions = {}
+        for i, name in enumerate(self.names):
+            for alias in json.loads(str(aliases[i])) if aliases is not None else []:
+                self._positions.setdefault(normalize(alias), i)
+        self._positions.update({normalize(name): i for i, name in enumerate(self.names)})
+
+    def standardize(self, features: np.ndarray) -> np.ndarray:
+        return np.nan_to_num((features - self.mean) / self.std) * np.sqrt(WEIGHTS)
+
+    def position(self, name):
+        return self._positions.get(normalize(name))
+
+    def nearest(self, name=None, features=None, k: int = 5, candidates=None) -> list:
+        """
+        the k most similar metals to a metal of the index (name) or to a feature vector
+        :param candidates: only consider these metal names, e.g. the metals with known parameters
+        :return: [(name, doc_path, distance)], the closest first
+        """
+        if features is None:
+            position = self.position(name)
+            if position is None:
+                raise KeyError(f"Metal not in the index: {name}")
+            query = self.vectors[position]
+        else:
+            position = None
+            query = self.standardize(features)
+
+        distances = np.sqrt(((self.vectors - query) ** 2).sum(axis=1))
+        allowed = np.ones(len(self.names), dtype=bool)
+        if position is not None:
+            allowed[position] = False
+        if candidates is not None:
+            wanted = {normalize(c) for c in candidates}
+            allowed &= np.array([normalize(n) in wanted for n in self.names], dtype=bool)
+        distances = np.where(allowed, distances, np.inf)
+        k = min(k, int(allowed.sum()))
+        if k <= 0:
+            return []
+        order = np.argpartition(distances, k - 1)[:k]
+        order = order[np.argsort(distances[order])]
+        return [(self.names[i], self.doc_paths[i], float(distances[i])) for i in order]
+
+    def features_of(self, name) -> dict:
+        position = self.position(name)
+        return {f: float(v) for f, v in zip(FEATURES, self.raw[position]) if np.isfinite(v)}
+
+
+_cache = {"path": None, "mtime": None, "index": None}
+_lock = threading.Lock()
+
+
+def read_index(index_path=METAL_INDEX_PATH) -> dict:
+    """the arrays of the index file, the names as lists"""
+    with np.load(index_path) as data:
+        return {
+            "names": [str(name) for name in data["names"]],
+            "doc_paths": [str(path) for path in data["doc_paths"]],
+            "aliases": [str(alias) for alias in data["aliases"]] if "aliases" in data else None,
+            "raw": data["raw"],
+            "mean": data["mean"],
+            "std": data["std"],
+        }
+
+
+def to_index(data: dict) -> MetalIndex:
+    # the snapshot keeps the lists in one JSON blob next to the arrays
+    data = {**data.pop("meta", {}), **data}
+    return MetalIndex(data["names"], data["doc_paths"], data["raw"], data["mean"], data["std"], data["aliases"])
+
+
+def load_index(index_path=METAL_INDEX_PATH) -> MetalIndex:
+    """the index (or its fresh snapshot, the arrays used in place), only re-read when the file changed on disk"""
+    index = snapshot.load("metal_index", index_path, convert=to_index)
+    if index is not None:
+        return index
+    mtime = os.path.getmtime(index_path)
+    with _lock:
+        if _cache["path"] != index_path or _cache["mtime"] != mtime:
+            _cache.update(path=index_path, mtime=mtime, index=to_index(read_index(index_path)))
+        return _cache["index"]
+
+
+def known_metals(reference_path=REFERENCE_METALS_PATH, metal_mapping_path=METAL_MAPPING_PATH,
+                 threshold: int = 80) -> set:
+    """
+    the metals with known parameters: the precomputed answers and the reference metal file, the reference
+    names (e.g. the alias 1.4125) resolved to their main names as the index and the lookup key them
+    """
+    metals = {key.split("|")[1] for key in load_answer_lookup()}
+    if os.path.exists(reference_path):
+        from metal_extractor import best_metal_match
+        with open(reference_path, "r", encoding="utf-8") as f:
+            names = list(json.load(f))
+        for name in names:
+            main_name, _, score = (best_metal_match(name, metal_mapping_path) if os.path.exists(metal_mapping_path)
+                                   else (None, None, 0))
+            metals.add(normalize(main_name if main_name is not None and score >= threshold else name))
+    return metals
+
+
+def best_reference(doc_path: str, index_path=METAL_INDEX_PATH):
+    """the most similar metal with known parameters to the metal document, (name, doc_path, distance) or None"""
+    index = load_index(index_path)
+    with open(doc_path, "r", encoding="utf-8") as f:
+        features = extract_features(f.read())
+    known = known_metals()
+    if not known:
+        print("⚠️ warning: no metal with known parameters (answer lookup, reference_metals.json), no reference")
+        return None
+    matches = [
+        match for match in index.nearest(features=features, k=len(index.names), candidates=known)
+        if os.path.normpath(match[1]) != os.path.normpath(doc_path)
+    ]
+    return matches[0] if matches else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Numeric similarity index of the metal datasheets.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="extract the features of the metal documents")
+    build_parser.add_argument("--mapping", default=METAL_MAPPING_PATH)
+    build_parser.add_argument("--index", default=METAL_INDEX_PATH)
+    query_parser = subparsers.add_parser("query", help="the most similar metals")
+    query_parser.add_argument("metal")
+    query_parser.add_argument("-k", type=int, default=5)
+    query_parser.add_argument("--known", action="store_true", help="only metals with known parameters")
+    query_parser.add_argument("--index", default=METAL_INDEX_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        summary = build_index(args.mapping, args.index)
+        print(f"💾 {summary['metals']} metals indexed to: {args.index}")
+        print("   values found per feature:", summary["coverage"])
+        return
+
+    index = load_index(args.index)
+    start = time.perf_counter()
+    matches = index.nearest(args.metal, k=args.k, candidates=known_metals() if args.known else None)
+    elapsed_us = (time.perf_counter() - start) * 1e6
+    for name, doc_path, distance in matches:
+        print(f"{distance:8.3f}  {name}  ({doc_path})")
+    print(f"\n⏱️ {elapsed_us:.0f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""
+Prometheus metrics of the RAG pipeline.
+
+The counters and histograms are written without locks: every thread counts
+into its own shard (a dict only it writes to) and a scrape sums the shards.
+The shard of an ended thread is folded into a retired total, so the shards
+do not grow with the requests served on short-lived threads.
+They are filled from two places:
+
+  - every finished span tree (MetricsExporter, registered with tracing.py):
+    the latency and queue time per stage, the errors, LLM calls, tokens and
+    local cache hits per stage, the routes of llm_call_router, the judges of
+    factors_check, the misses of fuzzy_match_metal and the rating decisions
+  - the governed LLM calls (governor.py): the calls and tokens per provider
+
+The state of the governor, the hedging and the single-flight coalescing is
+read when scraped (collectors).
+
+RAG_METRICS_PORT starts the /metrics endpoint with the pipeline (RAG.py);
+RAG_METRICS_HOST is 127.0.0.1 by default.
+
+Usage (from the project root):
+    RAG_METRICS_PORT=9464 python backend/RAG.py
+    python backend/load_test.py --users 8 --metrics-port 9464
+    curl http://127.0.0.1:9464/metrics
+"""
+import os
+import bisect
+import weakref
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from tracing import add_exporter
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# seconds, from a local lookup to a slow LLM call with retries
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+TOKEN_KINDS = ["input", "output", "cache_read", "cache_write"]
+
+_metrics = {}
+_collectors = []
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class ShardHolder:
+    """the shard of one thread, held by its thread-local data only"""
+    def __init__(self):
+        self.shard = {}
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._local = threading.local()
+        # id -> shard of the live threads, the shards of the ended threads are folded into _retired
+        self._shards = {}
+        self._retired = {}
+        # reentrant: a finalizer may run on a garbage collection inside values()
+        self._lock = threading.RLock()
+        _metrics[name] = self
+
+    def _shard(self) -> dict:
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            # once per thread: the holder dies with the thread-local data of its thread
+            holder = self._local.holder = ShardHolder()
+            with self._lock:
+                self._shards[id(holder.shard)] = holder.shard
+            weakref.finalize(holder, self._retire, holder.shard)
+        return holder.shard
+
+    def _retire(self, shard: dict):
+        with self._lock:
+            self._shards.pop(id(shard), None)
+            self._merge(self._retired, shard)
+
+    def _merge(self, totals: dict, shard: dict):
+        raise NotImplementedError
+
+    def values(self) -> dict:
+        totals = {}
+        with self._lock:
+            # dict.copy() runs under the GIL, a shard is never seen half updated
+            shards = [self._retired.copy()] + [shard.copy() for shard in self._shards.values()]
+        for shard in shards:
+            self._merge(totals, shard)
+        return totals
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, n=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + n
+
+    def _merge(self, totals, shard):
+        for labels, value in shard.items():
+            totals[labels] = totals.get(labels, 0) + value
+
+    def samples(self) -> list:
+        return [f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}"
+                for labels, value in sorted(self.values().items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = list(buckets)
+
+    def observe(self, value: float, *labels):
+        shard = self._shard()
+        entry = shard.get(labels)
+        if entry is None:
+            # the counts per bucket (the last one is +Inf) and the sum
+            entry = shard[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def _merge(self, totals, shard):
+        # new lists: the shard's entries are still written by its thread
+        for labels, (counts, total) in shard.items():
+            if labels in totals:
+                totals[labels] = [[a + b for a, b in zip(totals[labels][0], counts)], totals[labels][1] + total]
+            else:
+                totals[labels] = [list(counts), total]
+
+    def samples(self) -> list:
+        lines = []
+        for labels, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+
+QUERIES = Counter("rag_queries_total", "RAG calls by outcome", ["status"])
+STAGE_DURATION = Histogram("rag_stage_duration_seconds", "wall time of the pipeline stages", ["stage"])
+STAGE_QUEUE = Histogram("rag_stage_queue_seconds", "time the stage tasks waited for a worker", ["stage"])
+STAGE_ERRORS = Counter("rag_stage_errors_total", "stages which raised", ["stage"])
+STAGE_LLM_CALLS = Counter("rag_stage_llm_calls_total", "LLM calls per stage", ["stage"])
+STAGE_TOKENS = Counter("rag_stage_tokens_total", "LLM tokens per stage, cache_read/cache_write are part of input",
+                       ["stage", "kind"])
+CACHE_HITS = Counter("rag_cache_hits_total", "local cache hits (answer lookup, speculative retrieval)", ["stage"])
+ROUTES = Counter("rag_routes_total", "queries per route of llm_call_router", ["route"])
+FACTORS_CHECKS = Counter("rag_factors_checks_total", "factors_check judges, no is a rejected query", ["judge"])
+METAL_MATCHES = Counter("rag_metal_matches_total", "fuzzy_match_metal results", ["outcome"])
+RATINGS = Counter("rag_ratings_total", "rating decisions of the retrieved references", ["decision"])
+LLM_CALLS = Counter("rag_llm_calls_total", "governed LLM and embedding calls per provider", ["provider", "outcome"])
+LLM_TOKENS = Counter("rag_llm_tokens_total", "tokens per provider, as reported or the estimate", ["provider"])
+
+
+def register_collector(collect):
+    """collect() -> [(name, type, help, [(labels dict, value)])], called on every scrape"""
+    _collectors.append(collect)
+
+
+def render() -> str:
+    lines = []
+    for metric in list(_metrics.values()):
+        lines += metric.render()
+    for collect in _collectors:
+        try:
+            families = collect()
+        except Exception as e:
+            print(f"⚠️ warning: metrics collector {collect.__name__} failed: {str(e)}")
+            continue
+        for name, kind, help, samples in families:
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            lines += [f"{name}{format_labels(labels, labels.values())} {format_value(value)}"
+                      for labels, value in samples if value is not None]
+    return "\n".join(lines) + "\n"
+
+
+################################################################################################################################
+# span trees
+
+class MetricsExporter:
+    """count every finished span tree into the stage metrics"""
+
+    def export(self, sp):
+        if sp.name == "rag":
+            QUERIES.inc(sp.status)
+        self.count(sp)
+
+    def count(self, sp):
+        if sp.wall_ms is None:
+            # still running when its root ended (a discarded speculative retrieval), not counted
+            return
+        STAGE_DURATION.observe(sp.wall_ms / 1000, sp.name)
+        if sp.wait_ms > 0:
+            STAGE_QUEUE.observe(sp.wait_ms / 1000, sp.name)
+        if sp.status == "error":
+            STAGE_ERRORS.inc(sp.name)
+        if sp.llm_calls:
+            STAGE_LLM_CALLS.inc(sp.name, n=sp.llm_calls)
+            for kind in TOKEN_KINDS:
+                tokens = getattr(sp, f"{kind}_tokens")
+                if tokens:
+                    STAGE_TOKENS.inc(sp.name, kind, n=tokens)
+        if sp.cache_hits:
+            CACHE_HITS.inc(sp.name, n=sp.cache_hits)
+
+        attributes = sp.attributes
+        if sp.name == "llm_call_router" and "route" in attributes:
+            ROUTES.inc(attributes["route"])
+        elif sp.name == "factors_check" and "judge" in attributes:
+            FACTORS_CHECKS.inc(attributes["judge"])
+        elif sp.name == "fuzzy_match_metal" and "matched" in attributes:
+            METAL_MATCHES.inc("matched" if attributes["matched"] else "miss")
+        elif sp.name == "rating" and "relevant" in attributes:
+            RATINGS.inc("relevant" if attributes["relevant"] else "not_relevant")
+        for child in sp.children:
+            self.count(child)
+
+
+add_exporter(MetricsExporter())
+
+
+################################################################################################################################
+# collectors
+
+def governor_metrics() -> list:
+    from governor import governor
+    providers = governor.utilization()
+
+    def family(name, kind, help, field, scale=1):
+        return (name, kind, help, [({"provider": provider}, state[field] * scale if state[field] is not None else None)
+                                   for provider, state in providers.items()])
+    return [
+        family("rag_governor_in_flight", "gauge", "calls in flight per provider", "in_flight"),
+        family("rag_governor_concurrency_limit", "gauge", "adaptive concurrency limit per provider", "concurrency_limit"),
+        family("rag_governor_rpm_utilization", "gauge", "requests of the last minute / rpm limit", "rpm_utilization"),
+        family("rag_governor_tpm_utilization", "gauge", "tokens of the last minute / tpm limit", "tpm_utilization"),
+        family("rag_governor_throttled_total", "counter", "429 responses per provider", "throttled"),
+        family("rag_governor_retries_total", "counter", "retried calls per provider", "retries"),
+        family("rag_governor_wait_seconds_total", "counter", "time spent waiting for the limits", "wait_ms", 0.001),
+    ]
+
+
+def hedging_metrics() -> list:
+    from hedging import hedge_stats
+    stages = hedge_stats()
+    return [
+        (name, kind, help, [({"stage": stage}, stats[field] * scale) for stage, stats in stages.items()])
+        for name, kind, help, field, scale in [
+            ("rag_hedge_calls_total", "counter", "hedged stage calls", "calls", 1),
+            ("rag_hedge_sent_total", "counter", "calls which sent the secondary request", "hedged", 1),
+            ("rag_hedge_secondary_wins_total", "counter", "calls answered by the secondary model", "secondary_wins", 1),
+            ("rag_hedge_failovers_total", "counter", "calls answered by the secondary after an error", "failovers", 1),
+            ("rag_hedge_delay_seconds", "gauge", "current hedge delay per stage", "delay_ms", 0.001),
+        ]
+    ]
+
+
+def singleflight_metrics() -> list:
+    from singleflight import flight_stats
+    levels = flight_stats()
+    return [
+        (name, kind, help, [({"level": level}, stats[field]) for level, stats in levels.items()])
+        for name, kind, help, field in [
+            ("rag_singleflight_calls_total", "counter", "coalescable calls per level", "calls"),
+            ("rag_singleflight_shared_total", "counter", "calls answered by another caller's run", "shared"),
+            ("rag_singleflight_in_flight", "gauge", "runs in flight per level", "in_flight"),
+        ]
+    ]
+
+
+register_collector(governor_metrics)
+register_collector(hedging_metrics)
+register_collector(singleflight_metrics)
+
+
+################################################################################################################################
+# endpoint
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/metrics":
+            status, content_type, data = 200, CONTENT_TYPE, render().encode("utf-8")
+        elif path == "/health":
+            status, content_type, data = 200, "text/plain", b"ok\n"
+        else:
+            status, content_type, data = 404, "text/plain", f"unknown path {self.path}\n".encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsServer:
+    """the /metrics endpoint in a background thread"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/metrics"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="metrics")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_from_env():
+    """start the endpoint once per process when RAG_METRICS_PORT is set, the server or None"""
+    global _server
+    port = os.getenv("RAG_METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = MetricsServer(os.getenv("RAG_METRICS_HOST", "127.0.0.1"), int(port)).start()
+            print(f"📊 Metrics at: {_server.url}")
+        return _server
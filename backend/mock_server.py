@@ -0,0 +1,418 @@
+"""
+Local mock HTTP server of the OpenAI, Anthropic and Tavily APIs.
+
+The real client stacks (ChatOpenAI, ChatAnthropic, OpenAIEmbeddings,
+TavilyClient) are pointed at it through their base URLs (client_env()), so
+a load test exercises the SDKs, their connection pools, SSE parsing and the
+governor's retries over HTTP:
+
+    POST /v1/chat/completions    OpenAI (and DeepSeek), plain and streamed
+    POST /v1/embeddings          deterministic vectors, float or base64
+    POST /v1/messages            Anthropic, plain and streamed
+    POST /search                 Tavily
+    GET  /stats                  requests, injected errors and 429s per endpoint
+
+Structured outputs (a json_schema response format, or a forced function /
+tool call) are answered with the schema-valid answers of fakes.py, based on
+the text of the last user message. The latency is drawn from a
+fakes.LatencyModel and spread over the chunks of a stream. A share of the
+requests is answered with a 500 (--error-rate) or a 429 with Retry-After
+(--rate-limit-rate).
+
+Usage (from the project root):
+    python backend/mock_server.py --port 8765 --llm-latency-ms 600 --rate-limit-rate 0.02
+    python backend/load_test.py --url http://127.0.0.1:8765 --users 1 8 32
+"""
+import json
+import time
+import uuid
+import base64
+import random
+import struct
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from fakes import FakeChatModel, FakeEmbeddings, FakeSearchClient, JsonSchema, LatencyModel, message_text
+
+# share of the latency before the first streamed chunk, and the characters per chunk (as fakes.py)
+FIRST_CHUNK_SHARE = 0.3
+CHUNK_CHARS = 12
+
+
+class MockBackend:
+    """the answers, latencies and injected faults of the mock server"""
+    def __init__(self, llm_latency: LatencyModel = None, embedding_latency: LatencyModel = None,
+                 search_latency: LatencyModel = None, error_rate: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 1.0, accept_rate: float = 0.6, embedding_size: int = 1536, seed: int = 0):
+        self.llm_latency = llm_latency or LatencyModel()
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.accept_rate = accept_rate
+        self.seed = seed
+        self.embeddings = FakeEmbeddings(size=embedding_size, latency=embedding_latency)
+        self.search_client = FakeSearchClient(latency=search_latency)
+        self._models = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def model(self, name: str) -> FakeChatModel:
+        with self._lock:
+            if name not in self._models:
+                # the latency is applied by the server, the fake only answers
+                self._models[name] = FakeChatModel(name, accept_rate=self.accept_rate, seed=self.seed)
+            return self._models[name]
+
+    def count(self, endpoint: str, outcome: str):
+        with self._lock:
+            counts = self.stats.setdefault(endpoint, {"requests": 0, "errors": 0, "rate_limited": 0})
+            counts[outcome] += 1
+
+    def fault(self):
+        """None, or the HTTP status of an injected failure"""
+        with self._lock:
+            draw = self._random.random()
+        if draw < self.rate_limit_rate:
+            return 429
+        if draw < self.rate_limit_rate + self.error_rate:
+            return 500
+        return None
+
+    def structured(self, model: str, name: str, schema: dict, text: str) -> dict:
+        result = self.model(model).answer(JsonSchema({**schema, "title": name}), [text])
+        return result if isinstance(result, dict) else result.model_dump()
+
+    def reset_stats(self):
+        with self._lock:
+            self.stats = {}
+
+
+def _text(content) -> str:
+    """the text of an OpenAI / Anthropic message content, a string or a list of blocks"""
+    if isinstance(content, list):
+        return "".join(message_text(block) if not isinstance(block, dict) else block.get("text", "") for block in content)
+    return str(content or "")
+
+
+def _chunks(text: str) -> list:
+    return [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)] or [""]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def backend(self) -> MockBackend:
+        return self.server.backend
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (ConnectionResetError, BrokenPipeError):
+            # the client closed a stream it no longer needs, e.g. the losing one of a hedged request
+            pass
+
+    # --- transport ---
+
+    def _json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_stream(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _send_event(self, data, event: str = None):
+        payload = data if isinstance(data, str) else json.dumps(data)
+        text = (f"event: {event}\n" if event else "") + f"data: {payload}\n\n"
+        encoded = text.encode("utf-8")
+        self.wfile.write(f"{len(encoded):x}\r\n".encode("ascii") + encoded + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def _fail(self, endpoint: str, status: int, anthropic: bool = False):
+        self.backend.count(endpoint, "rate_limited" if status == 429 else "errors")
+        kind = "rate_limit_error" if status == 429 else ("api_error" if anthropic else "server_error")
+        message = "mock rate limit exceeded" if status == 429 else "mock server error"
+        body = {"type": "error", "error": {"type": kind, "message": message}} if anthropic else \
+            {"error": {"message": message, "type": kind, "code": None}}
+        headers = {"retry-after": str(self.backend.retry_after)} if status == 429 else {}
+        self._json(status, body, headers)
+
+    def _stream_delays(self, delay_ms: float, chunks: int):
+        """the sleep before the first chunk and between the chunks, in seconds"""
+        return delay_ms * FIRST_CHUNK_SHARE / 1000, delay_ms * (1 - FIRST_CHUNK_SHARE) / max(chunks, 1) / 1000
+
+    # --- routing ---
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self._json(200, self.backend.stats)
+        elif self.path.rstrip("/") == "/health":
+            self._json(200, {"status": "ok"})
+        else:
+            self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?")[0].rstrip("/")
+        routes = {
+            "/v1/chat/completions": self.openai_chat,
+            "/chat/completions": self.openai_chat,
+            "/v1/embeddings": self.openai_embeddings,
+            "/embeddings": self.openai_embeddings,
+            "/v1/messages": self.anthropic_messages,
+            "/search": self.tavily_search,
+        }
+        handler = routes.get(path)
+        if handler is None:
+            self._json(404, {"error": {"message": f"unknown path {self.path}"}})
+            return
+        status = self.backend.fault()
+        if status is not None:
+            self._fail(path, status, anthropic=handler == self.anthropic_messages)
+            return
+        self.backend.count(path, "requests")
+        handler(body)
+
+    # --- OpenAI ---
+
+    def openai_chat(self, body: dict):
+        model = body.get("model", "mock")
+        messages = body.get("messages", [])
+        prompt = "\n".join(_text(message.get("content")) for message in messages)
+        last_user = next((_text(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), prompt)
+
+        response_format = body.get("response_format") or {}
+        tool_choice = body.get("tool_choice")
+        forced = tool_choice.get("function", {}).get("name") if isinstance(tool_choice, dict) else None
+        content, tool_call = None, None
+        if response_format.get("type") == "json_schema":
+            spec = response_format["json_schema"]
+            content = json.dumps(self.backend.structured(model, spec.get("name", "Output"), spec.get("schema", {}), last_user))
+        elif forced:
+            tool = next(t["function"] for t in body.get("tools", []) if t["function"]["name"] == forced)
+            arguments = json.dumps(self.backend.structured(model, forced, tool.get("parameters", {}), last_user))
+            tool_call = {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+                         "function": {"name": forced, "arguments": arguments}}
+        else:
+            content = f"Mock answer to: {last_user[:200]}"
+
+        output = content if content is not None else tool_call["function"]["arguments"]
+        usage = {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(output) // 4,
+                 "total_tokens": (len(prompt) + len(output)) // 4, "prompt_tokens_details": {"cached_tokens": 0}}
+        delay_ms = self.backend.llm_latency.sample_ms(model, prompt)
+        base = {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "created": int(time.time()), "model": model}
+        finish_reason = "tool_calls" if tool_call else "stop"
+
+        if not body.get("stream"):
+            time.sleep(delay_ms / 1000)
+            message = {"role": "assistant", "content": content, "refusal": None}
+            if tool_call:
+                message["tool_calls"] = [tool_call]
+            self._json(200, {**base, "object": "chat.completion", "usage": usage,
+                             "choices": [{"index": 0, "message": message, "finish_reason": finish_reason, "logprobs": None}]})
+            return
+
+        chunk = {**base, "object": "chat.completion.chunk"}
+        pieces = _chunks(output)
+        first, between = self._stream_delays(delay_ms, len(pieces))
+        time.sleep(first)
+        self._start_stream()
+        self._send_event({**chunk, "choices": [{"index": 0, "delta": {"role": "assistant", "content": "" if content is not None else None},
+                                                "finish_reason": None}]})
+        for i, piece in enumerate(pieces):
+            time.sleep(between)
+            if tool_call:
+                call = {"index": 0, "function": {"arguments": piece}}
+                if i == 0:
+                    call.update(id=tool_call["id"], type="function", function={"name": tool_call["function"]["name"], "arguments": piece})
+                delta = {"tool_calls": [call]}
+            else:
+                delta = {"content": piece}
+            self._send_event({**chunk, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._send_event({**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}]})
+        if (body.get("stream_options") or {}).get("include_usage"):
+            self._send_event({**chunk, "choices": [], "usage": usage})
+        self._send_event("[DONE]")
+        self._end_stream()
+
+    def openai_embeddings(self, body: dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        # token arrays are embedded by their text form, the vectors only have to be deterministic
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        vectors = self.backend.embeddings.embed_documents(texts)
+        base64_format = body.get("encoding_format") == "base64"
+        data = [
+            {"object": "embedding", "index": i,
+             "embedding": base64.b64encode(struct.pack(f"<{len(vector)}f", *vector)).decode("ascii")
+             if base64_format else vector}
+            for i, vector in enumerate(vectors)
+        ]
+        tokens = sum(len(text) // 4 for text in texts)
+        self._json(200, {"object": "list", "data": data, "model": body.get("model", "mock"),
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    # --- Anthropic ---
+
+    def anthropic_messages(self, body: dict):
+        model = body.get("model", "mock")
+        messages = body.get("messages", [])
+        prompt = "\n".join([_text(body.get("system"))] + [_text(message.get("content")) for message in messages])
+        last_user = next((_text(m.get("content")) for m in reversed(messages) if m.get("role") == "user"), prompt)
+
+        tool_choice = body.get("tool_choice") or {}
+        output_format = body.get("output_format") or (body.get("output_config") or {}).get("format") or {}
+        if tool_choice.get("type") == "tool":
+            tool = next(t for t in body.get("tools", []) if t["name"] == tool_choice["name"])
+            value = self.backend.structured(model, tool["name"], tool.get("input_schema", {}), last_user)
+            block = {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:24]}", "name": tool["name"], "input": value}
+            output, stop_reason = json.dumps(value), "tool_use"
+        elif output_format.get("type") == "json_schema":
+            schema = output_format.get("schema", {})
+            output = json.dumps(self.backend.structured(model, schema.get("title", "Output"), schema, last_user))
+            block, stop_reason = {"type": "text", "text": output}, "end_turn"
+        else:
+            output = f"Mock answer to: {last_user[:200]}"
+            block, stop_reason = {"type": "text", "text": output}, "end_turn"
+
+        usage = {"input_tokens": len(prompt) // 4, "output_tokens": len(output) // 4,
+                 "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        delay_ms = self.backend.llm_latency.sample_ms(model, prompt)
+        message = {"id": f"msg_{uuid.uuid4().hex[:24]}", "type": "message", "role": "assistant", "model": model,
+                   "stop_sequence": None}
+
+        if not body.get("stream"):
+            time.sleep(delay_ms / 1000)
+            self._json(200, {**message, "content": [block], "stop_reason": stop_reason, "usage": usage})
+            return
+
+        pieces = _chunks(output)
+        first, between = self._stream_delays(delay_ms, len(pieces))
+        time.sleep(first)
+        self._start_stream()
+        self._send_event({"type": "message_start", "message": {**message, "content": [], "stop_reason": None,
+                                                               "usage": {**usage, "output_tokens": 1}}}, "message_start")
+        start_block = {**block, "input": {}} if block["type"] == "tool_use" else {"type": "text", "text": ""}
+        self._send_event({"type": "content_block_start", "index": 0, "content_block": start_block}, "content_block_start")
+        for piece in pieces:
+            time.sleep(between)
+            delta = {"type": "input_json_delta", "partial_json": piece} if block["type"] == "tool_use" else \
+                {"type": "text_delta", "text": piece}
+            self._send_event({"type": "content_block_delta", "index": 0, "delta": delta}, "content_block_delta")
+        self._send_event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        self._send_event({"type": "message_delta", "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                          "usage": {"output_tokens": usage["output_tokens"]}}, "message_delta")
+        self._send_event({"type": "message_stop"}, "message_stop")
+        self._end_stream()
+
+    # --- Tavily ---
+
+    def tavily_search(self, body: dict):
+        start = time.perf_counter()
+        response = self.backend.search_client.search(body.get("query", ""))
+        self._json(200, {**response, "answer": None, "images": [], "follow_up_questions": None,
+                         "response_time": round(time.perf_counter() - start, 3)})
+
+
+class MockServer:
+    """the mock server in a background thread, for load tests in the same process"""
+    def __init__(self, backend: MockBackend = None, host: str = "127.0.0.1", port: int = 0):
+        self.backend = backend or MockBackend()
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.backend = self.backend
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True, name="mock-server")
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def client_env(url: str) -> dict:
+    """the environment variables which point the provider SDKs at the mock server at url"""
+    return {
+        "OPENAI_BASE_URL": f"{url}/v1",
+        "OPENAI_API_KEY": "mock",
+        "ANTHROPIC_BASE_URL": url,
+        "ANTHROPIC_API_KEY": "mock",
+        "DEEPSEEK_API_BASE": f"{url}/v1",
+        "DEEPSEEK_API_KEY": "mock",
+        "TAVILY_API_BASE_URL": url,
+        "TAVILY_API_KEY": "mock",
+    }
+
+
+def add_backend_arguments(parser):
+    parser.add_argument("--llm-latency-ms", type=float, default=600)
+    parser.add_argument("--llm-sigma", type=float, default=0.5)
+    parser.add_argument("--latency-kind", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--embedding-latency-ms", type=float, default=40)
+    parser.add_argument("--search-latency-ms", type=float, default=800)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of the requests answered with a 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of the requests answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="seconds, the Retry-After of the 429s")
+    parser.add_argument("--accept-rate", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def build_backend(args) -> MockBackend:
+    return MockBackend(
+        llm_latency=LatencyModel(args.llm_latency_ms, kind=args.latency_kind, sigma=args.llm_sigma, seed=args.seed),
+        embedding_latency=LatencyModel(args.embedding_latency_ms, kind="fixed"),
+        search_latency=LatencyModel(args.search_latency_ms, kind="fixed"),
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        accept_rate=args.accept_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI, Anthropic and Tavily HTTP server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = add_backend_arguments(parser).parse_args()
+
+    server = MockServer(build_backend(args), args.host, args.port)
+    print(f"🔹 Mock server listening on {server.url}, point the clients at it with:")
+    for name, value in client_env(server.url).items():
+        print(f"   export {name}={value}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Per-stage model tiering.
+
+Every LLM stage of the pipeline can run on its own model profile (provider,
+model, temperature, max tokens, timeout): a small fast model for the control
+steps (routing, factor extraction, relevance rating) and the frontier model
+for the recommendation itself. The assignment is read from
+backend/model_tiers.json (RAG_MODEL_TIERS overrides the path):
+
+    {
+        "profiles": {"fast": {"provider": "openai", "model": "gpt-4o-mini", "temperature": 0, "timeout": 20}},
+        "stages": {"llm_call_router": "fast", "rating": "fast"},
+        "alternatives": {"fast-control": {"llm_call_router": "fast", "factors_check": "fast", "rating": "fast"}}
+    }
+
+A stage without a profile keeps the model it is given (RAG's global llm).
+The stage names are the span names of tracing.py. tier_benchmark.py runs
+logged queries through the alternatives and compares them with the current
+stages, so a faster assignment is only locked in with evidence.
+"""
+import os
+import json
+import threading
+from typing import Optional
+from typing_extensions import Literal
+from pydantic import BaseModel, model_validator
+import providers
+
+TIERS_PATH = os.getenv("RAG_MODEL_TIERS", os.path.join("backend", "model_tiers.json"))
+STAGES = ("rewrite_query", "llm_call_router", "factors_check", "rating", "answer", "online_search")
+
+
+class ModelProfile(BaseModel):
+    provider: Literal["openai", "anthropic", "deepseek"] = "openai"
+    model: str
+    temperature: Optional[float] = None
+    max_tokens: Optional[int] = None
+    # seconds per request
+    timeout: Optional[float] = None
+
+
+class TierConfig(BaseModel):
+    profiles: dict[str, ModelProfile] = {}
+    # stage -> profile name
+    stages: dict[str, str] = {}
+    # alternative name -> {stage: profile name}, compared by tier_benchmark.py
+    alternatives: dict[str, dict[str, str]] = {}
+
+    @model_validator(mode="after")
+    def check_names(self):
+        for assignment in [self.stages, *self.alternatives.values()]:
+            for stage, profile in assignment.items():
+                if stage not in STAGES:
+                    raise ValueError(f"unknown stage {stage!r}, expected one of {STAGES}")
+                if profile not in self.profiles:
+                    raise ValueError(f"stage {stage!r} uses the unknown profile {profile!r}")
+        return self
+
+
+_lock = threading.Lock()
+_cache = {"path": None, "mtime": None, "config": TierConfig()}
+# the stage assignment set by set_assignment(), None for the one of the file
+_assignment = None
+
+
+def load_config(path=None) -> TierConfig:
+    """the tier configuration, only re-read when the file changed on disk; empty without file"""
+    path = path or TIERS_PATH
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    with _lock:
+        if _cache["path"] != path or _cache["mtime"] != mtime:
+            config = TierConfig()
+            if mtime is not None:
+                with open(path, "r", encoding="utf-8") as f:
+                    config = TierConfig.model_validate(json.load(f))
+            _cache.update(path=path, mtime=mtime, config=config)
+        return _cache["config"]
+
+
+def set_assignment(stages: Optional[dict]):
+    """use another {stage: profile name} assignment in this process, None restores the configured one"""
+    global _assignment
+    if stages is not None:
+        TierConfig(profiles=load_config().profiles, stages=stages)
+    _assignment = dict(stages) if stages is not None else None
+
+
+def assignment() -> dict:
+    return _assignment if _assignment is not None else load_config().stages
+
+
+def profile_for(stage: str) -> Optional[ModelProfile]:
+    name = assignment().get(stage)
+    return load_config().profiles[name] if name else None
+
+
+def model_for(stage: str, default=None):
+    """the model of the profile of stage, default if the stage has none"""
+    profile = profile_for(stage)
+    if profile is None:
+        return default
+    return providers.get_chat_model(profile)
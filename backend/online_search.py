@@ -1,47 +1,226 @@
-from tavily import TavilyClient
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
 from langchain_core.tools import tool
+from tracing import record_cache_hit
+from governor import governor, invoke
 
-client = TavilyClient("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")
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY", "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")
 
 
-def search_online(query: str):
-    response = client.search(
-        query=query
-    )
-    
-    search_results = response.get("results", [])
-    
+def normalize_query(query: str) -> str:
+    """the cache key of a query: lower-cased, whitespaces and trailing punctuation removed"""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+
+def query_variants(query: str) -> list:
+    """the search variants of a query, they are searched in parallel and merged"""
+    variants = [query]
+    if "machining" not in query.lower():
+        variants.append(f"{query} machining recommendation")
+    return variants
+
+
+class LocalSearchClient:
+    """
+    local stand-in of TavilyClient, used for offline load testing.
+    it returns `results_per_query` deterministic results after `latency` seconds.
+    """
+    def __init__(self, latency: float = 0.0, results_per_query: int = 5, content_chars: int = 2000):
+        self.latency = latency
+        self.results_per_query = results_per_query
+        self.content_chars = content_chars
+        self.calls = 0
+
+    def search(self, query: str, **kwargs):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        slug = normalize_query(query).replace(" ", "-")[:60]
+        content = (f"Local search result for '{query}'. " * 50)[:self.content_chars]
+        return {
+            "query": query,
+            "results": [
+                {
+                    "title": f"Result {i + 1} for {query}",
+                    "url": f"https://local.search/{slug}/{i + 1}",
+                    "content": content,
+                    "score": 1.0 - i * 0.1,
+                }
+                for i in range(self.results_per_query)
+            ],
+        }
+
+
+class SearchLayer:
+    """
+    search layer in front of the search client:
+      - TTL cache of the results, keyed on the normalized query
+      - per-call timeout, a timed out search returns no results instead of blocking
+      - parallel search of several queries on a shared thread pool
+      - the result content is trimmed before it goes into any prompt
+    """
+    def __init__(self, client=None, ttl: float = 3600, timeout: float = 10, max_workers: int = 4,
+                 max_content_chars: int = 200, max_entries: int = 1024):
+        self._client = client
+        self.ttl = ttl
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self.max_content_chars = max_content_chars
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="search")
+        self.stats = {"hits": 0, "misses": 0, "timeouts": 0, "errors": 0}
+
+    @property
+    def client(self):
+        """the Tavily client is only built on first use, with a connection pool sized for the workers"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from tavily import TavilyClient
+                    session = requests.Session()
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    # TAVILY_API_BASE_URL points the client at another endpoint, e.g. mock_server.py
+                    self._client = TavilyClient(TAVILY_API_KEY, session=session,
+                                                api_base_url=os.getenv("TAVILY_API_BASE_URL"))
+        return self._client
+
+    def set_client(self, client):
+        """swap the search client, e.g. for a LocalSearchClient, and clear the cache"""
+        with self._lock:
+            self._client = client
+            self._cache.clear()
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def _get_cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            expires_at, results = entry
+            if expires_at < time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return results
+
+    def _put_cached(self, key, results):
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, results)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def _trim(self, results):
+        return [
+            {
+                "title": result.get("title", "No title"),
+                "url": result.get("url", "No link"),
+                "content": (result.get("content") or "No content")[:self.max_content_chars],
+            }
+            for result in results
+        ]
+
+    def _fetch(self, query):
+        response = governor.call("tavily", self.client.search, query=query, timeout=self.timeout)
+        return self._trim(response.get("results", []))
+
+    def search_many(self, queries: list) -> dict:
+        """
+        search the queries in parallel.
+        :return: {query: [{"title", "url", "content"}, ...]}, timed out or failed queries get []
+        """
+        output = {}
+        futures = {}
+        for query in dict.fromkeys(queries):
+            key = normalize_query(query)
+            cached = self._get_cached(key)
+            if cached is not None:
+                self._count("hits")
+                record_cache_hit()
+                output[query] = cached
+            else:
+                self._count("misses")
+                futures[self._executor.submit(self._fetch, query)] = query
+
+        if futures:
+            done, not_done = wait(futures, timeout=self.timeout)
+            for future in not_done:
+                future.cancel()
+                self._count("timeouts")
+                print(f"⚠️ warning: online search timed out for: {futures[future]}")
+                output[futures[future]] = []
+            for future in done:
+                query = futures[future]
+                try:
+                    results = future.result()
+                except Exception as e:
+                    self._count("errors")
+                    print(f"⚠️ warning: online search failed for: {query}: {str(e)}")
+                    output[query] = []
+                    continue
+                self._put_cached(normalize_query(query), results)
+                output[query] = results
+        return output
+
+    def search(self, query: str) -> list:
+        return self.search_many([query])[query]
+
+
+search_layer = SearchLayer()
+
+
+def search_online(query: str, max_results: int = 8):
+    """search all variants of the query in parallel and merge the results without duplicated links"""
+    variant_results = search_layer.search_many(query_variants(query))
+
+    search_results = []
+    seen_urls = set()
+    for results in variant_results.values():
+        for result in results:
+            if result["url"] in seen_urls:
+                continue
+            seen_urls.add(result["url"])
+            search_results.append(result)
+    search_results = search_results[:max_results]
+
     summary_text = f"Original question: {query}\n\nHere are the search results summary:\n\n"
-    
+
     for i, result in enumerate(search_results, 1):
-        title = result.get("title", "No title")
-        content = result.get("content", "No content") 
-        url = result.get("url", "No link")
-        
-        summary_text += f"{i}. {title}\n"
-        summary_text += f"   Link: {url}\n"
-        summary_text += f"   Content summary: {content[:200]}...\n\n"
-    
+        summary_text += f"{i}. {result['title']}\n"
+        summary_text += f"   Link: {result['url']}\n"
+        summary_text += f"   Content summary: {result['content']}...\n\n"
+
     return summary_text, query
-    
+
 @tool
 def online_search(llm, query):
     """
     use online search to get the related information of the query.
-    
+
     Args:
         llm: the language model used to process the search results
         query: the query string to search
-    
+
     Returns:
         str: the summary of the search results
     """
     summary_text, query = search_online(query)
     prompt = f"Question: {query}\n\n{summary_text}\n\nBased on the search results above, please answer the original question."
-        
-    response = llm.invoke(
+
+    response = invoke(llm,
         [   SystemMessage(content="""
             You are an expert in manufacturing. You are helpful assistant that can answer questions based on the provided search results.
             Summarize the search results and provide a brief and concise answer to the original question.
@@ -50,4 +229,3 @@ def online_search(llm, query):
         ]
     )
     return response.content
-
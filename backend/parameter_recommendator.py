@@ -1,11 +1,20 @@
 from tool_extrator import tool_search
 from metal_extractor import fuzzy_match_metal
-from langgraph.func import task
-from langchain_core.messages import HumanMessage, SystemMessage
+from tracing import traced_task, span, record_cache_hit, current_span
+from langchain_core.messages import HumanMessage
+from prompt_cache import system_message, human_message
 from typing_extensions import Literal
 from pydantic import BaseModel, Field
 from langgraph.types import interrupt
 from online_search import online_search
+from answer_lookup import lookup_answer, make_key
+from reference_packer import pack_references
+from providers import model_name_of
+from streaming import stream_structured, emit
+from governor import invoke
+from hedging import hedged_invoke, hedge_model
+from model_tiers import model_for
+from singleflight import flights
 
 class Check(BaseModel):
     judge: Literal["yes","no"] = Field(
@@ -24,12 +33,7 @@ class Check(BaseModel):
         description="The questioned parameters if it exists in the query, None if not.",
     )
 
-@task
-def factors_check(llm, query):
-    """check if the query contains all necessary factors, and extract the metal name"""
-    result = llm.with_structured_output(Check).invoke(
-        [
-            SystemMessage(content="""
+CHECK_PROMPT = """
             You're an expert in manufacturing and metallurgy. Your task is to check if the query contains all necessary elements and accurately extract the metal information.
 
             Required elements to check:
@@ -62,10 +66,23 @@ def factors_check(llm, query):
                 "operation": "milling",
                 "questioned_parameters": "cutting speed"
             }
-            """),
-            HumanMessage(content=f"Query: {query}")
-        ]
-    )
+            """
+
+
+@traced_task
+def factors_check(llm, query):
+    """check if the query contains all necessary factors, and extract the metal name"""
+    def check(model):
+        return invoke(model.with_structured_output(Check),
+            [
+                system_message(model, CHECK_PROMPT),
+                HumanMessage(content=f"Query: {query}")
+            ],
+            model,
+        )
+    result = hedged_invoke("factors_check", check, llm, hedge_model(llm))
+    current_span().set(judge=result.judge, tool=result.tool, metal=result.metal,
+                       operation=result.operation, questioned_parameters=result.questioned_parameters)
     return result
 
 class Answer(BaseModel):
@@ -88,44 +105,18 @@ class Answer(BaseModel):
         If there is conflicted parameters between tool and metal, give a brief explanation and make a suggestion based both sources and your own knowledge.
         """,
     )
-    
-@task
-def parameter_recommendation(llm, query: str):
-    """main function of parameter recommendation"""
-    llm = llm.bind_tools([online_search])
-    check = factors_check(llm, query).result()
-    if check.judge == "no":
-        print("Please provide a complete query with operation, metal and tool information.")
-        return 
-    
-    print("-- Start to generate parameter recommendation:\n")
-    metal_name = check.metal
 
-    _, doc_path, _ = fuzzy_match_metal(metal_name).result()
-    
-    # read the metal document
-    metal_doc = None
-    if doc_path:
-        try:
-            with open(doc_path, 'r', encoding='utf-8') as f:
-                metal_doc = f.read()
-        except FileNotFoundError:
-            return f"No metal references found for {metal_name}", False
-
-    # search the tool references
-    tool_refs = tool_search(llm, query)
-    if tool_refs is None:
-        print("No valid tool references found.")
-
-    # merge the reference information
-    references = [metal_doc] if metal_doc else []
-    references.extend(tool_refs or [])
 
-    llm = llm.bind_tools([online_search])
-    
-    # create the conversation history list
-    messages = [
-        SystemMessage(content="""
+def format_answer(response: Answer) -> str:
+    return f"""
+    🔍 Questioned parameter: {response.questioned_parameter}
+    🔧 Metal's source: {response.metal_range}
+    🛠️  Tool's source: {response.tool_range}
+    🎯 Combined range: {response.combined_range}
+    💭 RagBot's thoughts: {response.thoughts}
+    """ 
+
+ANSWER_PROMPT = """
         You are a manufacturing expert. Your task is to recommend cutting parameters based on metal and tool references.
 
         Analysis Process (internal thought process, not for final answer):
@@ -183,22 +174,91 @@ def parameter_recommendation(llm, query: str):
         - Maintain numerical accuracy - no rounding or approximating
         - Explicitly state if any parameters conflict between sources
         - Keep final response concise and focused on parameters
-        """),
-    ]
-    
-    # add the initial query
-    messages.append(HumanMessage(content=f"Query: {query}\nReferences: {references}"))
+        """
+
+
+def coalescing_key(check: Check, metal_name):
+    """the answer key of the checked factors, None unless they are catalogued and name a single parameter"""
+    if not metal_name:
+        return None
+    return make_key(check.tool, metal_name, check.operation, check.questioned_parameters)
+
+
+@traced_task
+def parameter_recommendation(llm, query: str, use_lookup: bool = True):
+    """main function of parameter recommendation, use_lookup=False skips the precomputed answers"""
+    # the stages with a profile in model_tiers.json use its model instead of llm
+    answer_llm = model_for("answer", llm)
+    model_name = model_name_of(answer_llm)
+    llm = llm.bind_tools([online_search])
+    check = factors_check(model_for("factors_check", llm), query).result()
+    if check.judge == "no":
+        print("Please provide a complete query with operation, metal and tool information.")
+        return 
     
-    # get the initial answer
-    response = llm.with_structured_output(Answer).invoke(messages)
+    print("-- Start to generate parameter recommendation:\n")
+    metal_name = check.metal
 
-    llm_response =   f"""
-    🔍 Questioned parameter: {response.questioned_parameter}
-    🔧 Metal's source: {response.metal_range}
-    🛠️  Tool's source: {response.tool_range}
-    🎯 Combined range: {response.combined_range}
-    💭 RagBot's thoughts: {response.thoughts}
-    """ 
+    main_name, doc_path, _ = fuzzy_match_metal(metal_name).result()
+
+    # answer from the precomputed matrix if the combination is catalogued (a single questioned parameter)
+    if use_lookup and main_name:
+        cached = lookup_answer(check.tool, main_name, check.operation, check.questioned_parameters)
+        if cached:
+            record_cache_hit()
+            response = Answer(**cached)
+            print("\n🤖 RagBot's Answer (precomputed):\n\n", format_answer(response))
+            return response
+
+    def recommend():
+        # read the metal document
+        metal_doc = None
+        if doc_path:
+            try:
+                with open(doc_path, 'r', encoding='utf-8') as f:
+                    metal_doc = f.read()
+            except FileNotFoundError:
+                return f"No metal references found for {metal_name}", False
+
+        # search the tool references
+        tool_refs = tool_search(model_for("rating", llm), query)
+        if tool_refs is None:
+            print("No valid tool references found.")
+
+        # merge the reference information, deduplicated and within the token budget of the model
+        references = pack_references(metal_doc, tool_refs, model_name, metal_name=main_name)
+
+        answer_model = answer_llm.bind_tools([online_search])
+
+        # the conversation history for a model, the cache blocks of the messages depend on its provider
+        def build_messages(model):
+            messages = [system_message(model, ANSWER_PROMPT)]
+            # add the initial query
+            # the metal document is shared by the sub-queries on the same metal, so it goes first and is cached
+            if references.metal:
+                messages.append(human_message(model, f"References:\n{references.metal}",
+                                              f"{references.tools}\n\nQuery: {query}"))
+            else:
+                messages.append(HumanMessage(content=f"References:\n{references.tools}\n\nQuery: {query}"))
+            return messages
+
+        # get the initial answer
+        with span("answer", reference_tokens=references.tokens, reference_budget=references.budget,
+                  tables=references.tables, dropped_references=references.dropped,
+                  truncated_references=references.truncated):
+            # the fields are streamed to the caller as they are generated
+            return stream_structured(answer_model, Answer, build_messages, hedge_model(answer_model), query=query)
+
+    # the same factors in flight (another operator, or a near-duplicate sub-query) share one answer
+    response, shared = flights["answer"].do(coalescing_key(check, main_name), recommend)
+    if not isinstance(response, Answer):
+        return response
+    if shared:
+        current_span().set(coalesced=True)
+        # the deltas went to the caller of the shared answer, this caller gets the complete one
+        emit("answer", query=query, answer=response.model_dump())
+
+    llm_response = format_answer(response)
     print("\n🤖 RagBot's Answer:\n\n", llm_response)
     return response
     
@@ -0,0 +1,165 @@
+"""
+Offline precomputation of the tool x metal x operation x parameter answer matrix.
+
+Every cell is answered by the normal parameter_recommendation workflow and the
+Answer objects are written to the compact lookup file that the online path
+consults first (see answer_lookup.py).
+
+Usage (from the project root):
+    python backend/precompute.py --workers 4
+    python backend/precompute.py --metals 1.4125 CCR-1150 --parameters "cutting speed"
+
+The run can be interrupted at any time, finished cells are kept in the
+checkpoint file and skipped when the command is started again.
+"""
+import os
+import json
+import argparse
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dotenv import load_dotenv
+from langgraph.func import entrypoint
+import providers
+from metal_extractor import best_metal_match
+from parameter_recommendator import parameter_recommendation, Answer
+from answer_lookup import (
+    ANSWER_LOOKUP_PATH, TOOL_GRADES, OPERATIONS, PARAMETERS,
+    make_key, answer_to_row, save_answer_lookup,
+)
+
+METAL_MAPPING_PATH = os.path.join("backend", "mappings", "metal_mappings.json")
+CHECKPOINT_PATH = os.path.join("backend", "mappings", "answer_lookup.checkpoint.jsonl")
+
+
+def load_metals(metal_mapping_path=METAL_MAPPING_PATH):
+    """return the main metal names in metal_mappings.json"""
+    with open(metal_mapping_path, "r", encoding="utf-8") as f:
+        return list(json.load(f).keys())
+
+
+def resolve_metals(names, metal_mapping_path=METAL_MAPPING_PATH, threshold: int = 80) -> list:
+    """
+    the main names of the metals given on the command line (e.g. the alias 1.4125 -> CHRONIFER M-17C), as
+    fuzzy_match_metal resolves them on the online path, which keys the lookup on the main name
+    """
+    metals = []
+    for name in names:
+        main_name, _, score = best_metal_match(name, metal_mapping_path)
+        if main_name is None or score < threshold:
+            print(f"⚠️ warning: no metal of {metal_mapping_path} matches {name}, skipped")
+            continue
+        if main_name != name:
+            print(f"🔹 {name} -> {main_name}")
+        if main_name not in metals:
+            metals.append(main_name)
+    return metals
+
+
+def enumerate_cells(tools, metals, operations, parameters):
+    """yield (key, tool, metal, operation, parameter) for every cell of the matrix"""
+    for tool, metal, operation, parameter in itertools.product(tools, metals, operations, parameters):
+        key = make_key(tool, metal, operation, parameter)
+        if key is not None:
+            yield key, tool, metal, operation, parameter
+
+
+def build_query(tool, metal, operation, parameter) -> str:
+    """phrase the cell like the rewritten queries of RAG.rewrite_query"""
+    return f"What's the {parameter} for {operation} {metal} with {tool} tool?"
+
+
+def load_checkpoint(checkpoint_path=CHECKPOINT_PATH) -> dict:
+    """
+    read the finished cells from the checkpoint file.
+    :return: {key: row}, row is None for cells that could not be answered
+    """
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may be cut off by an interruption
+                continue
+            done[record["key"]] = record.get("row")
+    return done
+
+
+@entrypoint()
+def recommend_cell(inputs: dict):
+    return parameter_recommendation(inputs["llm"], inputs["query"], use_lookup=False).result()
+
+
+def precompute(llm, cells, workers=4, checkpoint_path=CHECKPOINT_PATH, lookup_path=ANSWER_LOOKUP_PATH, retry_failed=False):
+    """
+    answer every cell with bounded parallelism and write the lookup file.
+    :param cells: the output of enumerate_cells()
+    :param workers: the max number of cells processed at the same time
+    :param retry_failed: also rerun the cells which were recorded as unanswered
+    :return: the number of answered cells in the lookup file
+    """
+    done = load_checkpoint(checkpoint_path)
+    pending = [
+        cell for cell in cells
+        if cell[0] not in done or (retry_failed and done[cell[0]] is None)
+    ]
+    print(f"🔹 {len(done)} cells already in checkpoint, {len(pending)} cells to compute")
+
+    os.makedirs(os.path.dirname(checkpoint_path) or ".", exist_ok=True)
+    write_lock = threading.Lock()
+
+    def run(cell):
+        key, tool, metal, operation, parameter = cell
+        query = build_query(tool, metal, operation, parameter)
+        response = recommend_cell.invoke({"llm": llm, "query": query})
+        return key, answer_to_row(response) if isinstance(response, Answer) else None
+
+    with open(checkpoint_path, "a", encoding="utf-8") as checkpoint, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(run, cell): cell for cell in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            key = futures[future][0]
+            try:
+                key, row = future.result()
+            except Exception as e:
+                # not recorded, so the cell is retried on the next run
+                print(f"⚠️ warning: error occurred when computing {key}: {str(e)}")
+                continue
+            with write_lock:
+                checkpoint.write(json.dumps({"key": key, "row": row}, ensure_ascii=False) + "\n")
+                checkpoint.flush()
+                done[key] = row
+            print(f"[{i}/{len(pending)}] {key}: {'✅' if row else '❌'}")
+
+    rows = {key: row for key, row in done.items() if row is not None}
+    save_answer_lookup(rows, lookup_path)
+    print(f"\n💾 {len(rows)} answers saved to: {lookup_path}")
+    return len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the parameter recommendation answer matrix.")
+    parser.add_argument("--tools", nargs="+", default=TOOL_GRADES)
+    parser.add_argument("--metals", nargs="+", default=None, help="default: all metals in metal_mappings.json")
+    parser.add_argument("--operations", nargs="+", default=OPERATIONS)
+    parser.add_argument("--parameters", nargs="+", default=PARAMETERS)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--output", default=ANSWER_LOOKUP_PATH)
+    parser.add_argument("--retry-failed", action="store_true")
+    args = parser.parse_args()
+
+    load_dotenv()
+    llm = providers.get("openai")
+
+    metals = resolve_metals(args.metals) if args.metals else load_metals()
+    cells = list(enumerate_cells(args.tools, metals, args.operations, args.parameters))
+    precompute(llm, cells, workers=args.workers, checkpoint_path=args.checkpoint,
+               lookup_path=args.output, retry_failed=args.retry_failed)
+
+
+if __name__ == "__main__":
+    main()
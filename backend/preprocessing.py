@@ -1,13 +1,11 @@
 import re
-import pandas as pd
-import os
 from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 import json
+import providers
+from governor import invoke
 
 load_dotenv()
-openai_api_key = os.environ["OPENAI_API_KEY"]
 
 def LLM_summary_tables(prompt: str, table_id: int) -> str:
     sys_prompt = (
@@ -31,14 +29,11 @@ def LLM_summary_tables(prompt: str, table_id: int) -> str:
         ("user", "{prompt}")
     ])
     
-    chat_model = ChatOpenAI(
-        model="gpt-4o-mini",
-        temperature=0,
-    )
+    chat_model = providers.get("table_summarizer")
     
     pipeline = combined_prompt | chat_model
     
-    result = pipeline.invoke(prompt)
+    result = invoke(pipeline, prompt, chat_model)
 
     return {
         'table_id': table_id,
@@ -69,13 +64,14 @@ def remove_images(md_text):
     return md_text
 
 
-input_md_file = "Diametal_Turning.md"  
-output_md_file = "step0.md"
-with open(input_md_file, 'r', encoding='utf-8') as f:
-    md_text = f.read()
+if __name__ == "__main__":
+    input_md_file = "Diametal_Turning.md"  
+    output_md_file = "step0.md"
+    with open(input_md_file, 'r', encoding='utf-8') as f:
+        md_text = f.read()
 
-md_text = remove_images(md_text)
-md_text = replace_tables(md_text)
+    md_text = remove_images(md_text)
+    md_text = replace_tables(md_text)
 
-with open(output_md_file, 'w', encoding='utf-8') as f:
-    f.write(md_text)
\ No newline at end of file
+    with open(output_md_file, 'w', encoding='utf-8') as f:
+        f.write(md_text)
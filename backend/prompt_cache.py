@@ -0,0 +1,51 @@
+"""
+Message builders which keep the static prompt prefix cacheable by the provider.
+
+OpenAI caches the longest previously seen prefix of a prompt automatically
+(from 1024 tokens on), Anthropic caches the prefix up to a content block
+marked with cache_control. Both only help when the static part of a prompt
+comes first and is byte-identical on every call, so:
+
+  - system prompts are module constants, passed through system_message()
+  - the part that repeats across calls (e.g. the metal document of the
+    sub-queries of one query) goes before the part that changes
+  - for Anthropic models the end of every static part is a cache breakpoint
+    (at most 4 per request), below the provider minimum it is simply ignored
+
+The cached token counts come back in the usage metadata of the responses,
+tracing.TokenUsageHandler adds them to the spans as cache_read_tokens and
+cache_write_tokens.
+"""
+from langchain_core.messages import HumanMessage, SystemMessage
+from providers import model_name_of
+
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def supports_cache_control(llm) -> bool:
+    """Anthropic models take explicit cache breakpoints, OpenAI and DeepSeek cache automatically"""
+    bound = getattr(llm, "bound", llm)
+    return "anthropic" in type(bound).__name__.lower() or model_name_of(llm).lower().startswith("claude")
+
+
+def text_block(llm, text: str, cache: bool = False) -> dict:
+    block = {"type": "text", "text": text}
+    if cache and supports_cache_control(llm):
+        block["cache_control"] = CACHE_CONTROL
+    return block
+
+
+def system_message(llm, content: str) -> SystemMessage:
+    """the static system prompt, marked as a cache breakpoint for the models which need one"""
+    if supports_cache_control(llm):
+        return SystemMessage(content=[text_block(llm, content, cache=True)])
+    return SystemMessage(content=content)
+
+
+def human_message(llm, cached: str, dynamic: str) -> HumanMessage:
+    """a user message whose cached part is repeated across calls and comes first, dynamic last"""
+    if not cached:
+        return HumanMessage(content=dynamic)
+    if supports_cache_control(llm):
+        return HumanMessage(content=[text_block(llm, cached, cache=True), text_block(llm, dynamic)])
+    return HumanMessage(content=f"{cached}\n\n{dynamic}")
@@ -0,0 +1,173 @@
+"""
+Factories of the external backends used across the backend modules.
+
+Every client is built on first use and then shared, and the provider SDKs
+are only imported by the factory that needs them, so importing a module never
+pays for (or needs the API key of) a provider it does not call. override()
+replaces a backend for the whole process, which is how benchmark.py swaps in
+the fakes of fakes.py without any network access.
+
+The clients do not retry themselves (max_retries=0), governor.py retries
+within the rate limits of the provider.
+"""
+import os
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+_lock = threading.RLock()
+_instances = {}
+
+
+def _build_openai():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model="gpt-4o-2024-08-06", temperature=0.7, streaming=True, stream_usage=True, max_retries=0)
+
+
+def _build_anthropic():
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(model="claude-3-7-sonnet-20250219", temperature=0.3, max_retries=0)
+
+
+def _build_deepseek():
+    from langchain_deepseek import ChatDeepSeek
+    return ChatDeepSeek(model="deepseek-chat", temperature=1.0, max_retries=0)
+
+
+def _build_rater_fallback():
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(model="claude-3-5-haiku-20241022", max_retries=0)
+
+
+def _build_experiment():
+    # the metal analysis of experiment.py
+    # also tried: ChatOpenAI gpt-4.5-preview-2025-02-27, gpt-4o-2024-08-06 (temperature=0)
+    # and o3-mini-2025-01-31 (temperature not supported)
+    from langchain_anthropic import ChatAnthropic
+    return ChatAnthropic(model="claude-3-7-sonnet-20250219", temperature=0, max_retries=0)
+
+
+def _build_table_summarizer():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model="gpt-4o-mini", temperature=0, max_retries=0)
+
+
+def _build_hedge():
+    # the secondary model of the hedged requests (hedging.py)
+    return get(os.getenv("RAG_HEDGE_MODEL", "anthropic"))
+
+
+def _build_chat_model(profile):
+    """the chat model of a model_tiers.ModelProfile"""
+    options = {"max_retries": 0}
+    if profile.temperature is not None:
+        options["temperature"] = profile.temperature
+    if profile.provider == "anthropic":
+        from langchain_anthropic import ChatAnthropic
+        return ChatAnthropic(model=profile.model, max_tokens=profile.max_tokens or 1024,
+                             default_request_timeout=profile.timeout, **options)
+    if profile.max_tokens is not None:
+        options["max_tokens"] = profile.max_tokens
+    if profile.provider == "deepseek":
+        from langchain_deepseek import ChatDeepSeek
+        return ChatDeepSeek(model=profile.model, timeout=profile.timeout, **options)
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(model=profile.model, timeout=profile.timeout, streaming=True, stream_usage=True, **options)
+
+
+def _build_embeddings():
+    from langchain_openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"), max_retries=0)
+
+
+def _build_vectorstore(persist_directory, collection_name):
+    from langchain_community.vectorstores import Chroma
+    return Chroma(
+        embedding_function=get("embeddings"),
+        persist_directory=persist_directory,
+        collection_name=collection_name,
+    )
+
+
+_factories = {
+    "openai": _build_openai,
+    "anthropic": _build_anthropic,
+    "deepseek": _build_deepseek,
+    # the second evaluator of rater.rating
+    "rater_fallback": _build_rater_fallback,
+    "experiment": _build_experiment,
+    # the table summaries of preprocessing.py
+    "table_summarizer": _build_table_summarizer,
+    "hedge": _build_hedge,
+    "embeddings": _build_embeddings,
+    # called with (persist_directory, collection_name)
+    "vectorstore_factory": lambda: _build_vectorstore,
+    # called with a model_tiers.ModelProfile
+    "chat_model_factory": lambda: _build_chat_model,
+}
+
+
+def model_name_of(llm) -> str:
+    """the model name of a chat model, also through bind_tools/with_structured_output bindings"""
+    llm = getattr(llm, "bound", llm)
+    return getattr(llm, "model_name", None) or getattr(llm, "model", None) or ""
+
+
+def get(name: str):
+    """return the shared instance of the backend, build it on first use"""
+    instance = _instances.get(name)
+    if instance is None:
+        with _lock:
+            instance = _instances.get(name)
+            if instance is None:
+                instance = _factories[name]()
+                _instances[name] = instance
+    return instance
+
+
+def override(name: str, instance):
+    """replace a backend for the whole process, e.g. override("embeddings", FakeEmbeddings())"""
+    with _lock:
+        _instances[name] = instance
+        if name in ("embeddings", "vectorstore_factory"):
+            # the vector stores hold the old embedding function
+            for key in [key for key in _instances if key.startswith("vectorstore:")]:
+                del _instances[key]
+        if name == "chat_model_factory":
+            for key in [key for key in _instances if key.startswith("chat_model:")]:
+                del _instances[key]
+
+
+def reset():
+    """drop every built or overridden backend"""
+    with _lock:
+        _instances.clear()
+
+
+def get_vectorstore(persist_directory: str, collection_name: str):
+    """the vector store handle of a collection, opened once and reused by every search"""
+    key = f"vectorstore:{collection_name}"
+    vectorstore = _instances.get(key)
+    if vectorstore is None:
+        factory = get("vectorstore_factory")
+        with _lock:
+            vectorstore = _instances.get(key)
+            if vectorstore is None:
+                vectorstore = factory(persist_directory, collection_name)
+                _instances[key] = vectorstore
+    return vectorstore
+
+
+def get_chat_model(profile):
+    """the chat model of a model profile, built once and shared by every stage using the profile"""
+    key = f"chat_model:{profile.model_dump_json()}"
+    model = _instances.get(key)
+    if model is None:
+        factory = get("chat_model_factory")
+        with _lock:
+            model = _instances.get(key)
+            if model is None:
+                model = factory(profile)
+                _instances[key] = model
+    return model
@@ -1,8 +1,11 @@
 from pydantic import BaseModel, Field
 from typing_extensions import Literal
-from langchain_core.messages import HumanMessage, SystemMessage
-from langgraph.func import task
-from langchain_anthropic import ChatAnthropic
+from langchain_core.messages import HumanMessage
+from prompt_cache import system_message
+from tracing import traced_task, current_span
+import providers
+from governor import invoke
+from hedging import hedged_invoke
 
 class Feedback(BaseModel):
     thought: str = Field(
@@ -13,12 +16,7 @@ class Feedback(BaseModel):
     )
 
 
-@task
-def rating(llm, reference: str, query: str):
-    evaluator1 = llm.with_structured_output(Feedback)
-    evaluator2 = ChatAnthropic(model="claude-3-5-haiku-20241022").with_structured_output(Feedback)
-
-    content = """
+RATING_PROMPT = """
         As a manufacturing expert, your task is to evaluate if a reference matches a user's query about machining tools.
 
         Evaluation Rules:
@@ -41,22 +39,37 @@ def rating(llm, reference: str, query: str):
 
         Please provide a very brief explanation for your decision.
     """
+
+
+@traced_task
+def rating(llm, reference: str, query: str):
+    fallback = providers.get("rater_fallback")
     
-    def evaluate(evaluator, **kwargs):
-        return evaluator.invoke(
+    def evaluate(model, **kwargs):
+        # the static prompt first, so the ten ratings of a sub-query share the cached prefix
+        return invoke(model.with_structured_output(Feedback),
             [
-                SystemMessage(content=content),
+                system_message(model, RATING_PROMPT),
                 HumanMessage(content=f"Query: {query}\nReference: {reference}"),
             ],
+            model,
             **kwargs
         )
     
-    decision1 = evaluate(evaluator1)
+    # a slow first evaluation is hedged with the fallback model
+    decision1, answered_by = hedged_invoke("rating", evaluate, llm, fallback, with_model=True)
     
     if decision1.judge == "relevant":
+        current_span().set(relevant=True)
         return True ##  if the first evaluation result is "relevant", return True
         
+    # the fallback won the hedge: its "not relevant" already is the second opinion
+    if answered_by is fallback:
+        current_span().set(relevant=False)
+        return False
+
     # only run the second evaluation when the first evaluation result is "not relevant"
-    decision2 = evaluate(evaluator2)
+    decision2 = evaluate(fallback)
     
+    current_span().set(relevant=decision2.judge == "relevant")
     return decision2.judge == "relevant"
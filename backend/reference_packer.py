@@ -0,0 +1,211 @@
+"""
+Reference packing for the final recommendation prompt.
+
+The retrieved tool chunks carry their expanded tables, so two chunks pointing
+at the same __TABLEn__ repeat the whole table, and overlapping chunks repeat
+text. pack_references() turns the metal document and the tool references
+into one compact prompt block:
+
+  - the tables are split out of the chunks and kept once, after the first
+    (most relevant) chunk which references them
+  - chunks contained in an earlier chunk are dropped, overlapping starts trimmed
+  - whitespace is collapsed, HTML tables lose the whitespace between tags
+  - the block fits a token budget per model, measured with tiktoken; the
+    metal document keeps at most metal_share of it when the tool references
+    need the rest, the least relevant references are dropped first
+"""
+import os
+import re
+from functools import lru_cache
+from pydantic import BaseModel
+import snapshot
+from retriever import detect_table_markers, load_and_get_table
+
+# reference budget in tokens by model name prefix, RAG_REFERENCE_BUDGET overrides it
+REFERENCE_BUDGETS = {
+    "gpt-4o": 24000,
+    "gpt-4": 12000,
+    "claude": 24000,
+    "deepseek": 16000,
+}
+DEFAULT_BUDGET = 8000
+MIN_OVERLAP_CHARS = 40
+
+
+class PackedReferences(BaseModel):
+    text: str
+    # the metal block and the tool blocks of text, the metal block is the stable part across sub-queries
+    metal: str
+    tools: str
+    tokens: int
+    budget: int
+    tables: int
+    dropped: int
+    truncated: int
+    duplicate_tables: int
+    duplicate_chunks: int
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model_name: str):
+    """
+    the tiktoken encoding of a model (from the warm-start snapshot when it has it), None when
+    tiktoken or its files are not available
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        encoding_name = tiktoken.encoding_name_for_model(model_name)
+    except KeyError:
+        # not an OpenAI model (Claude, DeepSeek): close enough for budgeting
+        encoding_name = "cl100k_base"
+    try:
+        return snapshot.get_encoding(encoding_name) or tiktoken.get_encoding(encoding_name)
+    except Exception:
+        return None
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model_name: str) -> str:
+    """cut text to max_tokens, at the last line break when it is close to the cut"""
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        cut = text[:max_tokens * 4]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        cut = encoding.decode(tokens[:max_tokens])
+    if len(cut) >= len(text):
+        return text
+    newline = cut.rfind("\n")
+    if newline > len(cut) * 0.8:
+        cut = cut[:newline]
+    return cut.rstrip() + "\n[...]"
+
+
+def reference_budget(model_name: str) -> int:
+    if os.getenv("RAG_REFERENCE_BUDGET"):
+        return int(os.getenv("RAG_REFERENCE_BUDGET"))
+    name = (model_name or "").lower()
+    for prefix, budget in REFERENCE_BUDGETS.items():
+        if name.startswith(prefix):
+            return budget
+    return DEFAULT_BUDGET
+
+
+def compact(text: str) -> str:
+    """collapse the whitespace of a reference without touching its content"""
+    text = re.sub(r">\s+<", "><", text)
+    text = re.sub(r"[ \t]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    text = re.sub(r"\n{3,}", "\n\n", text)
+    return text.strip()
+
+
+def split_tables(reference: str):
+    """split a retrieved reference into its chunk text and {table_id: table}"""
+    tables = {}
+    chunk = reference
+    for table_id in detect_table_markers(reference):
+        if table_id in tables:
+            continue
+        try:
+            table = load_and_get_table(None, table_id)
+        except (ValueError, FileNotFoundError):
+            continue
+        if table:
+            tables[table_id] = table
+            chunk = chunk.replace(" " + table, "").replace(table, "")
+    return chunk, tables
+
+
+def trim_overlap(kept: list, chunk: str):
+    """None if chunk is contained in a kept chunk, otherwise chunk without the start it shares with one"""
+    for other in kept:
+        if chunk in other:
+            return None
+    for other in kept:
+        longest = min(len(other), len(chunk)) - 1
+        for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+            if other.endswith(chunk[:size]):
+                return chunk[size:].lstrip()
+    return chunk
+
+
+def pack_references(metal_doc, tool_refs, model_name: str, budget: int = None,
+                    metal_name: str = None, metal_share: float = 0.5) -> PackedReferences:
+    """dedupe, order and format the references of the final prompt within the token budget of the model"""
+    budget = budget or reference_budget(model_name)
+
+    # tool chunks in retrieval order, each followed by the tables it is the first to reference
+    blocks = []
+    kept_chunks = []
+    seen_tables = set()
+    duplicate_tables = duplicate_chunks = 0
+    for reference in tool_refs or []:
+        chunk, tables = split_tables(reference)
+        chunk = trim_overlap(kept_chunks, compact(chunk))
+        if not chunk:
+            duplicate_chunks += 1
+            continue
+        kept_chunks.append(chunk)
+        blocks.append(f"[Tool reference {len(kept_chunks)}]\n{chunk}")
+        for table_id, table in tables.items():
+            if table_id in seen_tables:
+                duplicate_tables += 1
+                continue
+            seen_tables.add(table_id)
+            blocks.append(f"[Table {table_id}]\n{compact(table)}")
+
+    block_tokens = [count_tokens(block, model_name) for block in blocks]
+    metal_block = None
+    truncated = 0
+    if metal_doc:
+        header = f"[Metal document{': ' + metal_name if metal_name else ''}]\n"
+        metal_text = compact(metal_doc)
+        tool_tokens = sum(block_tokens)
+        metal_budget = max(budget - tool_tokens, int(budget * metal_share)) - count_tokens(header, model_name)
+        if count_tokens(metal_text, model_name) > metal_budget:
+            metal_text = truncate_tokens(metal_text, metal_budget, model_name)
+            truncated += 1
+        metal_block = header + metal_text
+
+    # the least relevant tool references are dropped first
+    remaining = budget - (count_tokens(metal_block, model_name) if metal_block else 0)
+    packed = [metal_block] if metal_block else []
+    dropped = 0
+    for block, tokens in zip(blocks, block_tokens):
+        if tokens <= remaining:
+            packed.append(block)
+            remaining -= tokens
+        elif remaining > 200 and block.startswith("[Tool reference"):
+            packed.append(truncate_tokens(block, remaining, model_name))
+            truncated += 1
+            remaining = 0
+        else:
+            dropped += 1
+
+    text = "\n\n".join(packed)
+    return PackedReferences(
+        text=text,
+        metal=metal_block or "",
+        tools="\n\n".join(packed[1:] if metal_block else packed),
+        tokens=count_tokens(text, model_name),
+        budget=budget,
+        tables=sum(1 for block in packed if block.startswith("[Table")),
+        dropped=dropped,
+        truncated=truncated,
+        duplicate_tables=duplicate_tables,
+        duplicate_chunks=duplicate_chunks,
+    )
@@ -1,35 +1,160 @@
 import os
 import json
+import uuid
+import time
+import queue
+import atexit
+import threading
 from datetime import datetime
-from pydantic import BaseModel
+
+
+def to_jsonable(value):
+    """convert a step result into plain JSON types, pydantic models become dicts instead of repr strings"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if hasattr(value, "model_dump"):
+        return to_jsonable(value.model_dump())
+    if isinstance(value, dict):
+        return {str(k): to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, set)):
+        return [to_jsonable(v) for v in value]
+    if hasattr(value, "content"):
+        return to_jsonable(value.content)
+    return str(value)
+
+
+class JsonlWriter:
+    """
+    append-only JSONL writer shared by all the runs logging to the same directory.
+    write() only puts the record on a queue, a background thread serializes the
+    records, writes them in batches and rotates the file when it exceeds max_bytes.
+    """
+    _FLUSH = object()
+    _CLOSE = object()
+
+    def __init__(self, directory, max_bytes: int = 64 * 1024 * 1024, flush_interval: float = 1.0, batch_size: int = 512):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.path = None
+        self._file = None
+        self._queue = queue.SimpleQueue()
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name=f"jsonl-writer-{directory}", daemon=True)
+        self._thread.start()
+
+    def write(self, record: dict):
+        self._queue.put(record)
+
+    def flush(self, timeout: float = 10.0):
+        """block until every record written before this call is on disk"""
+        done = threading.Event()
+        self._queue.put((self._FLUSH, done))
+        done.wait(timeout)
+
+    def close(self, timeout: float = 10.0):
+        done = threading.Event()
+        self._queue.put((self._CLOSE, done))
+        done.wait(timeout)
+
+    def _open(self):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.path = os.path.join(self.directory, f"{timestamp}_{uuid.uuid4().hex[:8]}.jsonl")
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _write_batch(self, lines):
+        if not lines:
+            return
+        if self._file is None:
+            self._open()
+        self._file.write("".join(lines))
+        self._file.flush()
+        if self._file.tell() >= self.max_bytes:
+            self._file.close()
+            self._file = None
+
+    def _run(self):
+        lines = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, tuple) and item and item[0] in (self._FLUSH, self._CLOSE):
+                self._write_batch(lines)
+                lines = []
+                if item[0] is self._CLOSE and self._file is not None:
+                    self._file.close()
+                    self._file = None
+                item[1].set()
+                continue
+
+            if item is not None:
+                try:
+                    lines.append(json.dumps(item, ensure_ascii=False) + "\n")
+                except (TypeError, ValueError) as e:
+                    print(f"⚠️ warning: dropped an unserializable log record: {str(e)}")
+
+            if len(lines) >= self.batch_size or time.monotonic() >= deadline:
+                self._write_batch(lines)
+                lines = []
+                deadline = time.monotonic() + self.flush_interval
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(results_dir) -> JsonlWriter:
+    """the shared writer of a log directory"""
+    key = os.path.abspath(results_dir)
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = JsonlWriter(results_dir)
+        return _writers[key]
+
+
+@atexit.register
+def _close_writers():
+    for writer in list(_writers.values()):
+        writer.close()
+
 
 class ResultLogger:
     def __init__(self, results_dir, model):
-        """initialize the result logger"""
-        self.results = {
-            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
-            "model_info": {
-                "name": model.__class__.__name__,
-                "model_id": getattr(model, 'model', "unknown"),
-                "temperature": getattr(model, 'temperature', "unknown"),
-            }
-        }
+        """initialize the result logger, every step is streamed to the JSONL log of results_dir as it completes"""
+        self.run_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
         self.results_dir = results_dir
-        os.makedirs(self.results_dir, exist_ok=True)
+        self._writer = get_writer(results_dir)
+        self._seq = 0
+        self._log("run_start", {
+            "name": model.__class__.__name__,
+            "model_id": getattr(model, 'model_name', None) or getattr(model, 'model', "unknown"),
+            "temperature": getattr(model, 'temperature', "unknown"),
+        })
+
+    def _log(self, step_name, data):
+        self._seq += 1
+        self._writer.write({
+            "run_id": self.run_id,
+            "seq": self._seq,
+            "ts": time.time(),
+            "step": step_name,
+            "data": data,
+        })
 
     def add_result(self, step_name, result):
-        """add the results to the storage dictionary"""
-        if hasattr(result, "model_dump"):
-            self.results[step_name] = result.model_dump()
-        elif hasattr(result, "content"):
-            self.results[step_name] = result.content
-        else:
-            self.results[step_name] = str(result)
-        # print(f"✅ Added result for '{step_name}'")
+        """log the result of a step"""
+        self._log(step_name, to_jsonable(result))
+
+    def add_spans(self, spans):
+        """log the span tree of tracing.py (already a dict)"""
+        self._log("spans", spans)
 
     def save_results(self):
-        """保存所有结果到文件"""
-        filename = f"{self.results_dir}/{self.results['timestamp']}.json"
-        with open(filename, "w", encoding="utf-8") as file:
-            json.dump(self.results, file, ensure_ascii=False, indent=4)
-        print(f"\n💾 All results saved to: {filename}") 
\ No newline at end of file
+        """mark the end of the run, the records are already on their way to disk"""
+        self._log("run_end", None)
+        print(f"\n💾 Run {self.run_id} logged to: {self.results_dir}")
@@ -1,22 +1,47 @@
 import os
 import re
 import json
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from langchain_community.vectorstores import Chroma
-from langchain_openai import OpenAIEmbeddings
+from tracing import traced, current_span
+import providers
+from catalog import collection_for
+from governor import governor, estimate_tokens
+import snapshot
 
 load_dotenv()
 openai_api_key = os.getenv("OPENAI_API_KEY")
 
-def load_and_get_table(mapping_file, table_id):
-    # use os.path.join to build the path
-    mapping_file_path = os.path.join('backend', 'mappings', 'table_mappings.json')
-    
+# the collection searches of a query run side by side
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+
+TABLE_MAPPING_PATH = os.path.join('backend', 'mappings', 'table_mappings.json')
+_tables_lock = threading.Lock()
+_tables_cache = {"mtime": None, "tables": []}
+
+def read_tables(mapping_file_path=TABLE_MAPPING_PATH):
+    """the original tables by table id"""
     with open(mapping_file_path, 'r', encoding='utf-8') as f:
-        mappings = json.load(f)
+        return [mapping.get("original_table") for mapping in json.load(f)]
+
+def load_tables():
+    """the original tables (or their fresh snapshot), only re-read when the mapping file changed on disk"""
+    tables = snapshot.load("tables", TABLE_MAPPING_PATH)
+    if tables is not None:
+        return tables
+    mtime = os.path.getmtime(TABLE_MAPPING_PATH)
+    with _tables_lock:
+        if _tables_cache["mtime"] != mtime:
+            _tables_cache.update(mtime=mtime, tables=read_tables(TABLE_MAPPING_PATH))
+        return _tables_cache["tables"]
+
+def load_and_get_table(mapping_file, table_id):
+    tables = load_tables()
         
-    if 0 <= table_id < len(mappings):
-        return mappings[table_id].get("original_table")
+    if 0 <= table_id < len(tables):
+        return tables[table_id]
     else:
         raise ValueError(f"Table with id {table_id} not found")
         
@@ -29,26 +54,8 @@ def detect_table_markers(text):
     # convert the string numbers to int
     return [int(m) for m in markers]
 
-def similarity_search(query: str, 
-                     file_path: str,# same as the file_path in markdown2embedding.py
-                     mapping_file: str,
-                     top_k: int = 6):
-    
-    filename = os.path.splitext(os.path.basename(file_path))[0]
-    
-    # build the persistent directory and collection name
-    persist_directory = os.path.join("backend\VectorDBs", filename)
-    collection_name = f"rag-{filename}"
-
-    vectorstore = Chroma(
-        embedding_function=OpenAIEmbeddings(openai_api_key=openai_api_key),
-        persist_directory=persist_directory,
-        collection_name=collection_name,
-    )
-    print(f"🔹 VectorDB for {filename} loaded")
-    
-    results = vectorstore.similarity_search(query, k=top_k)
-    
+def expand_references(results, mapping_file):
+    """the texts of the retrieved documents, a chunk with table markers is followed by its original tables"""
     references = []
     
     print(f"🔹 Top {len(results)} most related chunks：")
@@ -76,6 +83,61 @@ def similarity_search(query: str,
     
     return references
 
+@traced("similarity_search")
+def similarity_search(query: str, 
+                     file_path: str,# same as the file_path in markdown2embedding.py
+                     mapping_file: str,
+                     top_k: int = 6):
+    
+    # build the persistent directory and collection name
+    persist_directory, collection_name = collection_for(file_path)
+
+    vectorstore = providers.get_vectorstore(persist_directory, collection_name)
+    print(f"🔹 VectorDB for {collection_name} loaded")
+    
+    # the query embedding is the provider call
+    results = governor.call("embeddings", vectorstore.similarity_search, query, k=top_k,
+                            tokens=estimate_tokens(query, output_tokens=0))
+    
+    return expand_references(results, mapping_file)
+
+def scored_search(vectorstore, embedding, k):
+    """(document, relevance in [0, 1], higher is closer) of the k nearest chunks of a collection"""
+    if hasattr(vectorstore, "similarity_search_by_vector_with_relevance_scores"):
+        # Chroma returns distances, normalized with the relevance function of its distance metric
+        relevance = vectorstore._select_relevance_score_fn()
+        return [(doc, relevance(distance)) for doc, distance in
+                vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k)]
+    # the in-memory store returns the cosine similarity
+    return vectorstore.similarity_search_with_score_by_vector(embedding, k=k)
+
+@traced("similarity_search")
+def search_collections(query: str, entries, mapping_file: str, top_k: int = 6):
+    """
+    search the catalog entries concurrently and merge them into a global top_k.
+    the query is embedded once, every collection is a local nearest neighbour search.
+    """
+    embedding = governor.call("embeddings", providers.get("embeddings").embed_query, query,
+                              tokens=estimate_tokens(query, output_tokens=0))
+
+    def search(entry):
+        vectorstore = providers.get_vectorstore(entry.persist_directory, entry.collection)
+        return scored_search(vectorstore, embedding, top_k)
+
+    if len(entries) == 1:
+        scored = search(entries[0])
+    else:
+        futures = [_executor.submit(contextvars.copy_context().run, search, entry) for entry in entries]
+        scored = [item for future in futures for item in future.result()]
+    # the same chunk can be ingested in two collections
+    merged = {}
+    for doc, score in sorted(scored, key=lambda item: -item[1]):
+        merged.setdefault(doc.page_content, doc)
+    results = list(merged.values())[:top_k]
+    current_span().set(collections=len(entries), candidates=len(scored))
+    print(f"🔹 Searched {len(entries)} collections: {', '.join(entry.collection for entry in entries)}")
+    return expand_references(results, mapping_file)
+
 # result = similarity_search(query="What's the cutting speed for D10?", 
 #                      file_path="washed_documents\Summurized_Diametal_Turning.md",
 #                      mapping_file=r"mappings\table_mappings.json",
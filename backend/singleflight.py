@@ -0,0 +1,119 @@
+"""
+Single-flight coalescing of identical work in flight.
+
+Operators often send near-identical questions within seconds, and
+rewrite_query often splits a query into duplicate sub-queries. SingleFlight.do(key, func)
+runs func for the first caller of a key; every caller arriving while it runs
+waits for the same future and gets its result (or its exception). Only work
+in flight is shared: a finished result is forgotten at once. Setting
+RAG_SINGLEFLIGHT_LINGER_MS opts into sharing it for that long after it
+finished as well (a short result cache, e.g. for the duplicate sub-queries of
+one request, which run one after the other).
+
+Two levels are coalesced:
+    "sub_query"  the whole router -> check -> retrieval -> rating -> answer chain,
+                 keyed on the normalized sub-query (RAG.py)
+    "answer"     retrieval, rating and answer, keyed on the catalogued
+                 (tool, metal, operation, parameter) of the Check (parameter_recommendator.py)
+
+RAG_SINGLEFLIGHT=0 disables the coalescing. flight_stats() returns the calls
+and the saved executions per level.
+"""
+import os
+import time
+import threading
+from concurrent.futures import Future
+
+LINGER_MS = float(os.getenv("RAG_SINGLEFLIGHT_LINGER_MS", "0"))
+
+
+def enabled() -> bool:
+    return os.getenv("RAG_SINGLEFLIGHT", "1") != "0"
+
+
+class SingleFlight:
+    def __init__(self, linger_ms: float = LINGER_MS):
+        self.linger_ms = linger_ms
+        # key -> (future, finished at or None while in flight)
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.executed = 0
+        self.shared = 0
+        self.lingered = 0
+        self.errors = 0
+
+    def _expire(self, now):
+        expired = [key for key, (_, finished_at) in self._calls.items()
+                   if finished_at is not None and (now - finished_at) * 1000 > self.linger_ms]
+        for key in expired:
+            del self._calls[key]
+
+    def do(self, key, func, *args, **kwargs):
+        """
+        func(*args, **kwargs), shared with the callers of the same key.
+        :return: (result, shared), shared is True when the result comes from another caller
+        """
+        if key is None or not enabled():
+            return func(*args, **kwargs), False
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self.calls += 1
+            entry = self._calls.get(key)
+            if entry is None:
+                future = Future()
+                self._calls[key] = (future, None)
+                self.executed += 1
+            else:
+                future, finished_at = entry
+                self.shared += 1
+                self.lingered += finished_at is not None
+        if entry is not None:
+            return future.result(), True
+
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            # a failure is only shared with the callers already waiting
+            with self._lock:
+                self.errors += 1
+                self._calls.pop(key, None)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if self.linger_ms > 0:
+                self._calls[key] = (future, time.monotonic())
+            else:
+                self._calls.pop(key, None)
+        future.set_result(result)
+        return result, False
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executed": self.executed,
+                "shared": self.shared,
+                "lingered": self.lingered,
+                "saved_rate": round(self.shared / self.calls, 3) if self.calls else 0.0,
+                "in_flight": sum(finished_at is None for _, finished_at in self._calls.values()),
+                "errors": self.errors,
+            }
+
+    def reset(self):
+        with self._lock:
+            self._calls.clear()
+            self.calls = self.executed = self.shared = self.lingered = self.errors = 0
+
+
+flights = {"sub_query": SingleFlight(), "answer": SingleFlight()}
+
+
+def flight_stats() -> dict:
+    return {name: flight.to_dict() for name, flight in flights.items()}
+
+
+def reset_flights():
+    for flight in flights.values():
+        flight.reset()
@@ -0,0 +1,364 @@
+"""
+Warm-start snapshot of the local lookup structures.
+
+A worker cold start parses the metal aliases (metal_mappings.json), the
+table mappings, the answer lookup, the collection catalog and the metal
+index, and loads the tiktoken encodings (downloaded on first use). `build`
+writes all of them, prepared, into one binary file which the workers map
+with mmap at startup. Every section is only decoded on first use, the
+arrays of the metal index are used in place (no copy).
+
+Layout of the file:
+
+    b"RAGSNAP\\0" | format version (uint32) | manifest length (uint32) | manifest (JSON) | blobs
+
+The manifest lists per section its blobs (offset, length, and dtype and
+shape for the arrays, JSON otherwise) and the source file it was built from
+with its size, mtime and SHA-256. A section is stale when its source
+changed: the size and the mtime are compared on every load, the hash only
+when they differ (a touched but unchanged file is still fresh). A stale or
+missing section is read from its source file as before, so an outdated
+snapshot is never wrong, only slower. The tokenizer sections are tied to
+the tiktoken version instead of a file. A decoded section is handed out
+without the lock or a stat; the snapshot file and the section sources are
+checked again at most every RAG_SNAPSHOT_CHECK_S seconds (default 1).
+
+The vector store handles are not part of the snapshot: Chroma opens its own
+sqlite and HNSW files.
+
+RAG_SNAPSHOT=0 disables the snapshot, RAG_SNAPSHOT_PATH moves it.
+
+Usage (from the project root):
+    python backend/snapshot.py build
+    python backend/snapshot.py check
+"""
+import os
+import sys
+import json
+import mmap
+import time
+import struct
+import hashlib
+import argparse
+import threading
+import numpy as np
+
+SNAPSHOT_PATH = os.getenv("RAG_SNAPSHOT_PATH", os.path.join("backend", "mappings", "warm_start.snapshot"))
+MAGIC = b"RAGSNAP\0"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sII")
+ALIGNMENT = 64
+# the encodings of the chat models (o200k_base) and of the embeddings and the other providers (cl100k_base)
+TOKENIZER_ENCODINGS = ["o200k_base", "cl100k_base"]
+CHECK_INTERVAL = float(os.getenv("RAG_SNAPSHOT_CHECK_S", "1"))
+
+_lock = threading.Lock()
+# the mapped file, its stat when it was mapped, the manifest, the decoded sections and the source verdicts;
+# sections: {name: (value or None when stale, snapshot path, source path, monotonic time of the check)}
+_state = {"path": None, "stat": None, "file": None, "map": None, "manifest": None, "sections": {}, "verdicts": {}}
+
+
+def enabled() -> bool:
+    return os.getenv("RAG_SNAPSHOT", "1") != "0"
+
+
+def file_stamp(path: str) -> dict:
+    stat = os.stat(path)
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha256.update(block)
+    return {"path": os.path.normpath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+            "sha256": sha256.hexdigest()}
+
+
+def tiktoken_version():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return f"tiktoken {getattr(tiktoken, '__version__', '?')}"
+
+
+################################################################################################################################
+# build
+
+def json_blob(value) -> dict:
+    return {"data": json.dumps(value, ensure_ascii=False).encode("utf-8")}
+
+
+def encoding_blobs(encoding) -> dict:
+    """the mergeable ranks as one bytes blob with its offsets, the pattern and the special tokens as JSON"""
+    tokens = sorted(encoding._mergeable_ranks.items(), key=lambda item: item[1])
+    offsets = np.zeros(len(tokens) + 1, dtype=np.uint32)
+    offsets[1:] = np.cumsum([len(token) for token, _ in tokens])
+    return {
+        "meta": json.dumps({"name": encoding.name, "pat_str": encoding._pat_str,
+                            "special_tokens": encoding._special_tokens}).encode("utf-8"),
+        "tokens": b"".join(token for token, _ in tokens),
+        "offsets": offsets,
+        "ranks": np.array([rank for _, rank in tokens], dtype=np.uint32),
+    }
+
+
+def collect_sections() -> dict:
+    """{name: (source file stamp or None, version stamp or None, {blob name: bytes or ndarray})} of the available sources"""
+    from answer_lookup import ANSWER_LOOKUP_PATH, read_answer_lookup
+    from catalog import CATALOG_PATH, read_catalog
+    from metal_extractor import METAL_MAPPING_PATH, read_metal_aliases
+    from metal_index import METAL_INDEX_PATH
+    from retriever import TABLE_MAPPING_PATH, read_tables
+
+    readers = {
+        "metal_aliases": (METAL_MAPPING_PATH, lambda path: json_blob(read_metal_aliases(path))),
+        "tables": (TABLE_MAPPING_PATH, lambda path: json_blob(read_tables(path))),
+        "answer_lookup": (ANSWER_LOOKUP_PATH, lambda path: json_blob(read_answer_lookup(path))),
+        "catalog": (CATALOG_PATH, lambda path: json_blob(read_catalog(path))),
+        "metal_index": (METAL_INDEX_PATH, index_blobs),
+    }
+    sections = {}
+    for name, (path, read) in readers.items():
+        if not os.path.exists(path):
+            print(f"⚠️ {name}: no {path}, skipped")
+            continue
+        # stamped before the read: a change in between makes the section stale, never wrong
+        sections[name] = (file_stamp(path), None, read(path))
+
+    stamp = tiktoken_version()
+    if stamp is not None:
+        import tiktoken
+        for encoding_name in TOKENIZER_ENCODINGS:
+            try:
+                encoding = tiktoken.get_encoding(encoding_name)
+            except Exception as e:
+                print(f"⚠️ tokenizer {encoding_name}: not available ({type(e).__name__}), skipped")
+                continue
+            sections[f"tokenizer:{encoding_name}"] = (None, stamp, encoding_blobs(encoding))
+    return sections
+
+
+def index_blobs(path) -> dict:
+    from metal_index import read_index
+    data = read_index(path)
+    return {
+        "meta": json.dumps({field: data[field] for field in ("names", "doc_paths", "aliases")},
+                           ensure_ascii=False).encode("utf-8"),
+        **{field: np.ascontiguousarray(data[field], dtype=np.float64) for field in ("raw", "mean", "std")},
+    }
+
+
+def build(path=SNAPSHOT_PATH) -> dict:
+    """write the snapshot of every available source atomically, return its manifest"""
+    sections = collect_sections()
+    manifest = {"version": FORMAT_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "sections": {}}
+    payloads = []
+    offset = 0
+    for name, (source, stamp, blobs) in sections.items():
+        entry = {"source": source, "stamp": stamp, "blobs": {}}
+        for blob_name, blob in blobs.items():
+            offset += -offset % ALIGNMENT
+            if isinstance(blob, np.ndarray):
+                data = blob.tobytes()
+                entry["blobs"][blob_name] = {"offset": offset, "length": len(data),
+                                             "dtype": blob.dtype.str, "shape": list(blob.shape)}
+            else:
+                data = blob
+                entry["blobs"][blob_name] = {"offset": offset, "length": len(data)}
+            payloads.append((offset, data))
+            offset += len(data)
+        manifest["sections"][name] = entry
+
+    # the blob offsets are relative to the first blob, which starts aligned after the manifest
+    manifest_bytes = json.dumps(manifest, ensure_ascii=False).encode("utf-8")
+    start = HEADER.size + len(manifest_bytes)
+    start += -start % ALIGNMENT
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(manifest_bytes)))
+        f.write(manifest_bytes)
+        for blob_offset, data in payloads:
+            f.seek(start + blob_offset)
+            f.write(data)
+        f.truncate(start + offset)
+    os.replace(tmp_path, path)
+    reset()
+    return manifest
+
+
+################################################################################################################################
+# load
+
+def _open(path):
+    """map the snapshot (again when the file was rebuilt), False when there is no usable snapshot"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return False
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    if _state["stat"] == key:
+        return _state["map"] is not None
+    _close()
+    _state["stat"] = key
+    if stat.st_size < HEADER.size:
+        return False
+    f = open(path, "rb")
+    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, manifest_length = HEADER.unpack_from(mapped, 0)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        print(f"⚠️ warning: {path} is not a snapshot of format {FORMAT_VERSION}, rebuild it")
+        mapped.close()
+        f.close()
+        return False
+    manifest = json.loads(mapped[HEADER.size:HEADER.size + manifest_length].decode("utf-8"))
+    start = HEADER.size + manifest_length
+    manifest["start"] = start + -start % ALIGNMENT
+    _state.update(path=path, file=f, map=mapped, manifest=manifest)
+    return True
+
+
+def _close():
+    if _state["map"] is not None:
+        try:
+            _state["map"].close()
+        except BufferError:
+            # arrays handed out still use the map, it is unmapped with the last of them
+            pass
+    if _state["file"] is not None:
+        _state["file"].close()
+    _state.update(path=None, stat=None, file=None, map=None, manifest=None, sections={}, verdicts={})
+
+
+def reset():
+    with _lock:
+        _close()
+
+
+def source_fresh(source: dict) -> bool:
+    """the source file is unchanged since the build; the hash is only computed when the size or the mtime differ"""
+    try:
+        stat = os.stat(source["path"])
+    except OSError:
+        return False
+    if stat.st_size == source["size"] and stat.st_mtime_ns == source["mtime_ns"]:
+        return True
+    key = (source["path"], stat.st_size, stat.st_mtime_ns)
+    if key not in _state["verdicts"]:
+        _state["verdicts"][key] = stat.st_size == source["size"] and file_stamp(source["path"])["sha256"] == source["sha256"]
+    return _state["verdicts"][key]
+
+
+def section_fresh(entry: dict) -> bool:
+    if entry["source"] is not None and not source_fresh(entry["source"]):
+        return False
+    return entry["stamp"] is None or entry["stamp"] == tiktoken_version()
+
+
+def _blob(entry: dict, blob_name: str):
+    blob = entry["blobs"][blob_name]
+    offset = _state["manifest"]["start"] + blob["offset"]
+    if "dtype" in blob:
+        return np.frombuffer(_state["map"], dtype=np.dtype(blob["dtype"]), count=int(np.prod(blob["shape"])),
+                             offset=offset).reshape(blob["shape"])
+    data = _state["map"][offset:offset + blob["length"]]
+    return data if blob_name == "tokens" else json.loads(data.decode("utf-8"))
+
+
+def load(name: str, source_path=None, convert=None, path=None):
+    """
+    the decoded section, None when it is not in the snapshot, stale or built from another source path.
+    :param convert: turns the blobs ({blob name: value}, the value itself for a single "data" blob) into the
+        object handed out, it is called once per mapping
+    """
+    if not enabled():
+        return None
+    path = path or SNAPSHOT_PATH
+    source_path = os.path.normpath(source_path) if source_path is not None else None
+    cached = _state["sections"].get(name)
+    if (cached is not None and cached[1] == path and source_path in (None, cached[2])
+            and time.monotonic() - cached[3] < CHECK_INTERVAL):
+        return cached[0]
+
+    with _lock:
+        if not _open(path):
+            return None
+        entry = _state["manifest"]["sections"].get(name)
+        if entry is None:
+            return None
+        source = entry["source"]["path"] if entry["source"] is not None else None
+        if source_path is not None and source != source_path:
+            return None
+        value = None
+        if section_fresh(entry):
+            cached = _state["sections"].get(name)
+            if cached is not None and cached[0] is not None:
+                value = cached[0]
+            else:
+                blobs = {blob_name: _blob(entry, blob_name) for blob_name in entry["blobs"]}
+                value = blobs["data"] if list(blobs) == ["data"] else blobs
+                value = convert(value) if convert else value
+        _state["sections"][name] = (value, path, source, time.monotonic())
+        return value
+
+
+def to_encoding(blobs: dict):
+    import tiktoken
+    meta = blobs["meta"]
+    tokens, offsets = blobs["tokens"], blobs["offsets"].tolist()
+    ranks = dict(zip((tokens[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)), blobs["ranks"].tolist()))
+    return tiktoken.Encoding(name=meta["name"], pat_str=meta["pat_str"], mergeable_ranks=ranks,
+                             special_tokens=meta["special_tokens"])
+
+
+def get_encoding(encoding_name: str):
+    """the tiktoken encoding from the snapshot, None when it is not there or built with another tiktoken"""
+    if tiktoken_version() is None:
+        return None
+    return load(f"tokenizer:{encoding_name}", convert=to_encoding)
+
+
+def status(path=SNAPSHOT_PATH) -> dict:
+    """{section: "fresh" | "stale"} of the snapshot, None without snapshot"""
+    with _lock:
+        if not _open(path):
+            return None
+        return {name: "fresh" if section_fresh(entry) else "stale"
+                for name, entry in _state["manifest"]["sections"].items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm-start snapshot of the local lookup structures.")
+    parser.add_argument("command", choices=["build", "check"])
+    parser.add_argument("--path", default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        manifest = build(args.path)
+        size = os.path.getsize(args.path)
+        print(f"💾 {len(manifest['sections'])} sections ({size / 1e6:.2f} MB) written to: {args.path} "
+              f"in {time.perf_counter() - start:.2f} s")
+        for name, entry in manifest["sections"].items():
+            print(f"   {name:<24} {entry['source']['path'] if entry['source'] else entry['stamp']}")
+        return
+
+    sections = status(args.path)
+    if sections is None:
+        print(f"⚠️ no snapshot at: {args.path}")
+        sys.exit(1)
+    for name, verdict in sections.items():
+        # the time to decode the section from the map
+        start = time.perf_counter()
+        if verdict == "fresh":
+            with _lock:
+                entry = _state["manifest"]["sections"][name]
+                for blob_name in entry["blobs"]:
+                    _blob(entry, blob_name)
+        print(f"   {name:<24} {verdict:<6} {(time.perf_counter() - start) * 1000:8.2f} ms")
+    if "stale" in sections.values():
+        print("⚠️ stale sections are read from their sources, run: python backend/snapshot.py build")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
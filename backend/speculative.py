@@ -0,0 +1,66 @@
+"""
+Speculative work started before it is known to be needed.
+
+The tool retrieval of a sub-query only depends on its text, so RAG starts it
+as soon as the rewritten queries exist, while the router and factors_check
+are still waiting for the LLM. tool_search() takes the running retrieval
+instead of starting its own; if the router picks another path the result is
+discarded (or the retrieval cancelled if it has not started yet).
+
+The work runs in a small thread pool with a copy of the caller's context, so
+its spans are recorded under the span which started it.
+
+RAG_SPECULATIVE=0 disables the speculation (tool_search then retrieves inline).
+"""
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Speculation:
+    def __init__(self, max_workers: int = 4, max_pending: int = 64):
+        self.enabled = os.getenv("RAG_SPECULATIVE", "1") != "0"
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="speculative")
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.used = 0
+        self.discarded = 0
+
+    def start(self, key, func, *args, **kwargs):
+        """run func(*args, **kwargs) in the background unless the same key is already running"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return
+            context = contextvars.copy_context()
+            self._pending[key] = self._executor.submit(context.run, func, *args, **kwargs)
+            self.started += 1
+
+    def take(self, key):
+        """the future of the speculative work of key, None if there is none"""
+        with self._lock:
+            future = self._pending.pop(key, None)
+            if future is not None:
+                self.used += 1
+            return future
+
+    def discard(self, key):
+        """drop the speculative work of key if nobody took it"""
+        with self._lock:
+            future = self._pending.pop(key, None)
+            if future is None:
+                return
+            self.discarded += 1
+        future.cancel()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"started": self.started, "used": self.used, "discarded": self.discarded,
+                    "pending": len(self._pending)}
+
+
+speculation = Speculation()
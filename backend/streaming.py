@@ -0,0 +1,68 @@
+"""
+Incremental output of the pipeline through the langgraph "custom" stream mode.
+
+    for mode, event in RAG.stream(query, config, stream_mode=["custom", "updates"]):
+        ...
+
+The custom events are dicts with an "event" key:
+    {"event": "sub_query", "query": ...}                         a sub-query starts
+    {"event": "answer_delta", "query": ..., "field": ..., "delta": ...}
+                                                                 new text of a field of the answer
+    {"event": "answer", "query": ..., "answer": {...}}           the complete answer
+
+RAG.invoke() runs the same code, the events are then simply dropped.
+"""
+import time
+from langgraph.config import get_stream_writer
+from tracing import current_span
+from governor import governor, provider_of, estimate_tokens
+from hedging import hedged_stream
+
+
+def stream_writer():
+    """the custom stream writer of the running entrypoint, a no-op outside of one"""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda chunk: None
+
+
+def emit(event: str, **fields):
+    stream_writer()({"event": event, **fields})
+
+
+def stream_structured(llm, schema, messages, secondary=None, **event_fields):
+    """
+    invoke llm with the structured output schema while streaming the text of its fields.
+    the schema is passed as JSON schema, so the output parsers yield partial dicts
+    instead of waiting for a complete (valid) object; the result is validated at the end.
+    messages is a list, or a function of the model returning it; with a secondary model
+    the stream is hedged (hedging.py) under the stage name of the schema in lower case.
+    the time to the first streamed field is recorded on the current span as first_token_ms.
+    """
+    def stream(model):
+        prompt = messages(model) if callable(messages) else messages
+        structured = model.with_structured_output(schema.model_json_schema())
+        return governor.stream(provider_of(model), structured.stream, prompt, tokens=estimate_tokens(prompt))
+
+    writer = stream_writer()
+    start = time.perf_counter()
+    final = {}
+    for partial in hedged_stream(schema.__name__.lower(), stream, llm, secondary):
+        if not isinstance(partial, dict) or not partial:
+            continue
+        if not final:
+            sp = current_span()
+            if sp is not None:
+                sp.set(first_token_ms=round((time.perf_counter() - start) * 1000, 3))
+        for field, value in partial.items():
+            if not isinstance(value, str):
+                continue
+            before = final.get(field)
+            before = before if isinstance(before, str) else ""
+            if value.startswith(before) and len(value) > len(before):
+                writer({"event": "answer_delta", **event_fields, "field": field, "delta": value[len(before):]})
+        final = partial
+    result = schema.model_validate(final)
+    writer({"event": "answer", **event_fields, "answer": result.model_dump()})
+    return result
@@ -0,0 +1,243 @@
+"""
+Benchmark of the model tier assignments of model_tiers.json.
+
+Runs the logged queries through the current stage assignment (the baseline)
+and through each alternative, and reports per assignment the end-to-end
+latency, the LLM cost per query and the agreement with the baseline: the
+ranges of the answers compared numerically (overlap / union of the ranges,
+per questioned parameter) and the routes of the sub-queries compared exactly.
+
+The cost prices the token usage of every stage span with the model of the
+stage (MODEL_PRICES); the tokens outside the stage spans are the online
+search summary. Hedging and the coalescing of identical queries are off
+during the benchmark so every stage only uses its own model.
+
+With --fake the models are the fakes of fakes.py in the benchmark.py
+workspace, the latency of a profile scaled by FAKE_SPEED, to check an
+assignment offline; only real models give meaningful agreement numbers.
+
+Usage (from the project root):
+    python backend/tier_benchmark.py --queries "rag_logs/*.jsonl"
+    python backend/tier_benchmark.py --alternatives fast-control haiku-rating --repeat 2 --output tiers.json
+    python backend/tier_benchmark.py --fake --llm-latency-ms 300
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import tempfile
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+import benchmark
+import model_tiers
+from cost_engine import parse_range
+from providers import model_name_of
+
+# USD per 1M tokens: input, cached input, output; matched on the longest model name prefix
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "claude-3-7-sonnet": (3.0, 0.3, 15.0),
+    "claude-3-5-haiku": (0.8, 0.08, 4.0),
+    "deepseek-chat": (0.27, 0.07, 1.1),
+}
+# latency of a fake model relative to --llm-latency-ms, by model name part
+FAKE_SPEED = {"mini": 0.35, "haiku": 0.45, "deepseek": 1.3}
+FAKE_DEFAULT_MODEL = "gpt-4o-2024-08-06"
+ANSWER_FIELDS = ("tool_range", "metal_range", "combined_range")
+
+
+def price_of(model_name: str):
+    matches = [prefix for prefix in MODEL_PRICES if model_name.startswith(prefix)]
+    return MODEL_PRICES[max(matches, key=len)] if matches else None
+
+
+def span_cost(span, model_name: str) -> float:
+    price = price_of(model_name)
+    if price is None:
+        return 0.0
+    uncached = span.input_tokens - span.cache_read_tokens
+    return (uncached * price[0] + span.cache_read_tokens * price[1] + span.output_tokens * price[2]) / 1e6
+
+
+def range_agreement(a, b) -> float:
+    """1 for the same range, the overlap / union of numeric ranges, else whether the texts match"""
+    ra, rb = parse_range(a), parse_range(b)
+    if ra is None or rb is None:
+        return float(" ".join(str(a).lower().split()) == " ".join(str(b).lower().split()))
+    union = max(ra[1], rb[1]) - min(ra[0], rb[0])
+    if union == 0:
+        return 1.0
+    return max(0.0, min(ra[1], rb[1]) - max(ra[0], rb[0])) / union
+
+
+def answer_agreement(baseline: dict, answers: dict) -> float:
+    """mean agreement over the questioned parameters of both runs, a missing answer counts 0"""
+    parameters = set(baseline) | set(answers)
+    if not parameters:
+        return 1.0
+    scores = []
+    for parameter in parameters:
+        if parameter not in baseline or parameter not in answers:
+            scores.append(0.0)
+            continue
+        scores.append(sum(range_agreement(baseline[parameter].get(field), answers[parameter].get(field))
+                          for field in ANSWER_FIELDS) / len(ANSWER_FIELDS))
+    return sum(scores) / len(scores)
+
+
+def route_agreement(baseline: list, routes: list) -> float:
+    if not baseline and not routes:
+        return 1.0
+    return sum(a == b for a, b in zip(baseline, routes)) / max(len(baseline), len(routes))
+
+
+def run_query(RAG, query):
+    """latency ms and {questioned parameter: answer} of one RAG run, from its streamed answer events"""
+    answers = {}
+    start = time.perf_counter()
+    config = {"configurable": {"thread_id": str(uuid.uuid4())}}
+    for _, event in RAG.RAG.stream(query, config, stream_mode=["custom"]):
+        if event.get("event") == "answer":
+            answer = event["answer"]
+            answers[" ".join(str(answer.get("questioned_parameter")).lower().split())] = answer
+    return (time.perf_counter() - start) * 1000, answers
+
+
+def run_assignment(RAG, name, stages, queries, collector, args):
+    """run the queries with the stage assignment, the results by query"""
+    model_tiers.set_assignment(stages)
+    collector.spans.clear()
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    with contextlib.redirect_stdout(output), ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(lambda query: run_query(RAG, query), queries))
+
+    default_model = model_name_of(RAG.get_llm())
+    runs = {}
+    for query, (latency_ms, answers) in zip(queries, results):
+        runs.setdefault(query, {"latency_ms": [], "answers": answers, "routes": None, "cost": [], "tokens": []})
+        runs[query]["latency_ms"].append(latency_ms)
+    stage_ms = {}
+    for root in collector.spans:
+        run = runs.get(root.attributes.get("query"))
+        if run is None:
+            continue
+        spans = list(benchmark.walk(root))
+        cost = 0.0
+        for span in spans:
+            stage = span.name if span.name in model_tiers.STAGES else "online_search"
+            profile = model_tiers.profile_for(stage)
+            cost += span_cost(span, profile.model if profile else default_model)
+            if span.name in model_tiers.STAGES:
+                stage_ms.setdefault(span.name, []).append(span.wall_ms)
+        run["cost"].append(cost)
+        run["tokens"].append(sum(span.input_tokens + span.output_tokens for span in spans))
+        if run["routes"] is None:
+            run["routes"] = [span.attributes.get("route") for span in spans if span.name == "llm_call_router"]
+    model_tiers.set_assignment(None)
+    return {"name": name, "stages": stages, "runs": runs, "stage_ms": stage_ms}
+
+
+def summarize(result, baseline):
+    latencies = [ms for run in result["runs"].values() for ms in run["latency_ms"]]
+    costs = [cost for run in result["runs"].values() for cost in run["cost"]]
+    tokens = [count for run in result["runs"].values() for count in run["tokens"]]
+    answers = [answer_agreement(baseline["runs"][query]["answers"], run["answers"])
+               for query, run in result["runs"].items()]
+    routes = [route_agreement(baseline["runs"][query]["routes"] or [], run["routes"] or [])
+              for query, run in result["runs"].items()]
+    return {
+        "name": result["name"],
+        "stages": result["stages"],
+        "runs": len(latencies),
+        "latency_ms": {f"p{p}": round(benchmark.percentile(latencies, p), 3) for p in (50, 95)},
+        "cost_per_query_usd": round(sum(costs) / len(costs), 6) if costs else 0.0,
+        "tokens_per_query": round(sum(tokens) / len(tokens), 1) if tokens else 0,
+        "answer_agreement": round(sum(answers) / len(answers), 3) if answers else None,
+        "route_agreement": round(sum(routes) / len(routes), 3) if routes else None,
+        "stage_p50_ms": {stage: round(benchmark.percentile(values, 50), 3)
+                         for stage, values in sorted(result["stage_ms"].items())},
+    }
+
+
+def install_fake_models(args):
+    """fakes of benchmark.py, and a fake model per profile"""
+    import providers
+    from fakes import FakeChatModel, LatencyModel
+    RAG = benchmark.install_fakes(args)
+
+    def build(model_name):
+        speed = next((factor for part, factor in FAKE_SPEED.items() if part in model_name), 1.0)
+        latency = LatencyModel(args.llm_latency_ms * speed, kind=args.latency_kind, sigma=args.llm_sigma, seed=args.seed)
+        return FakeChatModel(model_name, latency, accept_rate=args.accept_rate, seed=args.seed)
+
+    providers.override("chat_model_factory", lambda profile: build(profile.model))
+    RAG.llm = build(FAKE_DEFAULT_MODEL)
+    return RAG
+
+
+def run_tiers(args):
+    config = model_tiers.load_config()
+    names = args.alternatives or list(config.alternatives)
+    unknown = [name for name in names if name not in config.alternatives]
+    if unknown:
+        raise SystemExit(f"unknown alternatives {unknown}, model_tiers.json has {list(config.alternatives)}")
+    queries = (benchmark.load_queries(args.queries) or benchmark.DEFAULT_QUERIES) * args.repeat
+    # every stage only uses its own model, and every assignment runs every query itself
+    os.environ["RAG_HEDGE"] = "0"
+    os.environ["RAG_SINGLEFLIGHT"] = "0"
+
+    if args.fake:
+        workspace = tempfile.mkdtemp(prefix="rag-tiers-")
+        benchmark.create_workspace(workspace)
+        os.chdir(workspace)
+        RAG = install_fake_models(args)
+    else:
+        import RAG
+
+    import tracing
+    collector = benchmark.SpanCollector()
+    tracing.add_exporter(collector)
+
+    baseline = run_assignment(RAG, "baseline", dict(config.stages), queries, collector, args)
+    results = [baseline] + [
+        run_assignment(RAG, name, {**config.stages, **config.alternatives[name]}, queries, collector, args)
+        for name in names
+    ]
+    return [summarize(result, baseline) for result in results]
+
+
+def print_report(summaries):
+    print(f"\n{'assignment':<24}{'runs':>6}{'p50 ms':>10}{'p95 ms':>10}{'$/query':>11}{'tokens':>9}{'answers':>9}{'routes':>8}")
+    for summary in summaries:
+        print(f"{summary['name']:<24}{summary['runs']:>6}{summary['latency_ms']['p50']:>10.1f}"
+              f"{summary['latency_ms']['p95']:>10.1f}{summary['cost_per_query_usd']:>11.5f}"
+              f"{summary['tokens_per_query']:>9.0f}{summary['answer_agreement']:>9.1%}{summary['route_agreement']:>8.1%}")
+    for summary in summaries[1:]:
+        print(f"\n🔹 {summary['name']}: {summary['stages']}")
+        print(f"   stage p50 ms: {summary['stage_p50_ms']}")
+
+
+def main():
+    parser = benchmark.build_parser()
+    parser.description = "Compare the model tier assignments of model_tiers.json with the current one."
+    parser.add_argument("--alternatives", nargs="+", default=None, help="default: every alternative of the file")
+    parser.add_argument("--tiers", default=model_tiers.TIERS_PATH, help="the tier configuration file")
+    parser.add_argument("--fake", action="store_true", help="fake models and backends, no network access")
+    args = parser.parse_args()
+    # resolve the paths before a --fake run moves into its workspace
+    args.queries = [os.path.abspath(pattern) for pattern in args.queries]
+    model_tiers.TIERS_PATH = os.path.abspath(args.tiers)
+    output = os.path.abspath(args.output) if args.output else None
+
+    summaries = run_tiers(args)
+    print_report(summaries)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(summaries, f, indent=4)
+        print(f"\n💾 Report saved to: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,38 @@
-from retriever import similarity_search
+import os
+from retriever import search_collections
+from catalog import DEFAULT_DOCUMENT, select
 from rater import rating
+from speculative import speculation
+from tracing import current_span
+
+TOOL_DOCUMENT = DEFAULT_DOCUMENT
+TABLE_MAPPING = os.path.join("backend", "mappings", "table_mappings.json")
+
+def retrieve_tool_chunks(query, top_k=5, tool=None, operation=None):
+    """the global top_k chunks of the catalog collections matching the tool and operation (read from the query unless given)"""
+    return search_collections(query=query,
+                    entries=select(query, tool, operation),
+                    mapping_file=TABLE_MAPPING,
+                    top_k=top_k)
+
+def prefetch_tool_chunks(query):
+    """start the retrieval of the tool chunks before the query is routed"""
+    speculation.start(("tool_chunks", query), retrieve_tool_chunks, query)
+
+def discard_tool_chunks(query):
+    speculation.discard(("tool_chunks", query))
 
 def tool_search(llm,query):
     filtered_reference = []
-    result = similarity_search(query=query, 
-                    file_path="backend\washed_documents\Summurized_Diametal_Turning.md",
-                    mapping_file="backend\mappings\table_mappings.json",
-                    top_k=5)
-    for i, each in enumerate(result):
-        feedback = rating(llm,each,query).result()
-        if feedback:
+    # reuse the speculative retrieval of the query if RAG started one
+    prefetched = speculation.take(("tool_chunks", query))
+    result = prefetched.result() if prefetched else retrieve_tool_chunks(query)
+    if current_span() is not None:
+        current_span().set(speculative_retrieval=prefetched is not None)
+    # all chunks are rated concurrently, the verdicts are read in retrieval order
+    feedbacks = [rating(llm,each,query) for each in result]
+    for i, (each, feedback) in enumerate(zip(result, feedbacks)):
+        if feedback.result():
             print(f"Chunk {i+1}: ✅ ")
             filtered_reference.append(each)
         else:
@@ -18,4 +41,3 @@ def tool_search(llm,query):
         return filtered_reference
     else:
         return None
-
@@ -0,0 +1,244 @@
+"""
+Stage-level spans for the RAG pipeline.
+
+A span records the wall time of a stage, the time it waited in the task queue
+before it started, the LLM tokens spent inside it (and how many of the input
+tokens were read from the provider's prompt cache) and the local cache hits.
+Spans opened inside another span (also in langgraph tasks, which copy the
+context of the caller) are nested under it, so one RAG call gives one tree:
+
+    rag
+    ├── rewrite_query
+    └── sub_query
+        ├── llm_call_router
+        ├── factors_check
+        ├── fuzzy_match_metal
+        ├── similarity_search
+        ├── rating (x N)
+        └── answer
+
+When a root span ends it is passed to the registered exporters.
+"""
+import os
+import time
+import uuid
+import functools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from langgraph.func import task
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers.context import register_configure_hook
+
+_current_span = ContextVar("current_span", default=None)
+_submitted_at = ContextVar("submitted_at", default=None)
+_exporters = []
+
+
+class Span:
+    def __init__(self, name: str, parent=None, attributes=None, queued_at=None):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.start_time = time.time()
+        self.end_time = None
+        self._start = time.perf_counter()
+        self.wall_ms = None
+        self.wait_ms = (self._start - queued_at) * 1000 if queued_at else 0.0
+        self.llm_calls = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.cache_read_tokens = 0
+        self.cache_write_tokens = 0
+        self.cache_hits = 0
+        self.status = "ok"
+        self._lock = threading.Lock()
+
+    def set(self, **attributes):
+        """add attributes to the span, e.g. span.set(route="online_search")"""
+        with self._lock:
+            self.attributes.update(attributes)
+
+    def add_child(self, span):
+        with self._lock:
+            self.children.append(span)
+
+    def add_usage(self, input_tokens: int = 0, output_tokens: int = 0,
+                  cache_read_tokens: int = 0, cache_write_tokens: int = 0):
+        """count an LLM call, cache_read_tokens/cache_write_tokens are the part of input_tokens served from/written to the prompt cache"""
+        with self._lock:
+            self.llm_calls += 1
+            self.input_tokens += input_tokens
+            self.output_tokens += output_tokens
+            self.cache_read_tokens += cache_read_tokens
+            self.cache_write_tokens += cache_write_tokens
+
+    def add_cache_hit(self, n: int = 1):
+        with self._lock:
+            self.cache_hits += n
+
+    def finish(self):
+        self.end_time = time.time()
+        self.wall_ms = (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "wall_ms": round(self.wall_ms, 3) if self.wall_ms is not None else None,
+            "wait_ms": round(self.wait_ms, 3),
+            "llm_calls": self.llm_calls,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cache_read_tokens": self.cache_read_tokens,
+            "cache_write_tokens": self.cache_write_tokens,
+            "cache_hits": self.cache_hits,
+            "status": self.status,
+            "attributes": self.attributes,
+            "children": [child.to_dict() for child in self.children],
+        }
+
+
+def current_span():
+    """the innermost open span, None outside of any span"""
+    return _current_span.get()
+
+
+def record_cache_hit(n: int = 1):
+    """count a local cache hit on the current span"""
+    span = _current_span.get()
+    if span is not None:
+        span.add_cache_hit(n)
+
+
+def add_exporter(exporter):
+    """register an exporter, exporter.export(span) is called with every finished root span"""
+    _exporters.append(exporter)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    parent = _current_span.get()
+    sp = Span(name, parent, attributes, queued_at=_submitted_at.get())
+    if parent is not None:
+        parent.add_child(sp)
+    span_token = _current_span.set(sp)
+    # the queue time belongs to this span only, not to the spans opened inside it
+    submitted_token = _submitted_at.set(None)
+    try:
+        yield sp
+    except Exception as e:
+        sp.status = "error"
+        sp.set(error=str(e))
+        raise
+    finally:
+        sp.finish()
+        _submitted_at.reset(submitted_token)
+        _current_span.reset(span_token)
+        if parent is None:
+            for exporter in _exporters:
+                try:
+                    exporter.export(sp)
+                except Exception as e:
+                    print(f"⚠️ warning: span exporter {exporter.__class__.__name__} failed: {str(e)}")
+
+
+def traced(name: str):
+    """decorator, run the function inside a span"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_task(func):
+    """
+    drop-in replacement of @task which runs the task inside a span named after the function.
+    the time between the call and the start of the task is recorded as the queue time.
+    """
+    task_func = task(traced(func.__name__)(func))
+
+    @functools.wraps(func)
+    def submit(*args, **kwargs):
+        token = _submitted_at.set(time.perf_counter())
+        try:
+            return task_func(*args, **kwargs)
+        finally:
+            _submitted_at.reset(token)
+    return submit
+
+
+def usage_of(response):
+    """(input, output, cache read, cache write) tokens of an LLMResult, from the usage metadata or the OpenAI token usage"""
+    input_tokens = output_tokens = cache_read = cache_write = 0
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+            input_tokens += usage.get("input_tokens", 0)
+            output_tokens += usage.get("output_tokens", 0)
+            details = usage.get("input_token_details") or {}
+            cache_read += details.get("cache_read") or 0
+            cache_write += details.get("cache_creation") or 0
+    if not (input_tokens or output_tokens):
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        input_tokens = token_usage.get("prompt_tokens", 0)
+        output_tokens = token_usage.get("completion_tokens", 0)
+        cache_read = (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+    return input_tokens, output_tokens, cache_read, cache_write
+
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """LangChain callback which adds the token usage of every LLM call to the current span"""
+
+    def on_llm_end(self, response, **kwargs):
+        sp = _current_span.get()
+        if sp is None:
+            return
+        sp.add_usage(*usage_of(response))
+
+
+# the handler is attached to every LangChain call of the process
+_usage_handler_var = ContextVar("span_token_usage_handler", default=TokenUsageHandler())
+register_configure_hook(_usage_handler_var, inheritable=True)
+
+
+class OpenTelemetryExporter:
+    """
+    replay the finished span trees into OpenTelemetry, with their original timestamps.
+    needs the opentelemetry-api package (and an SDK with an exporter configured to see anything).
+    """
+    def __init__(self, tracer_name: str = "llm4manufacturing"):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer(tracer_name)
+
+    def export(self, sp: Span, parent=None):
+        context = self._trace.set_span_in_context(parent) if parent is not None else None
+        otel_span = self._tracer.start_span(sp.name, context=context, start_time=int(sp.start_time * 1e9))
+        otel_span.set_attributes({
+            "wall_ms": sp.wall_ms or 0.0,
+            "wait_ms": sp.wait_ms,
+            "llm_calls": sp.llm_calls,
+            "input_tokens": sp.input_tokens,
+            "output_tokens": sp.output_tokens,
+            "cache_read_tokens": sp.cache_read_tokens,
+            "cache_write_tokens": sp.cache_write_tokens,
+            "cache_hits": sp.cache_hits,
+            "status": sp.status,
+            **{k: str(v) for k, v in sp.attributes.items()},
+        })
+        for child in sp.children:
+            self.export(child, otel_span)
+        otel_span.end(end_time=int((sp.end_time or time.time()) * 1e9))
+
+
+if os.getenv("RAG_OTEL_EXPORT"):
+    add_exporter(OpenTelemetryExporter())